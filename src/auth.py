@@ -1,56 +1,361 @@
 # src/auth.py
+# Verificación de contraseñas.
+# bcrypt.checkpw corre en un pool de procesos acotado (AUTH_WORKERS), así una
+# ráfaga de logins (un curso entero al inicio de la clase) no ocupa la CPU ni
+# los hilos que atienden el chat. Con más de AUTH_MAX_PENDING verificaciones en
+# curso, las siguientes esperan hasta AUTH_QUEUE_TIMEOUT y se rechazan como
+# "ocupado". Los intentos fallidos se limitan por usuario y por IP antes de
+# gastar CPU en bcrypt. Si el costo del hash guardado no es BCRYPT_ROUNDS, la
+# contraseña se rehashea al iniciar sesión.
+# Los handlers de Gradio usan averify, que espera al pool desde el event loop:
+# un login en curso no retiene uno de los hilos con los que Gradio corre el chat.
+#
+#   uv run python src/bench_login.py --logins 100
+import asyncio
+import logging
+import math
+import multiprocessing
 import os
 import sqlite3
+import threading
+import time
 import bcrypt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, TypeVar, Union
+
+from metrics import AUTH_REHASHES, AUTH_SECONDS, AUTH_THROTTLED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
 
 # Ruta a la base de datos, definida por variable de entorno o por defecto 'app.db'
 DB_PATH = Path(os.getenv("APP_DB_PATH", "app.db"))
 
+# Costo de bcrypt para contraseñas nuevas y rehash (12 = default de bcrypt)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Procesos para bcrypt; 0 = en el hilo que llama. Con varios workers (serve.py)
+# el default reparte la mitad de las CPUs entre ellos.
+_WORKER_COUNT = max(1, int(os.getenv("WORKER_COUNT", "1")))
+AUTH_WORKERS = int(
+    os.getenv("AUTH_WORKERS", str(max(1, (os.cpu_count() or 2) // (2 * _WORKER_COUNT))))
+)
+AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", "64"))
+AUTH_QUEUE_TIMEOUT = float(os.getenv("AUTH_QUEUE_TIMEOUT", "10"))
+
+# Fallos tolerados por ventana antes de bloquear. Por IP el límite es mayor:
+# un aula entera puede salir por la misma IP.
+AUTH_MAX_FAILURES_USER = int(os.getenv("AUTH_MAX_FAILURES_USER", "5"))
+AUTH_MAX_FAILURES_IP = int(os.getenv("AUTH_MAX_FAILURES_IP", "50"))
+AUTH_FAILURE_WINDOW = float(os.getenv("AUTH_FAILURE_WINDOW", "300"))
+# Primer bloqueo; se duplica en cada reincidencia hasta AUTH_LOCKOUT_MAX
+AUTH_LOCKOUT = float(os.getenv("AUTH_LOCKOUT", "30"))
+AUTH_LOCKOUT_MAX = float(os.getenv("AUTH_LOCKOUT_MAX", "900"))
+# Claves que se recuerdan como máximo (usuarios inventados no llenan la memoria)
+THROTTLE_MAX_KEYS = 10_000
+
+INVALID = "Usuario o contraseña inválidos."
+BUSY = "El servicio está ocupado. Intenta de nuevo en unos segundos."
+
+
+class AuthBusyError(RuntimeError):
+    """No hubo lugar en el pool de verificación dentro de AUTH_QUEUE_TIMEOUT."""
+
+
+class LoginThrottle:
+    """Fallos recientes por clave; al llegar al límite, bloqueo creciente."""
+
+    def __init__(
+        self,
+        max_failures: int,
+        window: float = AUTH_FAILURE_WINDOW,
+        lockout: float = AUTH_LOCKOUT,
+        lockout_max: float = AUTH_LOCKOUT_MAX,
+    ):
+        self.max_failures = max_failures
+        self.window = window
+        self.lockout = lockout
+        self.lockout_max = lockout_max
+        self._failures: Dict[str, Deque[float]] = {}
+        # clave -> (bloqueada hasta, bloqueos previos)
+        self._locked: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def retry_in(self, key: str) -> float:
+        """Segundos que faltan para poder intentar de nuevo (0 si no está bloqueada)."""
+        with self._lock:
+            until, _ = self._locked.get(key, (0.0, 0))
+        return max(0.0, until - time.monotonic())
+
+    def failure(self, key: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._failures and len(self._failures) >= THROTTLE_MAX_KEYS:
+                self._prune(now)
+            failures = self._failures.setdefault(key, deque())
+            failures.append(now)
+            while failures[0] < now - self.window:
+                failures.popleft()
+            if len(failures) >= self.max_failures:
+                _, strikes = self._locked.get(key, (0.0, 0))
+                pause = min(self.lockout * 2**strikes, self.lockout_max)
+                self._locked[key] = (now + pause, strikes + 1)
+                failures.clear()
+
+    def success(self, key: str) -> None:
+        with self._lock:
+            self._failures.pop(key, None)
+            self._locked.pop(key, None)
+
+    def _prune(self, now: float) -> None:
+        for key in [k for k, f in self._failures.items() if not f or f[-1] < now - self.window]:
+            del self._failures[key]
+        # Los bloqueos vencidos hace más de una ventana ya no suman reincidencia
+        for key in [k for k, (until, _) in self._locked.items() if until < now - self.window]:
+            del self._locked[key]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._failures.clear()
+            self._locked.clear()
+
+
+user_throttle = LoginThrottle(AUTH_MAX_FAILURES_USER)
+ip_throttle = LoginThrottle(AUTH_MAX_FAILURES_IP)
+
+_local = threading.local()
+
 
 def _conn() -> sqlite3.Connection:
     """
-    Crea y devuelve una conexión a la base de datos SQLite.
-    
+    Devuelve la conexión a la base de datos SQLite del hilo actual.
+
     Returns:
         sqlite3.Connection: Objeto de conexión con row_factory configurado.
     """
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # Una por hilo de Gradio en lugar de abrir una por login
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
     return conn
 
 
-def verify(username: str, password: str) -> Tuple[bool, str]:
+def _cost(pw_hash: bytes) -> Optional[int]:
+    # Formato $2b$<costo>$<sal+hash>
+    try:
+        return int(pw_hash.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _check(password: bytes, pw_hash: bytes, rounds: int) -> Tuple[bool, Optional[bytes]]:
+    """Corre en el pool: (coincide, hash nuevo si hay que rehashear)."""
+    if not bcrypt.checkpw(password, pw_hash):
+        return False, None
+    if _cost(pw_hash) != rounds:
+        return True, bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+    return True, None
+
+
+def hash_password(password: str) -> bytes:
+    """Hash bcrypt con el costo configurado (BCRYPT_ROUNDS)."""
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(BCRYPT_ROUNDS))
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(AUTH_MAX_PENDING)
+
+
+def start_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Crea el pool de verificación y levanta sus procesos.
+
+    main.py lo llama al arrancar, antes de que existan otros hilos: con fork
+    los procesos hijos no heredan locks tomados por hilos a medio camino, y con
+    spawn se evitaría reimportar main.py (y armar la interfaz) en cada hijo.
+    """
+    global _pool
+    if AUTH_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(
+                max_workers=AUTH_WORKERS, mp_context=multiprocessing.get_context(method)
+            )
+            # Con fork los procesos se crean en el primer submit
+            _pool.submit(_cost, b"").result()
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def _run(fn: Callable[..., T], *args: Any) -> T:
+    """Ejecuta `fn` en el pool, esperando a lo sumo AUTH_QUEUE_TIMEOUT por un lugar."""
+    if AUTH_WORKERS <= 0:
+        return fn(*args)
+    if not _pending.acquire(timeout=AUTH_QUEUE_TIMEOUT):
+        raise AuthBusyError("Demasiadas verificaciones en curso")
+    try:
+        try:
+            return start_pool().submit(fn, *args).result()
+        except BrokenProcessPool:
+            # Un proceso murió (p. ej. OOM): se recrea el pool una vez
+            shutdown_pool()
+            return start_pool().submit(fn, *args).result()
+    finally:
+        _pending.release()
+
+
+async def _run_async(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Como _run, desde el event loop. No espera lugar: con más de
+    AUTH_MAX_PENDING verificaciones en curso falla de inmediato (la cola
+    "login" de Gradio ya limita cuántas llegan).
+    """
+    if AUTH_WORKERS <= 0:
+        return await asyncio.to_thread(fn, *args)
+    if not _pending.acquire(blocking=False):
+        raise AuthBusyError("Demasiadas verificaciones en curso")
+    try:
+        try:
+            return await asyncio.wrap_future(start_pool().submit(fn, *args))
+        except BrokenProcessPool:
+            shutdown_pool()
+            return await asyncio.wrap_future(start_pool().submit(fn, *args))
+    finally:
+        _pending.release()
+
+
+def _rehash(username: str, old_hash: Union[str, bytes], new_hash: bytes) -> None:
+    # Solo si nadie cambió la contraseña mientras tanto
+    with _conn() as c:
+        c.execute(
+            "UPDATE users SET hash_password=? WHERE username=? AND hash_password=?",
+            (new_hash, username, old_hash),
+        )
+    AUTH_REHASHES.inc()
+
+
+def _failed(username: str, ip: Optional[str]) -> None:
+    user_throttle.failure(username)
+    if ip:
+        ip_throttle.failure(ip)
+
+
+def _lookup(username: str, ip: Optional[str]) -> Tuple[Optional[Tuple[bool, str]], str, Any]:
+    """
+    Límite de intentos y hash guardado, antes de bcrypt.
+    Devuelve (respuesta si ya se decidió, resultado para la métrica, hash guardado).
+    """
+    wait = max(user_throttle.retry_in(username), ip_throttle.retry_in(ip) if ip else 0.0)
+    if wait > 0:
+        AUTH_THROTTLED.inc(scope="user" if user_throttle.retry_in(username) else "ip")
+        msg = f"Demasiados intentos fallidos. Intenta de nuevo en {math.ceil(wait)} s."
+        return (False, msg), "throttled", None
+
+    row = _conn().execute(
+        "SELECT hash_password FROM users WHERE username=?", (username,)
+    ).fetchone()
+    if row is None:
+        _failed(username, ip)
+        return (False, INVALID), "fail", None
+    return None, "", row["hash_password"]
+
+
+def _as_bytes(stored: Union[str, bytes]) -> bytes:
+    # bcrypt.checkpw requiere bytes
+    return stored.encode("utf-8") if isinstance(stored, str) else stored
+
+
+def _conclude(
+    username: str, ip: Optional[str], stored: Any, ok: bool, new_hash: Optional[bytes]
+) -> Tuple[Tuple[bool, str], str]:
+    """Registra el resultado de bcrypt. Devuelve (respuesta, resultado para la métrica)."""
+    if not ok:
+        _failed(username, ip)
+        return (False, INVALID), "fail"
+    user_throttle.success(username)
+    if new_hash is not None:
+        _rehash(username, stored, new_hash)
+    return (True, "OK"), "ok"
+
+
+def verify(username: str, password: str, ip: Optional[str] = None) -> Tuple[bool, str]:
     """
     Verifica las credenciales del usuario comparando el hash de la contraseña.
+    Bloquea el hilo que llama hasta que el pool responde; en handlers de
+    Gradio usar averify.
 
     Args:
         username (str): Nombre de usuario.
         password (str): Contraseña en texto plano.
+        ip (Optional[str]): IP del cliente, para limitar intentos por origen.
 
     Returns:
         Tuple[bool, str]: Una tupla (éxito, mensaje).
     """
+    t0 = time.perf_counter()
+    result = "error"
+    try:
+        reply, result, stored = _lookup(username, ip)
+        if reply is not None:
+            return reply
+        try:
+            ok, new_hash = _run(_check, password.encode("utf-8"), _as_bytes(stored), BCRYPT_ROUNDS)
+        except AuthBusyError:
+            result = "busy"
+            return False, BUSY
+        reply, result = _conclude(username, ip, stored, ok, new_hash)
+        return reply
+    except Exception:
+        logger.exception(f"Error verificando credenciales de '{username}'")
+        result = "error"
+        return False, "Error verificando credenciales."
+    finally:
+        AUTH_SECONDS.observe(time.perf_counter() - t0, result=result)
+
+
+async def averify(username: str, password: str, ip: Optional[str] = None) -> Tuple[bool, str]:
+    """
+    Como verify, pero espera a bcrypt sin ocupar un hilo: los handlers sync de
+    Gradio comparten un pool de hilos (max_threads) con el chat, y una ráfaga
+    de logins bloqueados en bcrypt lo agotaría.
+    """
+    t0 = time.perf_counter()
+    result = "error"
     try:
-        with _conn() as c:
-            row = c.execute(
-                "SELECT hash_password FROM users WHERE username=?", (username,)
-            ).fetchone()
-        
-        if row is None:
-            return False, "Usuario o contraseña inválidos."
-        
-        pw_hash = row["hash_password"]
-        # bcrypt.checkpw requiere bytes
-        if isinstance(pw_hash, str):
-            pw_hash = pw_hash.encode('utf-8')
-            
-        ok = bcrypt.checkpw(password.encode("utf-8"), pw_hash)
-        return (ok, "OK" if ok else "Usuario o contraseña inválidos.")
-    except Exception as e:
-        # En un entorno real, se debería loguear el error 'e'
+        # SQLite y el throttle bloquean: fuera del event loop
+        reply, result, stored = await asyncio.to_thread(_lookup, username, ip)
+        if reply is not None:
+            return reply
+        try:
+            ok, new_hash = await _run_async(
+                _check, password.encode("utf-8"), _as_bytes(stored), BCRYPT_ROUNDS
+            )
+        except AuthBusyError:
+            result = "busy"
+            return False, BUSY
+        reply, result = await asyncio.to_thread(_conclude, username, ip, stored, ok, new_hash)
+        return reply
+    except Exception:
+        logger.exception(f"Error verificando credenciales de '{username}'")
+        result = "error"
         return False, "Error verificando credenciales."
+    finally:
+        AUTH_SECONDS.observe(time.perf_counter() - t0, result=result)
 
 
 def _auth(username: str, password: str) -> bool:
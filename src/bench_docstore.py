@@ -0,0 +1,153 @@
+# Benchmark de backends del docstore de padres: LocalFileStore vs SQLite (±zstd).
+# Construye un corpus sintético de N padres (un hijo por padre en Chroma, con
+# embeddings deterministas locales) y mide la latencia de retriever.invoke y de
+# mget en lote para cada backend. No requiere red.
+#
+#   uv run python src/bench_docstore.py --parents 50000 --queries 200
+
+import argparse
+import json
+import random
+import statistics
+import string
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+from langchain_chroma import Chroma
+from langchain_classic.retrievers import ParentDocumentRetriever
+from langchain_classic.storage import LocalFileStore, create_kv_docstore
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from docstore import SQLiteByteStore
+
+_vocab_rng = random.Random(1234)
+_WORDS = [
+    "".join(_vocab_rng.choices(string.ascii_lowercase, k=_vocab_rng.randint(3, 10)))
+    for _ in range(2000)
+]
+
+
+def _text(rng: random.Random, n_chars: int) -> str:
+    out, size = [], 0
+    while size < n_chars:
+        w = rng.choice(_WORDS)
+        out.append(w)
+        size += len(w) + 1
+    return " ".join(out)
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    q = statistics.quantiles(samples, n=100)
+    return {
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+        "p99_ms": q[98] * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+    }
+
+
+def build_corpus(workdir: Path, n_parents: int, parent_chars: int, seed: int):
+    """Crea la colección Chroma de hijos y devuelve (vs, ids, parents)."""
+    rng = random.Random(seed)
+    vs = Chroma(
+        embedding_function=DeterministicFakeEmbedding(size=64),
+        collection_name="bench_child",
+        persist_directory=str(workdir / "chroma"),
+    )
+    ids, parents = [], []
+    batch = 5000
+    for start in range(0, n_parents, batch):
+        chunk_ids, children = [], []
+        for _ in range(start, min(start + batch, n_parents)):
+            pid = str(uuid.uuid4())
+            text = _text(rng, parent_chars)
+            chunk_ids.append(pid)
+            parents.append(Document(page_content=text, metadata={"source": "bench.pdf"}))
+            children.append(Document(page_content=text[:200], metadata={"doc_id": pid}))
+        vs.add_documents(children)
+        ids.extend(chunk_ids)
+    return vs, ids, parents
+
+
+def bench_backend(name, byte_store, vs, ids, parents, queries, rng) -> Dict:
+    docstore = create_kv_docstore(byte_store)
+    t0 = time.perf_counter()
+    for i in range(0, len(ids), 1000):
+        docstore.mset(list(zip(ids[i : i + 1000], parents[i : i + 1000])))
+    load_s = time.perf_counter() - t0
+
+    retriever = ParentDocumentRetriever(
+        vectorstore=vs,
+        docstore=docstore,
+        child_splitter=RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=60),
+        search_kwargs={"k": 4},
+    )
+    lat = []
+    for q in queries:
+        t = time.perf_counter()
+        retriever.invoke(q)
+        lat.append(time.perf_counter() - t)
+
+    mget_lat = []
+    for _ in range(len(queries)):
+        keys = rng.sample(ids, 100)
+        t = time.perf_counter()
+        docstore.mget(keys)
+        mget_lat.append(time.perf_counter() - t)
+
+    return {
+        "backend": name,
+        "load_s": load_s,
+        "retriever_invoke": _percentiles(lat),
+        "mget_100": _percentiles(mget_lat),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de backends del docstore")
+    parser.add_argument("--parents", type=int, default=50000)
+    parser.add_argument("--parent-chars", type=int, default=4000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=None, help="Guardar resultados en JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix="bench_docstore_") as tmp:
+        workdir = Path(tmp)
+        print(f"Construyendo corpus de {args.parents} padres...")
+        vs, ids, parents = build_corpus(workdir, args.parents, args.parent_chars, args.seed)
+        queries = [_text(rng, 80) for _ in range(args.queries)]
+
+        backends = {
+            "file": LocalFileStore(str(workdir / "parent")),
+            "sqlite": SQLiteByteStore(workdir / "parent.db"),
+        }
+        try:
+            backends["sqlite+zstd"] = SQLiteByteStore(workdir / "parent_zstd.db", compress=True)
+        except ImportError:
+            print("zstandard no instalado: se omite sqlite+zstd")
+
+        results = []
+        for name, byte_store in backends.items():
+            r = bench_backend(name, byte_store, vs, ids, parents, queries, rng)
+            results.append(r)
+            inv, mg = r["retriever_invoke"], r["mget_100"]
+            print(
+                f"{name:<12} carga={r['load_s']:.1f}s  "
+                f"invoke p50={inv['p50_ms']:.2f}ms p95={inv['p95_ms']:.2f}ms  "
+                f"mget(100) p50={mg['p50_ms']:.2f}ms p95={mg['p95_ms']:.2f}ms"
+            )
+
+    if args.out:
+        meta = {k: v for k, v in vars(args).items() if k != "out"}
+        args.out.write_text(json.dumps({"args": meta, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Benchmark de timeouts y hedging contra el servidor falso de fake_openai.py.
+# Lanza el servidor en el proceso (con picos de latencia), apunta ChatOpenAI a
+# él y hace las mismas llamadas cortas del rol indicado sin y con hedging.
+# Reporta p50/p95/p99, timeouts y el tráfico extra que generó el hedging.
+#
+#   uv run python src/bench_hedging.py --calls 300 --spike-prob 0.03 --spike-ms 3000
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+import yaml
+
+from fake_openai import FakeOpenAIServer
+from loadgen import QUESTIONS, _percentiles
+
+
+def _config(path: Path, role: str, model: str, timeout: float, hedge: bool) -> Path:
+    spec = {"model": model, "timeout": timeout, "hedge": hedge}
+    path.write_text(yaml.safe_dump({"MODELS": {role: spec}}))
+    return path
+
+
+def run_mode(
+    server: FakeOpenAIServer, role: str, calls: int, concurrency: int, warmup: int
+) -> Dict[str, Any]:
+    from langchain_core.messages import HumanMessage
+
+    import resilient
+    from routing import chat_model
+
+    resilient.latencies.reset()
+    resilient.budget.reset()
+
+    def call(i: int) -> float:
+        t0 = time.perf_counter()
+        try:
+            question = HumanMessage(content=QUESTIONS[i % len(QUESTIONS)])
+            resilient.invoke_model(role, chat_model(role), [question])
+        except resilient.ModelTimeoutError:
+            return float("inf")
+        return time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # Muestras para el p95 del rol, sin medir
+        list(pool.map(call, range(warmup)))
+        requests_before = server.requests
+        latencies: List[float] = list(pool.map(call, range(calls)))
+    # Las llamadas que perdieron contra su hedge terminan después
+    time.sleep(0.5)
+    ok = [x for x in latencies if x != float("inf")]
+    return {
+        "latency": _percentiles(ok),
+        "max_ms": max(ok) * 1000 if ok else 0.0,
+        "timeouts": len(latencies) - len(ok),
+        "extra_requests": (server.requests - requests_before - calls) / calls,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Timeouts y hedging con picos de latencia")
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--role", default="grader")
+    parser.add_argument("--model", default="openai:gpt-4o-mini")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--spike-prob", type=float, default=0.03)
+    parser.add_argument("--spike-ms", type=float, default=3000)
+    parser.add_argument("--budget", type=float, default=None, help="Fracción de llamadas extra (HEDGE_BUDGET)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("FAKE_LLM_LATENCY_MS", "200")
+    os.environ.setdefault("FAKE_LLM_LATENCY_SIGMA", "0.3")
+    os.environ.setdefault("FAKE_LLM_ANSWER_TOKENS", "10")
+    server = FakeOpenAIServer("127.0.0.1", 0, args.spike_prob, args.spike_ms, args.seed)
+    server.start()
+    os.environ["LLM_PROVIDER"] = "openai"
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "fake"
+
+    import resilient
+    from routing import router
+
+    if args.budget is not None:
+        resilient.budget.ratio = args.budget
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="bench_hedging_") as tmp:
+        for hedge in (False, True):
+            path = _config(Path(tmp) / f"hedge_{hedge}.yaml", args.role, args.model, args.timeout, hedge)
+            router.use_file(path)
+            warmup = max(resilient.HEDGE_MIN_SAMPLES, args.concurrency)
+            result = run_mode(server, args.role, args.calls, args.concurrency, warmup)
+            rows.append(("con hedging" if hedge else "sin hedging", result))
+    server.shutdown()
+
+    print(
+        f"rol={args.role} llamadas={args.calls} picos={args.spike_prob:.0%} de {args.spike_ms:.0f}ms "
+        f"({server.spikes} en {server.requests} requests)"
+    )
+    print(f"{'modo':<12} {'p50':>9} {'p95':>9} {'p99':>9} {'máx':>9} {'timeouts':>9} {'extra':>7}")
+    for name, r in rows:
+        lat = r["latency"]
+        print(
+            f"{name:<12} {lat['p50_ms']:>7.0f}ms {lat['p95_ms']:>7.0f}ms {lat['p99_ms']:>7.0f}ms "
+            f"{r['max_ms']:>7.0f}ms {r['timeouts']:>9} {r['extra_requests']:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Benchmark de conexiones HTTP: handshakes y latencia con y sin pool compartido.
+# Levanta fake_openai.py con TLS (certificado autofirmado generado con openssl)
+# y envía las mismas requests de chat de tres formas: un cliente nuevo por
+# llamada (camino frío), un cliente por rol (como cuando cada modelo tenía el
+# suyo) y el cliente compartido de http_clients.py. Reporta conexiones nuevas,
+# handshakes TLS, tiempo total de conexión y latencia por request.
+#
+#   uv run python src/bench_http.py --requests 200 --concurrency 8
+
+import argparse
+import os
+import ssl
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+
+import http_clients
+from fake_openai import FakeOpenAIServer
+from loadgen import _percentiles
+
+ROLES = ("answer", "tool_routing", "grader", "memory", "rewrite", "title")
+
+
+def self_signed_cert(workdir: Path) -> Tuple[str, str]:
+    cert, key = workdir / "cert.pem", workdir / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", str(key), "-out", str(cert), "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return str(cert), str(key)
+
+
+def run_mode(
+    name: str,
+    get_client: Callable[[int], httpx.Client],
+    url: str,
+    n: int,
+    concurrency: int,
+    close: bool = False,
+) -> Dict[str, Any]:
+    body = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "hola"}]}
+
+    def call(i: int) -> float:
+        t0 = time.perf_counter()
+        client = get_client(i)
+        try:
+            client.post(url, json=body).raise_for_status()
+        finally:
+            if close:
+                client.close()
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies: List[float] = list(pool.map(call, range(n)))
+    wall = time.perf_counter() - t0
+    s = http_clients.stats().get(name, {})
+    return {
+        "mode": name,
+        "wall_s": wall,
+        "latency": _percentiles(latencies),
+        "connections": int(s.get("connections", 0)),
+        "tls_handshakes": int(s.get("tls_handshakes", 0)),
+        "connect_ms": s.get("connect_s", 0.0) * 1000,
+        "reuse_ratio": s.get("reuse_ratio", 0.0),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Handshakes y reutilización de conexiones")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    # Respuestas inmediatas: la diferencia es solo de conexiones
+    os.environ.setdefault("FAKE_LLM_LATENCY_MS", "1")
+    os.environ.setdefault("FAKE_LLM_TOKEN_MS", "0")
+    with tempfile.TemporaryDirectory(prefix="bench_http_") as tmp:
+        cert, key = self_signed_cert(Path(tmp))
+        server = FakeOpenAIServer("127.0.0.1", 0, tls=(cert, key))
+        server.start()
+        url = server.base_url + "/chat/completions"
+        verify = ssl.create_default_context(cafile=cert)
+
+        per_role = {r: http_clients.make_client("por_rol", verify=verify) for r in ROLES}
+        shared = http_clients.make_client("compartido", verify=verify)
+        modes = [
+            # Cliente nuevo (pool vacío) por llamada, cerrado al terminar
+            ("por_llamada", lambda i: http_clients.make_client("por_llamada", verify=verify), True),
+            ("por_rol", lambda i: per_role[ROLES[i % len(ROLES)]], False),
+            ("compartido", lambda i: shared, False),
+        ]
+        rows = [
+            run_mode(name, fn, url, args.requests, args.concurrency, close)
+            for name, fn, close in modes
+        ]
+        for client in [shared, *per_role.values()]:
+            client.close()
+        server.shutdown()
+
+    print(f"requests={args.requests} concurrencia={args.concurrency} http2={http_clients.http2_enabled()}")
+    print(
+        f"{'modo':<12} {'conexiones':>10} {'handshakes':>10} {'conexión':>10} {'reuso':>7} "
+        f"{'p50':>9} {'p95':>9} {'total':>8}"
+    )
+    for r in rows:
+        lat = r["latency"]
+        print(
+            f"{r['mode']:<12} {r['connections']:>10} {r['tls_handshakes']:>10} "
+            f"{r['connect_ms']:>8.0f}ms {r['reuse_ratio']:>7.0%} {lat['p50_ms']:>7.1f}ms "
+            f"{lat['p95_ms']:>7.1f}ms {r['wall_s']:>7.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+# Benchmark de ingesta PDF → padres/hijos → vectores.
+# Genera PDFs sintéticos con PyMuPDF (10 a 1000 páginas) y, para cada tamaño,
+# mide en un proceso nuevo (para que el pico de RSS sea el de ese caso):
+#   hash (SHA-256 de add_file), parse (PyMuPDFLoader), split (parent/child),
+#   embed (embedder falso local), store (Chroma + docstore) y el camino completo
+#   de ingest_pdf. Los resultados se guardan en JSON para comparar versiones.
+# Con --large además corre ingest_pdf solo, en un proceso por modo, cargando el
+# PDF entero ("memoria") y por rangos de páginas en el pool ("rangos", el camino
+# de los PDFs de más de LARGE_PDF_MB): tiempo y pico de RSS contra páginas.
+#
+#   uv run python src/bench_ingest.py --pages 10 100 1000
+#   uv run python src/bench_ingest.py --pages 1000 5000 20000 --large
+#   uv run python src/bench_ingest.py --pages 10 100 --compare bench_results/ingest_previo.json
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, List
+
+import fitz
+
+from loadgen import REPO_ROOT, prepare_workdir
+
+_VOCAB = (
+    "modelo proceso fase datos proyecto sistema análisis calidad dominio "
+    "conocimiento explotación preparación comprensión definición objetivo "
+    "resultado metodología evaluación información tarea requisito"
+).split()
+
+
+def make_pdf(path: Path, pages: int, chars_per_page: int = 3000, seed: int = 0) -> None:
+    """Genera un PDF de texto con `pages` páginas."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for n in range(pages):
+        words, size = [f"Sección {n + 1}."], 0
+        while size < chars_per_page:
+            w = rng.choice(_VOCAB)
+            words.append(w)
+            size += len(w) + 1
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, 555, 800), " ".join(words), fontsize=7)
+    doc.save(path)
+    doc.close()
+
+
+def _rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux informa KiB; macOS, bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_case(pdf: str, pages: int, workdir: str) -> Dict[str, Any]:
+    """Ejecuta un caso en un proceso aislado y devuelve sus métricas."""
+    prepare_workdir(Path(workdir))
+    from langchain_community.document_loaders import PyMuPDFLoader
+    from langchain_core.documents import Document
+
+    import db
+    from graph import _embeddings, child_splitter, get_retriever, parent_splitter
+    from ingest import ingest_pdf
+
+    db.init_db()
+    uid = db.create_user(f"bench_{pages}", "bench")
+    baseline_rss = _rss_mb()
+    stages: Dict[str, float] = {}
+
+    t0 = time.perf_counter()
+    db._sha256(Path(pdf))
+    stages["hash"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    page_docs = PyMuPDFLoader(pdf).load()
+    stages["parse"] = time.perf_counter() - t0
+
+    tid = db.get_chat_by_id(db.create_chat(uid, "bench"))["thread_id"]
+    full = Document(
+        page_content="\n".join(d.page_content for d in page_docs),
+        metadata={"source": Path(pdf).name, "user_id": uid, "thread_id": tid},
+    )
+    t0 = time.perf_counter()
+    parents = parent_splitter.split_documents([full])
+    children, parent_ids = [], []
+    for parent in parents:
+        pid = str(uuid.uuid4())
+        parent_ids.append(pid)
+        for child in child_splitter.split_documents([parent]):
+            child.metadata["doc_id"] = pid
+            children.append(child)
+    stages["split"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    vectors = _embeddings.embed_documents([c.page_content for c in children])
+    stages["embed"] = time.perf_counter() - t0
+
+    retriever = get_retriever(uid, tid)
+    collection = retriever.vectorstore._collection
+    t0 = time.perf_counter()
+    batch = 5000
+    for i in range(0, len(children), batch):
+        chunk = children[i : i + batch]
+        collection.upsert(
+            ids=[str(uuid.uuid4()) for _ in chunk],
+            embeddings=vectors[i : i + batch],
+            documents=[c.page_content for c in chunk],
+            metadatas=[c.metadata for c in chunk],
+        )
+    retriever.docstore.mset(list(zip(parent_ids, parents)))
+    stages["store"] = time.perf_counter() - t0
+    staged_total = sum(stages.values())
+
+    # Camino real de la app, en un hilo nuevo
+    tid2 = db.get_chat_by_id(db.create_chat(uid, "bench e2e"))["thread_id"]
+    e2e_stages: Dict[str, float] = {}
+    t0 = time.perf_counter()
+    ingest_pdf(pdf, uid, tid2, timings=e2e_stages)
+    e2e = time.perf_counter() - t0
+
+    return {
+        "pages": pages,
+        "file_mb": Path(pdf).stat().st_size / 1e6,
+        "parents": len(parents),
+        "children": len(children),
+        "stages_s": stages,
+        "staged_total_s": staged_total,
+        "pages_per_s": pages / staged_total,
+        "chunks_per_s": len(children) / (stages["split"] + stages["embed"] + stages["store"]),
+        "ingest_pdf_s": e2e,
+        "ingest_pdf_stages_s": e2e_stages,
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": _rss_mb(),
+    }
+
+
+def run_mode(pdf: str, pages: int, workdir: str, mode: str) -> Dict[str, Any]:
+    """ingest_pdf en un proceso aislado, en memoria o por rangos de páginas."""
+    prepare_workdir(Path(workdir))
+    import db
+    import ingest
+
+    db.init_db()
+    uid = db.create_user(f"bench_{mode}_{pages}", "bench")
+    tid = db.get_chat_by_id(db.create_chat(uid, "bench"))["thread_id"]
+    ingest.LARGE_PDF_MB = 0 if mode == "rangos" else float("inf")
+    baseline_rss = _rss_mb()
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+    ingest.ingest_pdf(pdf, uid, tid, timings=timings)
+    wall = time.perf_counter() - t0
+    # RUSAGE_CHILDREN solo cuenta procesos terminados
+    ingest.shutdown_parse_pool()
+    return {
+        "pages": pages,
+        "mode": mode,
+        "wall_s": wall,
+        "pages_per_s": pages / wall,
+        "stages_s": timings,
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": _rss_mb(),
+        "pool_peak_rss_mb": _rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def print_modes(rows: List[Dict[str, Any]]) -> None:
+    print(
+        f"\n{'págs':>6} {'modo':<8} {'tiempo':>8} {'págs/s':>8} {'parse':>7} {'index':>7} "
+        f"{'RSS MB':>8} {'+base':>7} {'pool MB':>8}"
+    )
+    for r in rows:
+        s = r["stages_s"]
+        print(
+            f"{r['pages']:>6} {r['mode']:<8} {r['wall_s']:>7.2f}s {r['pages_per_s']:>8.1f} "
+            f"{s.get('parse', 0.0):>7.2f} {s.get('index', 0.0):>7.2f} {r['peak_rss_mb']:>8.0f} "
+            f"{r['peak_rss_mb'] - r['baseline_rss_mb']:>7.0f} {r['pool_peak_rss_mb']:>8.0f}"
+        )
+
+
+def _environment() -> Dict[str, Any]:
+    def version(pkg: str) -> str:
+        try:
+            return metadata.version(pkg)
+        except metadata.PackageNotFoundError:
+            return "?"
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        commit = "?"
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "packages": {
+            p: version(p)
+            for p in ("pymupdf", "chromadb", "langchain-text-splitters", "langchain-classic")
+        },
+    }
+
+
+def print_cases(cases: List[Dict[str, Any]]) -> None:
+    print(
+        f"{'págs':>6} {'hijos':>8} {'págs/s':>8} {'chunks/s':>9} {'hash':>7} {'parse':>7} "
+        f"{'split':>7} {'embed':>7} {'store':>7} {'ingest':>8} {'RSS MB':>8}"
+    )
+    for c in cases:
+        s = c["stages_s"]
+        print(
+            f"{c['pages']:>6} {c['children']:>8} {c['pages_per_s']:>8.1f} {c['chunks_per_s']:>9.0f} "
+            f"{s['hash']:>7.2f} {s['parse']:>7.2f} {s['split']:>7.2f} {s['embed']:>7.2f} "
+            f"{s['store']:>7.2f} {c['ingest_pdf_s']:>8.2f} {c['peak_rss_mb']:>8.0f}"
+        )
+
+
+def compare(cases: List[Dict[str, Any]], baseline_path: Path) -> None:
+    """Compara páginas/s y tiempo de ingest_pdf contra un resultado anterior."""
+    old = {c["pages"]: c for c in json.loads(baseline_path.read_text())["cases"]}
+    print(f"\nComparación contra {baseline_path}:")
+    for c in cases:
+        prev = old.get(c["pages"])
+        if prev is None:
+            continue
+        speed = c["pages_per_s"] / prev["pages_per_s"]
+        rss = c["peak_rss_mb"] - prev["peak_rss_mb"]
+        print(
+            f"  {c['pages']:>5} págs: págs/s x{speed:.2f}  "
+            f"ingest_pdf {prev['ingest_pdf_s']:.2f}s → {c['ingest_pdf_s']:.2f}s  RSS {rss:+.0f} MB"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta de PDFs")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--chars-per-page", type=int, default=3000)
+    parser.add_argument("--out", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None, help="JSON de una corrida anterior")
+    parser.add_argument(
+        "--large", action="store_true", help="Compara ingest_pdf en memoria y por rangos de páginas"
+    )
+    args = parser.parse_args()
+
+    out = args.out or REPO_ROOT / "bench_results" / (
+        f"ingest_{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+    )
+    cases, modes = [], []
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="bench_ingest_") as tmp:
+        for pages in args.pages:
+            pdf = Path(tmp) / f"sintetico_{pages}.pdf"
+            make_pdf(pdf, pages, args.chars_per_page)
+            workdir = Path(tmp) / f"work_{pages}"
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                cases.append(pool.submit(run_case, str(pdf), pages, str(workdir)).result())
+            for mode in ("memoria", "rangos") if args.large else ():
+                workdir = Path(tmp) / f"work_{pages}_{mode}"
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    modes.append(pool.submit(run_mode, str(pdf), pages, str(workdir), mode).result())
+            print(f"{pages} páginas listo")
+
+    print_cases(cases)
+    if modes:
+        print_modes(modes)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    result = {"environment": _environment(), "cases": cases}
+    if modes:
+        result["modes"] = modes
+    out.write_text(json.dumps(result, indent=2))
+    print(f"Resultados en {out}")
+    if args.compare:
+        compare(cases, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# Benchmark de logins: ráfaga de inicios de sesión y latencia del chat.
+# Levanta una app de Gradio con la misma cola que main.py (grupo "login" de
+# AUTH_MAX_PENDING, chat con default_concurrency_limit y max_threads hilos para
+# los handlers sync) y la usa con gradio_client: mientras unos usuarios
+# conversan con el grafo (modelos falsos), N usuarios inician sesión a la vez.
+# Modos:
+#   hilo       handler sync con bcrypt en el hilo (AUTH_WORKERS=0)
+#   pool_sync  handler sync que espera al pool: cada login retiene un hilo
+#   pool       handler async con averify, como do_login
+# Reporta logins/s y p50/p95 del chat sin ráfaga y durante la ráfaga.
+#
+#   uv run python src/bench_login.py --logins 100 --chat-users 5
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from loadgen import QUESTIONS, _percentiles, _setup_users, prepare_workdir
+
+PASSWORD = "clave-de-prueba"
+
+
+def _create_login_users(n: int) -> List[str]:
+    import auth
+    import db
+
+    # Todos con el mismo hash: crearlos no debería costar n * bcrypt
+    pw_hash = auth.hash_password(PASSWORD)
+    names = [f"login_{i}" for i in range(n)]
+    with db._conn() as c:
+        c.executemany(
+            "INSERT OR IGNORE INTO users(username, hash_password) VALUES (?, ?)",
+            [(name, pw_hash) for name in names],
+        )
+    return names
+
+
+def _build_app(args: argparse.Namespace) -> Any:
+    """App con los handlers de los tres modos y la cola configurada como en main.py."""
+    import gradio as gr
+    from langchain_core.messages import HumanMessage
+    from langchain_core.runnables import RunnableConfig
+
+    import auth
+    from graph import graph
+
+    def login_sync(username: str, password: str) -> bool:
+        return auth.verify(username, password)[0]
+
+    async def login_async(username: str, password: str) -> bool:
+        return (await auth.averify(username, password))[0]
+
+    def chat(i: float, thread_id: str, user_id: float) -> str:
+        cfg = RunnableConfig({"configurable": {"thread_id": thread_id, "user_id": int(user_id)}})
+        graph.invoke({"messages": [HumanMessage(content=QUESTIONS[int(i) % len(QUESTIONS)])]}, cfg)
+        return "ok"
+
+    with gr.Blocks() as demo:
+        user, pwd, ok = gr.Textbox(), gr.Textbox(), gr.Checkbox()
+        turn, thread_id, user_id, answer = gr.Number(), gr.Textbox(), gr.Number(), gr.Textbox()
+        for name, fn in (("login_sync", login_sync), ("login_async", login_async)):
+            gr.Button().click(
+                fn,
+                inputs=[user, pwd],
+                outputs=ok,
+                api_name=name,
+                concurrency_limit=args.login_queue,
+                concurrency_id="login",
+            )
+        gr.Button().click(chat, inputs=[turn, thread_id, user_id], outputs=answer, api_name="chat")
+    demo.queue(default_concurrency_limit=args.queue).launch(
+        prevent_thread_lock=True, max_threads=args.max_threads, quiet=True
+    )
+    return demo
+
+
+def _chat_loop(
+    client: Any, user: Dict[str, Any], stop: threading.Event, out: List[Tuple[float, float]]
+) -> None:
+    i = 0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        client.predict(i, user["thread_id"], user["user_id"], api_name="/chat")
+        out.append((t0, time.perf_counter() - t0))
+        i += 1
+
+
+def run_mode(
+    mode: str,
+    client: Any,
+    names: List[str],
+    chat_users: List[Dict[str, Any]],
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    import auth
+
+    # El pool sigue vivo en todos los modos; con 0 workers verify() no lo usa
+    auth.AUTH_WORKERS = 0 if mode == "hilo" else args.workers
+    auth.user_throttle.reset()
+    auth.ip_throttle.reset()
+    endpoint = "/login_async" if mode == "pool" else "/login_sync"
+
+    stop = threading.Event()
+    chat: List[Tuple[float, float]] = []
+    threads = [
+        threading.Thread(target=_chat_loop, args=(client, u, stop, chat), daemon=True)
+        for u in chat_users
+    ]
+    for t in threads:
+        t.start()
+    # Latencia del chat sin ráfaga
+    time.sleep(args.baseline)
+
+    def login(i: int) -> Tuple[float, bool]:
+        t0 = time.perf_counter()
+        ok = client.predict(names[i], PASSWORD, api_name=endpoint)
+        return time.perf_counter() - t0, bool(ok)
+
+    storm_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        results = list(pool.map(login, range(len(names))))
+    storm_end = time.perf_counter()
+    stop.set()
+    for t in threads:
+        t.join()
+
+    storm = storm_end - storm_start
+    return {
+        "mode": mode,
+        "logins_s": len(names) / storm,
+        "failed": sum(not ok for _, ok in results),
+        "login": _percentiles([s for s, _ in results]),
+        "chat_base": _percentiles([s for t0, s in chat if t0 + s < storm_start]),
+        "chat_storm": _percentiles([s for t0, s in chat if storm_start <= t0 < storm_end]),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ráfaga de logins y latencia del chat")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--chat-users", type=int, default=5)
+    parser.add_argument("--queue", type=int, default=None, help="Por defecto QUEUE_CONCURRENCY")
+    parser.add_argument("--login-queue", type=int, default=None, help="Por defecto AUTH_MAX_PENDING")
+    parser.add_argument("--max-threads", type=int, default=40, help="Hilos de Gradio (default de launch)")
+    parser.add_argument("--workers", type=int, default=None, help="Por defecto AUTH_WORKERS")
+    parser.add_argument("--rounds", type=int, default=12, help="Costo de bcrypt")
+    parser.add_argument("--baseline", type=float, default=3.0, help="Segundos de chat sin ráfaga")
+    parser.add_argument("--workdir", type=Path, default=None, help="Por defecto, temporal")
+    args = parser.parse_args()
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="bench_login_"))
+    prepare_workdir(workdir)
+
+    import auth
+    from scheduler import QUEUE_CONCURRENCY
+
+    args.workers = args.workers or max(1, auth.AUTH_WORKERS)
+    args.queue = args.queue or QUEUE_CONCURRENCY
+    args.login_queue = args.login_queue or auth.AUTH_MAX_PENDING
+    # Pool levantado antes de crear hilos (ver auth.start_pool)
+    auth.AUTH_WORKERS = args.workers
+    auth.start_pool()
+    names = _create_login_users(args.logins)
+    chat_users = _setup_users(args.chat_users, with_docs=False, seed=0, prefix="chat")
+
+    from gradio_client import Client
+
+    demo = _build_app(args)
+    client = Client(demo.local_url, verbose=False, max_workers=args.logins + args.chat_users + 4)
+    rows = [run_mode(mode, client, names, chat_users, args) for mode in ("hilo", "pool_sync", "pool")]
+    demo.close()
+    auth.shutdown_pool()
+
+    print(
+        f"logins={args.logins} chat={args.chat_users} usuarios cola={args.queue} "
+        f"login={args.login_queue} hilos={args.max_threads} bcrypt={args.rounds} "
+        f"procesos={args.workers} ({workdir})"
+    )
+    print(
+        f"{'modo':<9} {'logins/s':>9} {'login p50':>10} {'login p95':>10} "
+        f"{'chat p50':>9} {'chat p95':>9} {'ráfaga p50':>11} {'ráfaga p95':>11}"
+    )
+    for r in rows:
+        print(
+            f"{r['mode']:<9} {r['logins_s']:>9.1f} {r['login']['p50_ms']:>8.0f}ms "
+            f"{r['login']['p95_ms']:>8.0f}ms {r['chat_base']['p50_ms']:>7.0f}ms "
+            f"{r['chat_base']['p95_ms']:>7.0f}ms {r['chat_storm']['p50_ms']:>9.0f}ms "
+            f"{r['chat_storm']['p95_ms']:>9.0f}ms"
+        )
+        if r["failed"]:
+            print(f"  {r['failed']} logins fallidos")
+
+
+if __name__ == "__main__":
+    main()
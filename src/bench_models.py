@@ -0,0 +1,168 @@
+# Benchmark de configuraciones de modelos por rol.
+# Corre el mismo conjunto de preguntas contra el grafo con cada config.yaml
+# (un proceso y un directorio de trabajo aislado por configuración, con los
+# mismos documentos indexados) y reporta latencia, tokens, costo estimado y
+# coincidencia de las respuestas con la primera configuración.
+# Usa el proveedor de LLM_PROVIDER (por defecto, los modelos falsos).
+#
+#   LLM_PROVIDER=openai uv run python src/bench_models.py config.yaml configs/economico.yaml
+#   uv run python src/bench_models.py config.yaml otra.yaml --questions preguntas.txt --pdf doc.pdf
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loadgen import QUESTIONS, _percentiles, prepare_workdir
+
+# Similitud mínima (0-1) para contar dos respuestas como coincidentes
+AGREEMENT_THRESHOLD = 0.6
+
+
+def run_config(config: str, questions: List[str], workdir: str, pdf: Optional[str]) -> Dict[str, Any]:
+    """Ejecuta las preguntas con una configuración, en un proceso aislado."""
+    os.environ["MODEL_CONFIG_PATH"] = config
+    prepare_workdir(Path(workdir))
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langchain_core.messages import HumanMessage
+    from langchain_core.runnables import RunnableConfig
+
+    from graph import get_checkpointer, get_graph
+    from loadgen import _setup_users
+    from routing import router
+
+    class TokenCounter(BaseCallbackHandler):
+        def __init__(self) -> None:
+            self.models: Dict[Any, str] = {}
+            self.tokens: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+            self.models[run_id] = (metadata or {}).get("ls_model_name", "desconocido")
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            model = self.models.pop(run_id, "desconocido")
+            for gens in response.generations:
+                for gen in gens:
+                    usage = getattr(getattr(gen, "message", None), "usage_metadata", None) or {}
+                    self.tokens[model][0] += usage.get("input_tokens", 0)
+                    self.tokens[model][1] += usage.get("output_tokens", 0)
+
+    user = _setup_users(1, pdf is None, seed=0)[0]
+    uid, tid = user["user_id"], user["thread_id"]
+    if pdf:
+        from ingest import ingest_pdf
+
+        ingest_pdf(pdf, uid, tid)
+    graph = get_graph()
+    results = []
+    for question in questions:
+        # Mismo hilo (mismos documentos) pero sin historial de la pregunta anterior
+        get_checkpointer().delete_thread(tid)
+        counter = TokenCounter()
+        cfg = RunnableConfig(
+            {"configurable": {"thread_id": tid, "user_id": uid}, "callbacks": [counter]}
+        )
+        t0 = time.perf_counter()
+        error = None
+        answer = ""
+        try:
+            out = graph.invoke({"messages": [HumanMessage(content=question)]}, cfg)
+            answer = out["messages"][-1].content
+        except Exception as e:
+            error = str(e)
+        results.append(
+            {
+                "question": question,
+                "answer": answer,
+                "error": error,
+                "latency_s": time.perf_counter() - t0,
+                "tokens": dict(counter.tokens),
+            }
+        )
+    return {"config": config, "roles": router.specs, "results": results}
+
+
+def _similarity(a: str, b: str) -> float:
+    return SequenceMatcher(None, a.lower().split(), b.lower().split()).ratio()
+
+
+def summarize(run: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    from usage import cost_usd
+
+    results = run["results"]
+    n = len(results)
+    tokens_in = sum(t[0] for r in results for t in r["tokens"].values())
+    tokens_out = sum(t[1] for r in results for t in r["tokens"].values())
+    cost = sum(cost_usd(m, t[0], t[1]) for r in results for m, t in r["tokens"].items())
+    sims = [
+        _similarity(r["answer"], b["answer"])
+        for r, b in zip(results, baseline["results"])
+        if not r["error"] and not b["error"]
+    ]
+    return {
+        "config": run["config"],
+        "latency": _percentiles([r["latency_s"] for r in results]),
+        "errors": sum(1 for r in results if r["error"]),
+        "tokens_in_per_q": tokens_in / n if n else 0,
+        "tokens_out_per_q": tokens_out / n if n else 0,
+        "cost_usd_per_q": cost / n if n else 0,
+        "similarity": statistics.mean(sims) if sims else 0.0,
+        "agreement": sum(s >= AGREEMENT_THRESHOLD for s in sims) / len(sims) if sims else 0.0,
+    }
+
+
+def print_summary(rows: List[Dict[str, Any]]) -> None:
+    print(
+        f"{'configuración':<28} {'p50':>8} {'p95':>8} {'err':>4} {'tok in':>8} "
+        f"{'tok out':>8} {'USD/preg':>9} {'simil.':>7} {'coinc.':>7}"
+    )
+    for r in rows:
+        lat = r["latency"]
+        print(
+            f"{Path(r['config']).name:<28} {lat['p50_ms'] / 1000:>7.2f}s {lat['p95_ms'] / 1000:>7.2f}s "
+            f"{r['errors']:>4} {r['tokens_in_per_q']:>8.0f} {r['tokens_out_per_q']:>8.0f} "
+            f"{r['cost_usd_per_q']:>9.5f} {r['similarity']:>7.2f} {r['agreement']:>7.0%}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Comparación de configuraciones de modelos")
+    parser.add_argument("configs", type=Path, nargs="+", help="La primera es la referencia")
+    parser.add_argument("--questions", type=Path, default=None, help="Una pregunta por línea")
+    parser.add_argument("--pdf", type=Path, default=None, help="PDF a indexar (por defecto, texto sintético)")
+    parser.add_argument("--out", type=Path, default=None, help="Guardar respuestas y resumen en JSON")
+    args = parser.parse_args()
+
+    questions = (
+        [q.strip() for q in args.questions.read_text().splitlines() if q.strip()]
+        if args.questions
+        else QUESTIONS
+    )
+    pdf = str(args.pdf.resolve()) if args.pdf else None
+    runs = []
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="bench_models_") as tmp:
+        for i, config in enumerate(args.configs):
+            workdir = Path(tmp) / f"config_{i}"
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                runs.append(
+                    pool.submit(run_config, str(config.resolve()), questions, str(workdir), pdf).result()
+                )
+            print(f"{config} listo")
+
+    rows = [summarize(run, runs[0]) for run in runs]
+    print_summary(rows)
+    if args.out:
+        args.out.write_text(json.dumps({"summary": rows, "runs": runs}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
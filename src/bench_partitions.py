@@ -0,0 +1,108 @@
+# Benchmark de latencia de búsqueda: colección única filtrada vs. colecciones
+# particionadas por hilo, en función del tamaño total del corpus.
+# Usa vectores aleatorios y un cliente Chroma persistente en un directorio
+# temporal. No requiere red.
+#
+#   uv run python src/bench_partitions.py --sizes 10000 50000 100000 --tenants 100
+
+import argparse
+import json
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import chromadb
+
+_BATCH = 5000
+
+
+def _vec(rng: random.Random, dim: int) -> List[float]:
+    return [rng.gauss(0, 1) for _ in range(dim)]
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    q = statistics.quantiles(samples, n=100)
+    return {"p50_ms": q[49] * 1000, "p95_ms": q[94] * 1000, "p99_ms": q[98] * 1000}
+
+
+def bench_size(client, size: int, tenants: int, dim: int, queries: int, k: int, seed: int) -> Dict:
+    rng = random.Random(seed)
+    single = client.create_collection(f"single_{size}")
+    parts = [client.create_collection(f"part_{size}_{t}") for t in range(tenants)]
+
+    # Mismo corpus en ambos layouts
+    rows = []
+    for i in range(size):
+        t = i % tenants
+        rows.append((f"v{i}", _vec(rng, dim), {"user_id": t, "thread_id": f"t{t}"}))
+    for i in range(0, size, _BATCH):
+        chunk = rows[i : i + _BATCH]
+        single.add(
+            ids=[r[0] for r in chunk],
+            embeddings=[r[1] for r in chunk],
+            metadatas=[r[2] for r in chunk],
+        )
+    for t in range(tenants):
+        mine = rows[t::tenants]
+        for i in range(0, len(mine), _BATCH):
+            chunk = mine[i : i + _BATCH]
+            parts[t].add(
+                ids=[r[0] for r in chunk],
+                embeddings=[r[1] for r in chunk],
+                metadatas=[r[2] for r in chunk],
+            )
+
+    single_lat, part_lat = [], []
+    for _ in range(queries):
+        t = rng.randrange(tenants)
+        q = _vec(rng, dim)
+        where = {"$and": [{"user_id": {"$eq": t}}, {"thread_id": {"$eq": f"t{t}"}}]}
+        t0 = time.perf_counter()
+        single.query(query_embeddings=[q], n_results=k, where=where)
+        single_lat.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        parts[t].query(query_embeddings=[q], n_results=k)
+        part_lat.append(time.perf_counter() - t0)
+
+    return {
+        "size": size,
+        "tenants": tenants,
+        "single_filtered": _percentiles(single_lat),
+        "partitioned": _percentiles(part_lat),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de particionado de vectores")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--tenants", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=None, help="Guardar resultados en JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'vectores':>10} {'único p50':>11} {'único p95':>11} {'part. p50':>11} {'part. p95':>11}")
+    with tempfile.TemporaryDirectory(prefix="bench_partitions_") as tmp:
+        client = chromadb.PersistentClient(path=tmp)
+        for size in args.sizes:
+            r = bench_size(client, size, args.tenants, args.dim, args.queries, args.k, args.seed)
+            results.append(r)
+            s, p = r["single_filtered"], r["partitioned"]
+            print(
+                f"{size:>10} {s['p50_ms']:>9.2f}ms {s['p95_ms']:>9.2f}ms "
+                f"{p['p50_ms']:>9.2f}ms {p['p95_ms']:>9.2f}ms"
+            )
+
+    if args.out:
+        meta = {k: v for k, v in vars(args).items() if k != "out"}
+        args.out.write_text(json.dumps({"args": meta, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
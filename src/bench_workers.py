@@ -0,0 +1,127 @@
+# Escalado multi-proceso.
+# Para cada cantidad de workers W corre W procesos de loadgen en paralelo sobre
+# el mismo estado compartido (app.db, chat.db y un servidor de Chroma), igual
+# que serve.py, y reporta throughput agregado, speedup y eficiencia respecto
+# de W=1. Con los modelos falsos (sin red) mide el costo de CPU de la app y la
+# contención entre procesos.
+#
+#   uv run python src/bench_workers.py --workers 1 2 4 --users 10 --turns 5
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+from loadgen import REPO_ROOT, prepare_workdir
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _init_shared(workdir: str) -> None:
+    """Crea los esquemas una sola vez, antes de que arranquen los workers."""
+    prepare_workdir(Path(workdir))
+    from db import init_db
+    from startup import warm_up
+
+    init_db()
+    warm_up(["memory_db", "checkpointer"])
+
+
+def _worker(index: int, workdir: str, args: argparse.Namespace, barrier) -> Dict[str, Any]:
+    os.environ["WORKER_INDEX"] = str(index)
+    prepare_workdir(Path(workdir))
+    from loadgen import run_load
+
+    args.user_prefix = f"w{index}"
+    args.seed = index
+    return run_load(args, ready=barrier.wait)
+
+
+def run_workers(n: int, args: argparse.Namespace) -> Dict[str, Any]:
+    from serve import start_chroma_server
+
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix=f"bench_workers_{n}_") as workdir:
+        port = _free_port()
+        chroma = start_chroma_server(str(Path(workdir) / "chroma"), "127.0.0.1", port)
+        os.environ["CHROMA_SERVER_HOST"] = "127.0.0.1"
+        os.environ["CHROMA_SERVER_PORT"] = str(port)
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                pool.submit(_init_shared, workdir).result()
+            with ctx.Manager() as manager:
+                barrier = manager.Barrier(n)
+                with ProcessPoolExecutor(max_workers=n, mp_context=ctx) as pool:
+                    futures = [pool.submit(_worker, i, workdir, args, barrier) for i in range(n)]
+                    results = [f.result() for f in futures]
+        finally:
+            chroma.terminate()
+            chroma.wait()
+            os.chdir(REPO_ROOT)
+
+    start = min(r["started_at"] for r in results)
+    end = max(r["started_at"] + r["wall_s"] for r in results)
+    turns = sum(r["turns"] for r in results)
+    # Latencias combinadas a partir de los percentiles de cada worker (aproximado)
+    p50 = sorted(r["end_to_end"]["p50_ms"] for r in results)
+    p95 = max(r["end_to_end"]["p95_ms"] for r in results)
+    return {
+        "workers": n,
+        "turns": turns,
+        "errors": sum(r["errors"] for r in results),
+        "wall_s": end - start,
+        "throughput_turns_s": turns / (end - start) if end > start else 0.0,
+        "p50_ms": p50[len(p50) // 2],
+        "p95_ms": p95,
+        "per_worker": [r["throughput_turns_s"] for r in results],
+    }
+
+
+def print_scaling(rows: List[Dict[str, Any]]) -> None:
+    base = rows[0]["throughput_turns_s"] / rows[0]["workers"] if rows else 0.0
+    print(
+        f"{'workers':>7} {'turnos':>7} {'err':>4} {'turnos/s':>9} {'speedup':>8} "
+        f"{'eficiencia':>10} {'p50':>9} {'p95':>9}"
+    )
+    for r in rows:
+        speedup = r["throughput_turns_s"] / base if base else 0.0
+        print(
+            f"{r['workers']:>7} {r['turns']:>7} {r['errors']:>4} {r['throughput_turns_s']:>9.2f} "
+            f"{speedup:>7.2f}x {speedup / r['workers']:>10.0%} "
+            f"{r['p50_ms']:>7.1f}ms {r['p95_ms']:>7.1f}ms"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Escalado del throughput con varios workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=10, help="Usuarios por worker")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--mode", choices=["bot", "graph"], default="bot")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Media (s) entre turnos")
+    parser.add_argument("--concurrency-limit", type=int, default=5, help="Por worker; 0 = sin límite")
+    parser.add_argument("--no-docs", action="store_true", help="Hilos sin documentos indexados")
+    parser.add_argument("--out", type=Path, default=None, help="Guardar resultados en JSON")
+    args = parser.parse_args()
+    out = args.out.resolve() if args.out else None
+
+    rows = []
+    for n in args.workers:
+        rows.append(run_workers(n, args))
+        print(f"{n} workers listo")
+    print_scaling(rows)
+    if out:
+        out.write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# Almacén de archivos subidos por contenido.
+# store() lee el archivo subido una sola vez: cada bloque se hashea y se
+# escribe a un temporal dentro de BLOBS_DIR, que al terminar se renombra
+# (atómico) a blobs/ab/cdef… según su SHA-256. Si el blob ya existía se
+# descarta el temporal. Con el hash en la mano, ingest.py detecta un archivo
+# repetido en el chat antes de parsearlo.
+# El directorio del hilo recibe un hardlink al blob (link_into), así que el
+# mismo PDF subido en varios chats ocupa disco una sola vez y borrar un hilo
+# (rmtree) solo quita enlaces. Un blob con st_nlink == 1 ya no lo usa nadie:
+# collect() lo elimina pasado BLOB_GRACE, el margen entre store() y el enlace.
+#
+#   uv run python src/blobs.py gc --dry-run
+
+import argparse
+import hashlib
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from db import UPLOADS_DIR
+from metrics import UPLOADS
+
+# Debe estar en el mismo sistema de archivos que UPLOADS_DIR para poder enlazar
+BLOBS_DIR = Path(os.getenv("BLOBS_DIR", str(UPLOADS_DIR / "blobs")))
+BLOB_CHUNK = int(os.getenv("BLOB_CHUNK", str(1 << 20)))
+BLOB_GRACE = int(os.getenv("BLOB_GRACE", "3600"))
+
+
+def blob_path(sha256: str) -> Path:
+    return BLOBS_DIR / sha256[:2] / sha256[2:]
+
+
+def store(src: str) -> Tuple[str, Path]:
+    """Copia `src` al almacén en una sola lectura. Devuelve (sha256, ruta del blob)."""
+    tmp_dir = BLOBS_DIR / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp = tmp_dir / f"{os.getpid()}-{time.monotonic_ns()}"
+    h = hashlib.sha256()
+    try:
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            for chunk in iter(lambda: fin.read(BLOB_CHUNK), b""):
+                h.update(chunk)
+                fout.write(chunk)
+        sha = h.hexdigest()
+        dest = blob_path(sha)
+        if dest.exists():
+            # Se renueva el mtime para que collect() no lo borre antes del enlace
+            os.utime(dest)
+            UPLOADS.inc(result="blob_existente")
+        else:
+            dest.parent.mkdir(exist_ok=True)
+            os.replace(tmp, dest)
+            UPLOADS.inc(result="nuevo")
+    finally:
+        tmp.unlink(missing_ok=True)
+    return sha, dest
+
+
+def link_into(blob: Path, dest: Path) -> None:
+    """Enlaza el blob en `dest`, reemplazando lo que hubiera con ese nombre."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # rename() entre dos enlaces del mismo archivo no hace nada y dejaría el temporal
+    if dest.exists() and os.path.samefile(blob, dest):
+        return
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(blob, tmp)
+    except OSError:
+        # Sin hardlinks (otro dispositivo, FS que no los soporta): copia
+        shutil.copyfile(blob, tmp)
+    os.replace(tmp, dest)
+
+
+def collect(dry_run: bool = True, grace: float = BLOB_GRACE) -> Dict[str, Any]:
+    """Blobs sin enlaces desde ningún hilo; si dry_run es False, los borra."""
+    cutoff = time.time() - grace
+    found, size = 0, 0
+    if not BLOBS_DIR.exists():
+        return {"blobs": 0, "blob_bytes": 0}
+    for d in BLOBS_DIR.iterdir():
+        if d.name == "tmp" or not d.is_dir():
+            continue
+        for entry in os.scandir(d):
+            # Otro proceso puede borrarlo a la vez (collect en paralelo)
+            try:
+                st = entry.stat(follow_symlinks=False)
+                if st.st_nlink > 1 or st.st_mtime > cutoff:
+                    continue
+                if not dry_run:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                continue
+            found += 1
+            size += st.st_size
+    # Temporales de store() interrumpidos; store() borra los suyos al terminar
+    for tmp in (BLOBS_DIR / "tmp").glob("*"):
+        try:
+            if tmp.stat().st_mtime < cutoff and not dry_run:
+                tmp.unlink()
+        except FileNotFoundError:
+            pass
+    return {"blobs": found, "blob_bytes": size}
+
+
+# CLI
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Almacén de archivos por contenido")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_gc = sub.add_parser("gc", help="Borra blobs que ningún hilo enlaza")
+    p_gc.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.cmd == "gc":
+        report = collect(dry_run=args.dry_run)
+        verb = "Se eliminarían" if args.dry_run else "Eliminados"
+        print(f"{verb}: {report['blobs']} blobs ({report['blob_bytes'] / 1e6:.1f} MB)")
@@ -0,0 +1,233 @@
+# Retención y compactación de checkpoints de LangGraph en chat.db.
+# SqliteSaver escribe un checkpoint completo (con todos los mensajes) en cada nodo
+# de cada turno. Solo el último es necesario para continuar un hilo, así que se
+# conservan los últimos CHECKPOINT_KEEP_LAST por hilo y se borra el resto junto
+# con sus writes. El espacio se devuelve al sistema con VACUUM incremental.
+
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DB_PATH = Path(os.getenv("CHECKPOINT_DB_PATH", "chat.db"))
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "1"))
+CHECKPOINT_COMPACT_INTERVAL = int(os.getenv("CHECKPOINT_COMPACT_INTERVAL", "600"))
+# Páginas liberadas por pasada de VACUUM incremental (4 KiB c/u por defecto)
+CHECKPOINT_VACUUM_PAGES = int(os.getenv("CHECKPOINT_VACUUM_PAGES", "2000"))
+
+
+def _conn(path: Path = CHECKPOINT_DB_PATH) -> sqlite3.Connection:
+    """Conexión propia (no la del SqliteSaver) con espera ante bloqueos."""
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _has_tables(c: sqlite3.Connection) -> bool:
+    rows = c.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name IN ('checkpoints','writes')"
+    ).fetchall()
+    return len(rows) == 2
+
+
+def prune_checkpoints(
+    keep: int = CHECKPOINT_KEEP_LAST,
+    thread_id: Optional[str] = None,
+    path: Path = CHECKPOINT_DB_PATH,
+) -> Dict[str, int]:
+    """
+    Borra los checkpoints superados, conservando los `keep` más recientes por
+    hilo y namespace, y los writes que quedan huérfanos.
+
+    Los checkpoint_id son UUIDv6, por lo que el orden lexicográfico es cronológico.
+    """
+    if keep < 1:
+        raise ValueError("keep debe ser >= 1")
+    with _conn(path) as c:
+        if not _has_tables(c):
+            return {"checkpoints": 0, "writes": 0}
+        where = "WHERE thread_id = ?" if thread_id else ""
+        params: List[Any] = [thread_id] if thread_id else []
+        cur = c.execute(
+            f"""
+            DELETE FROM checkpoints WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, ROW_NUMBER() OVER (
+                        PARTITION BY thread_id, checkpoint_ns
+                        ORDER BY checkpoint_id DESC
+                    ) AS rn
+                    FROM checkpoints {where}
+                ) WHERE rn > ?
+            )
+            """,
+            params + [keep],
+        )
+        deleted_checkpoints = cur.rowcount
+        cur = c.execute(
+            f"""
+            DELETE FROM writes {where.replace("thread_id", "writes.thread_id")}
+            {"AND" if where else "WHERE"} NOT EXISTS (
+                SELECT 1 FROM checkpoints cp
+                WHERE cp.thread_id = writes.thread_id
+                  AND cp.checkpoint_ns = writes.checkpoint_ns
+                  AND cp.checkpoint_id = writes.checkpoint_id
+            )
+            """,
+            params,
+        )
+        deleted_writes = cur.rowcount
+    return {"checkpoints": deleted_checkpoints, "writes": deleted_writes}
+
+
+def incremental_vacuum(
+    pages: int = CHECKPOINT_VACUUM_PAGES, path: Path = CHECKPOINT_DB_PATH
+) -> int:
+    """
+    Devuelve hasta `pages` páginas libres al sistema de archivos.
+
+    La primera vez convierte la base a auto_vacuum=INCREMENTAL, lo que requiere
+    un VACUUM completo; las siguientes pasadas son acotadas y no bloquean
+    la base por mucho tiempo.
+    """
+    c = _conn(path)
+    try:
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.info("chat.db: activando auto_vacuum incremental (VACUUM completo)")
+            c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            c.execute("VACUUM")
+        free_before = c.execute("PRAGMA freelist_count").fetchone()[0]
+        c.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        free_after = c.execute("PRAGMA freelist_count").fetchone()[0]
+        c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return free_before - free_after
+    finally:
+        c.close()
+
+
+def compact(
+    keep: int = CHECKPOINT_KEEP_LAST,
+    pages: int = CHECKPOINT_VACUUM_PAGES,
+    path: Path = CHECKPOINT_DB_PATH,
+) -> Dict[str, int]:
+    """Una pasada de compactación: poda + VACUUM incremental."""
+    stats = prune_checkpoints(keep=keep, path=path)
+    stats["pages_freed"] = incremental_vacuum(pages=pages, path=path)
+    return stats
+
+
+def checkpoint_report(path: Path = CHECKPOINT_DB_PATH) -> List[Dict[str, Any]]:
+    """Bytes y cantidad de checkpoints/writes por hilo, de mayor a menor."""
+    with _conn(path) as c:
+        if not _has_tables(c):
+            return []
+        rows = c.execute(
+            """
+            SELECT cp.thread_id,
+                   cp.n_checkpoints,
+                   cp.checkpoint_bytes,
+                   COALESCE(w.n_writes, 0) AS n_writes,
+                   COALESCE(w.write_bytes, 0) AS write_bytes
+            FROM (
+                SELECT thread_id,
+                       COUNT(*) AS n_checkpoints,
+                       SUM(LENGTH(checkpoint) + COALESCE(LENGTH(metadata), 0)) AS checkpoint_bytes
+                FROM checkpoints GROUP BY thread_id
+            ) cp
+            LEFT JOIN (
+                SELECT thread_id, COUNT(*) AS n_writes,
+                       SUM(COALESCE(LENGTH(value), 0)) AS write_bytes
+                FROM writes GROUP BY thread_id
+            ) w ON w.thread_id = cp.thread_id
+            ORDER BY cp.checkpoint_bytes + COALESCE(w.write_bytes, 0) DESC
+            """
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+
+def checkpoint_thread_ids(path: Path = CHECKPOINT_DB_PATH) -> Set[str]:
+    """Hilos que tienen al menos un checkpoint."""
+    with _conn(path) as c:
+        if not _has_tables(c):
+            return set()
+        return {r[0] for r in c.execute("SELECT DISTINCT thread_id FROM checkpoints")}
+
+
+class CheckpointCompactor:
+    """Hilo en segundo plano que compacta chat.db periódicamente."""
+
+    def __init__(
+        self,
+        interval: int = CHECKPOINT_COMPACT_INTERVAL,
+        keep: int = CHECKPOINT_KEEP_LAST,
+        path: Path = CHECKPOINT_DB_PATH,
+    ):
+        self.interval = interval
+        self.keep = keep
+        self.path = path
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                stats = compact(keep=self.keep, path=self.path)
+                if stats["checkpoints"] or stats["pages_freed"]:
+                    logger.info(f"Compactación de checkpoints: {stats}")
+            except Exception as e:
+                logger.error(f"Error compactando checkpoints: {e}")
+
+    def start(self) -> "CheckpointCompactor":
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="checkpoint-compactor", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _fmt_bytes(n: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TiB"
+
+
+# CLI
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento de checkpoints (chat.db)")
+    parser.add_argument("--db", type=Path, default=CHECKPOINT_DB_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_report = sub.add_parser("report", help="Bytes de checkpoints por hilo")
+    p_report.add_argument("--top", type=int, default=20)
+    p_prune = sub.add_parser("prune", help="Borra checkpoints superados")
+    p_prune.add_argument("--keep", type=int, default=CHECKPOINT_KEEP_LAST)
+    p_prune.add_argument("--thread", default=None)
+    p_vacuum = sub.add_parser("vacuum", help="VACUUM incremental")
+    p_vacuum.add_argument("--pages", type=int, default=CHECKPOINT_VACUUM_PAGES)
+    args = parser.parse_args()
+
+    if args.cmd == "report":
+        rows = checkpoint_report(args.db)
+        total = sum(r["checkpoint_bytes"] + r["write_bytes"] for r in rows)
+        print(f"{'thread_id':<38} {'ckpts':>6} {'writes':>7} {'bytes':>12}")
+        for r in rows[: args.top]:
+            size = r["checkpoint_bytes"] + r["write_bytes"]
+            print(
+                f"{r['thread_id']:<38} {r['n_checkpoints']:>6} {r['n_writes']:>7} {_fmt_bytes(size):>12}"
+            )
+        print(f"Hilos: {len(rows)}  Total: {_fmt_bytes(total)}")
+        if args.db.exists():
+            print(f"Archivo: {_fmt_bytes(args.db.stat().st_size)}")
+    elif args.cmd == "prune":
+        print(prune_checkpoints(keep=args.keep, thread_id=args.thread, path=args.db))
+    elif args.cmd == "vacuum":
+        print(f"Páginas liberadas: {incremental_vacuum(pages=args.pages, path=args.db)}")
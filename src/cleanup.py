@@ -0,0 +1,264 @@
+# Limpieza entre almacenes al eliminar un chat.
+# 1. db.delete_chat_by_thread deja una lápida (chat_tombstones) en la misma
+#    transacción que borra el chat.
+# 2. CleanupWorker procesa las lápidas en segundo plano: vectores hijos en Chroma,
+#    documentos padre en el docstore, checkpoints de LangGraph y copias en disco.
+# 3. Se verifica que no quede nada antes de marcar la lápida como 'done'.
+# collect_garbage() busca huérfanos de borrados anteriores (python src/db.py gc).
+# Los archivos del hilo son hardlinks a blobs (ver blobs.py): el worker borra
+# después los blobs que quedaron sin enlaces.
+
+import logging
+import queue
+import shutil
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from langchain_core.runnables import RunnableConfig
+
+import blobs
+from checkpoints import checkpoint_thread_ids
+from db import (
+    UPLOADS_DIR,
+    delete_orphan_rows,
+    list_live_threads,
+    list_tombstones,
+    mark_tombstone,
+    thread_upload_dir,
+)
+from graph import get_checkpointer, get_docstore, get_partitions
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de página al recorrer la colección de Chroma
+_SCAN_BATCH = 5000
+MAX_CLEANUP_ATTEMPTS = 5
+
+
+def _thread_filter(thread_id: str) -> Dict[str, Any]:
+    return {"thread_id": {"$eq": str(thread_id)}}
+
+
+def _child_vectors(user_id: int, thread_id: str) -> Dict[str, Set[str]]:
+    """IDs de vectores hijos del hilo y los doc_id de sus padres."""
+    child_vs = get_partitions().peek(user_id, thread_id)
+    if child_vs is None:
+        return {"ids": set(), "parents": set()}
+    got = child_vs.get(where=_thread_filter(thread_id), include=["metadatas"])
+    parents = {m.get("doc_id") for m in got["metadatas"] if m and m.get("doc_id")}
+    return {"ids": set(got["ids"]), "parents": parents}
+
+
+def _delete_checkpoints(thread_id: str) -> None:
+    get_checkpointer().delete_thread(str(thread_id))
+
+
+def _has_checkpoints(thread_id: str) -> bool:
+    cfg = RunnableConfig({"configurable": {"thread_id": str(thread_id)}})
+    return get_checkpointer().get_tuple(cfg) is not None
+
+
+def purge_thread(thread_id: str, user_id: int) -> Set[str]:
+    """Borra todos los datos de un hilo fuera de app.db. Devuelve los padres borrados."""
+    found = _child_vectors(user_id, thread_id)
+    if found["ids"]:
+        get_partitions().get(user_id, thread_id).delete(ids=list(found["ids"]))
+    if found["parents"]:
+        get_docstore().mdelete(list(found["parents"]))
+    get_partitions().drop(user_id, thread_id)
+    _delete_checkpoints(thread_id)
+    shutil.rmtree(thread_upload_dir(user_id, thread_id), ignore_errors=True)
+    return found["parents"]
+
+
+def verify_purged(
+    thread_id: str, user_id: int, parent_ids: Iterable[str] = ()
+) -> List[str]:
+    """
+    Devuelve la lista de almacenes que todavía tienen datos del hilo.
+    `parent_ids` son los padres que purge_thread debía borrar del docstore.
+    """
+    leftovers = []
+    child_vs = get_partitions().peek(user_id, thread_id)
+    if child_vs is not None and child_vs.get(where=_thread_filter(thread_id), limit=1)["ids"]:
+        leftovers.append("chroma")
+    if _has_checkpoints(thread_id):
+        leftovers.append("checkpoints")
+    if thread_upload_dir(user_id, thread_id).exists():
+        leftovers.append("archivos")
+    if parent_ids and any(d is not None for d in get_docstore().mget(list(parent_ids))):
+        leftovers.append("docstore")
+    return leftovers
+
+
+def process_tombstone(tombstone: Dict[str, Any]) -> bool:
+    """Limpia y verifica un chat eliminado. Devuelve True si quedó limpio."""
+    thread_id, user_id = tombstone["thread_id"], int(tombstone["user_id"])
+    try:
+        parents = purge_thread(thread_id, user_id)
+        leftovers = verify_purged(thread_id, user_id, parents)
+        if leftovers:
+            raise RuntimeError(f"quedan datos en: {', '.join(leftovers)}")
+        mark_tombstone(thread_id, "done")
+        logger.info(f"Hilo {thread_id} eliminado de todos los almacenes")
+        return True
+    except Exception as e:
+        failed = tombstone.get("attempts", 0) + 1 >= MAX_CLEANUP_ATTEMPTS
+        mark_tombstone(thread_id, "failed" if failed else "pending", str(e))
+        logger.error(f"Error limpiando hilo {thread_id}: {e}")
+        return False
+
+
+class CleanupWorker:
+    """Procesa en segundo plano las lápidas de chats eliminados."""
+
+    def __init__(self, retry_interval: int = 300):
+        self.retry_interval = retry_interval
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, thread_id: str) -> None:
+        self._queue.put(thread_id)
+
+    def _drain_pending(self) -> None:
+        for t in list_tombstones("pending"):
+            process_tombstone(t)
+
+    def _run(self) -> None:
+        # Al arrancar se retoman las lápidas que quedaron pendientes
+        self._drain_pending()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.retry_interval)
+            except queue.Empty:
+                item = ""
+            if item is None:
+                return
+            try:
+                self._drain_pending()
+                blobs.collect(dry_run=False)
+            except Exception as e:
+                logger.error(f"Error en limpieza de chats: {e}")
+
+    def start(self) -> "CleanupWorker":
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="chat-cleanup", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._queue.put(None)
+
+
+# -----------------------------
+# Recolección de huérfanos
+# -----------------------------
+
+
+def _scan_vectors() -> Dict[str, Dict[str, Any]]:
+    """Agrupa todos los vectores de todas las colecciones de hijos por thread_id."""
+    by_thread: Dict[str, Dict[str, Any]] = {}
+    for child_vs in get_partitions().all_stores():
+        offset = 0
+        while True:
+            got = child_vs.get(include=["metadatas"], limit=_SCAN_BATCH, offset=offset)
+            if not got["ids"]:
+                break
+            for vid, meta in zip(got["ids"], got["metadatas"]):
+                meta = meta or {}
+                entry = by_thread.setdefault(
+                    str(meta.get("thread_id")), {"ids": [], "parents": set()}
+                )
+                entry["ids"].append((child_vs, vid))
+                if meta.get("doc_id"):
+                    entry["parents"].add(meta["doc_id"])
+            offset += len(got["ids"])
+    return by_thread
+
+
+def collect_garbage(dry_run: bool = True) -> Dict[str, Any]:
+    """
+    Busca datos de hilos que ya no existen en app.db y, si dry_run es False,
+    los elimina. Devuelve un reporte con lo encontrado en cada almacén.
+    """
+    # Primero se recorren los almacenes y al final se leen los chats vivos: lo
+    # creado durante el recorrido pertenece a un chat que ya está en `live`.
+    # Los padres van antes que los vectores porque la ingesta escribe los hijos
+    # primero: un padre ya escrito tiene sus hijos visibles en _scan_vectors().
+    parent_keys = list(get_docstore().yield_keys())
+    by_thread = _scan_vectors()
+    ckpt_threads = checkpoint_thread_ids()
+    upload_dirs = list(UPLOADS_DIR.glob("*/thread_*")) if UPLOADS_DIR.exists() else []
+    live = list_live_threads()
+    report: Dict[str, Any] = {}
+
+    # Vectores hijos de hilos inexistentes
+    orphan_vectors = {t: e for t, e in by_thread.items() if t not in live}
+    live_parents = set().union(
+        *(e["parents"] for t, e in by_thread.items() if t in live)
+    )
+    report["chroma_threads"] = len(orphan_vectors)
+    report["chroma_vectors"] = sum(len(e["ids"]) for e in orphan_vectors.values())
+
+    # Padres no referenciados por ningún vector de un hilo vivo
+    orphan_parents = [k for k in parent_keys if k not in live_parents]
+    report["parent_docs"] = len(orphan_parents)
+
+    # Checkpoints de hilos inexistentes
+    orphan_ckpts = sorted(ckpt_threads - set(live))
+    report["checkpoint_threads"] = len(orphan_ckpts)
+
+    # Directorios test_data/{user_id}/thread_{thread_id} sin chat
+    orphan_dirs = [
+        d for d in upload_dirs if d.is_dir() and d.name.removeprefix("thread_") not in live
+    ]
+    report["upload_dirs"] = [str(d) for d in orphan_dirs]
+    report["upload_bytes"] = sum(
+        f.stat().st_size for d in orphan_dirs for f in d.rglob("*") if f.is_file()
+    )
+
+    report["app_db_rows"] = delete_orphan_rows(dry_run=dry_run)
+
+    if dry_run:
+        report.update(blobs.collect(dry_run=True))
+        return report
+
+    by_store: Dict[int, Any] = {}
+    for e in orphan_vectors.values():
+        for child_vs, vid in e["ids"]:
+            by_store.setdefault(id(child_vs), (child_vs, []))[1].append(vid)
+    for child_vs, ids in by_store.values():
+        for i in range(0, len(ids), _SCAN_BATCH):
+            child_vs.delete(ids=ids[i : i + _SCAN_BATCH])
+    for i in range(0, len(orphan_parents), _SCAN_BATCH):
+        get_docstore().mdelete(orphan_parents[i : i + _SCAN_BATCH])
+    for thread_id in orphan_ckpts:
+        _delete_checkpoints(thread_id)
+    for d in orphan_dirs:
+        shutil.rmtree(d, ignore_errors=True)
+    for t in list_tombstones("pending") + list_tombstones("failed"):
+        process_tombstone(t)
+    # Después de borrar directorios: sus blobs quedan sin enlaces
+    report.update(blobs.collect(dry_run=False))
+    return report
+
+
+def print_gc_report(report: Dict[str, Any], dry_run: bool) -> None:
+    """Imprime el reporte de collect_garbage."""
+    verb = "Se eliminarían" if dry_run else "Eliminados"
+    print(f"{verb}:")
+    print(
+        f"  - Chroma: {report['chroma_vectors']} vectores de {report['chroma_threads']} hilos"
+    )
+    print(f"  - Docstore: {report['parent_docs']} documentos padre")
+    print(f"  - Checkpoints: {report['checkpoint_threads']} hilos")
+    print(
+        f"  - Archivos: {len(report['upload_dirs'])} directorios ({report['upload_bytes'] / 1e6:.1f} MB)"
+    )
+    print(f"  - Blobs: {report['blobs']} sin enlaces ({report['blob_bytes'] / 1e6:.1f} MB)")
+    rows = report["app_db_rows"]
+    print(f"  - app.db: {rows['messages']} mensajes, {rows['files']} archivos")
+    if dry_run:
+        print("Ejecutar sin --dry-run para aplicar.")
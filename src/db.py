@@ -1,7 +1,6 @@
 # Persistir solo usuarios, chats (con thread_id único) y archivos. No hay tabla de mensajes separada (mensajes en chats).
 from getpass import getpass
 import uuid
-import bcrypt
 import os
 import sys
 import sqlite3
@@ -9,10 +8,15 @@ import time
 import json
 import hashlib
 from pathlib import Path
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Tuple
+
+import auth
+from metrics import DB_SECONDS, timed
 
 # Ruta de la base de datos
 DB_PATH = Path(os.getenv("APP_DB_PATH", "app.db"))
+# Directorio raíz de las copias de los archivos subidos
+UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", "test_data"))
 
 SCHEMA = """
 PRAGMA journal_mode=WAL;
@@ -32,6 +36,12 @@ CREATE TABLE IF NOT EXISTS chats (
   title TEXT NOT NULL,
   created_at REAL NOT NULL DEFAULT (strftime('%s','now')),
   updated_at REAL NOT NULL DEFAULT (strftime('%s','now')),
+  -- Documentos indexados en el hilo; 0 = el grafo no ofrece la búsqueda
+  doc_count INTEGER NOT NULL DEFAULT 0,
+  -- Con HISTORY_STORE=messages (history.py): resumen de los turnos viejos y
+  -- último messages.id que incluye
+  summary TEXT NOT NULL DEFAULT '',
+  summary_upto INTEGER NOT NULL DEFAULT 0,
   FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
@@ -62,16 +72,67 @@ CREATE TABLE IF NOT EXISTS files (
   UNIQUE(sha256, chat_id, user_id)
 );
 
+-- Ingestas de PDFs grandes en curso (ver ingest.py): hasta qué página quedó
+-- indexado, cuántos padres se escribieron y el texto que falta cortar. La fila
+-- se borra al terminar; si el proceso `owner` murió, se retoma desde next_page.
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+  thread_id TEXT NOT NULL,
+  sha256 TEXT NOT NULL,
+  user_id INTEGER NOT NULL,
+  source TEXT NOT NULL,
+  pages INTEGER NOT NULL,
+  next_page INTEGER NOT NULL DEFAULT 0,
+  parents INTEGER NOT NULL DEFAULT 0,
+  carry TEXT NOT NULL DEFAULT '',
+  carry_page INTEGER NOT NULL DEFAULT 0,
+  owner INTEGER,
+  updated_at REAL NOT NULL DEFAULT (strftime('%s','now')),
+  PRIMARY KEY (thread_id, sha256),
+  FOREIGN KEY (thread_id) REFERENCES chats(thread_id) ON DELETE CASCADE
+);
+
+-- Lápidas de chats eliminados: la limpieza en Chroma, docstore, checkpoints y
+-- disco se hace en segundo plano (ver cleanup.py)
+CREATE TABLE IF NOT EXISTS chat_tombstones (
+  thread_id TEXT PRIMARY KEY,
+  user_id INTEGER NOT NULL,
+  deleted_at REAL NOT NULL DEFAULT (strftime('%s','now')),
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT,
+  completed_at REAL
+);
+
+-- Tokens consumidos, agregados por día/usuario/hilo/nodo/modelo (ver usage.py).
+-- Sin claves foráneas: el historial de consumo sobrevive al borrado de chats.
+CREATE TABLE IF NOT EXISTS usage (
+  day TEXT NOT NULL,
+  user_id INTEGER NOT NULL,
+  thread_id TEXT NOT NULL,
+  node TEXT NOT NULL,
+  model TEXT NOT NULL,
+  calls INTEGER NOT NULL DEFAULT 0,
+  input_tokens INTEGER NOT NULL DEFAULT 0,
+  output_tokens INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, user_id, thread_id, node, model)
+);
+
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
+CREATE INDEX IF NOT EXISTS idx_usage_user ON usage(user_id, day);
+CREATE INDEX IF NOT EXISTS idx_usage_thread ON usage(thread_id);
 CREATE INDEX IF NOT EXISTS idx_chats_user ON chats(user_id, updated_at);
 CREATE INDEX IF NOT EXISTS idx_files_user ON files(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, id);
 """
 
 
 def _conn() -> sqlite3.Connection:
     """Establece conexión con la base de datos."""
-    conn = sqlite3.connect(DB_PATH)
+    # timeout: espera ante bloqueos de otros workers (serve.py)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
+    # Es por conexión: sin esto no se aplican los ON DELETE CASCADE
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
 
@@ -80,13 +141,28 @@ def init_db() -> None:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     with _conn() as c:
         c.executescript(SCHEMA)
+        _migrate(c)
+
+
+def _migrate(c: sqlite3.Connection) -> None:
+    """Columnas agregadas a bases creadas con versiones anteriores del esquema."""
+    chat_columns = {r["name"] for r in c.execute("PRAGMA table_info(chats)")}
+    if "doc_count" not in chat_columns:
+        c.execute("ALTER TABLE chats ADD COLUMN doc_count INTEGER NOT NULL DEFAULT 0")
+        c.execute(
+            "UPDATE chats SET doc_count = (SELECT COUNT(*) FROM files f WHERE f.chat_id = chats.id)"
+        )
+    if "summary" not in chat_columns:
+        c.execute("ALTER TABLE chats ADD COLUMN summary TEXT NOT NULL DEFAULT ''")
+        c.execute("ALTER TABLE chats ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
 
 
 # ---- Usuarios ----
+@timed(DB_SECONDS)
 def create_user(username: str, password: str) -> int:
     """Crea un nuevo usuario con contraseña hasheada."""
     with _conn() as c:
-        hash_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+        hash_password = auth.hash_password(password)
         cur = c.execute(
             "INSERT INTO users(username, hash_password) VALUES (?, ?)",
             (username, hash_password),
@@ -94,6 +170,7 @@ def create_user(username: str, password: str) -> int:
         return int(cur.lastrowid)
 
 
+@timed(DB_SECONDS)
 def get_user_id(username: str) -> Optional[int]:
     """Obtiene el ID de usuario dado su nombre de usuario."""
     with _conn() as c:
@@ -101,6 +178,7 @@ def get_user_id(username: str) -> Optional[int]:
         return int(r["id"]) if r else None
 
 
+@timed(DB_SECONDS)
 def list_users() -> List[Dict[str, Any]]:
     """Lista todos los usuarios registrados."""
     with _conn() as c:
@@ -112,6 +190,7 @@ def list_users() -> List[Dict[str, Any]]:
         ]
 
 
+@timed(DB_SECONDS)
 def list_chats(user_id: int) -> List[Dict[str, Any]]:
     """Lista los chats de un usuario específico."""
     q = """SELECT id, title, thread_id, created_at, updated_at 
@@ -120,6 +199,7 @@ def list_chats(user_id: int) -> List[Dict[str, Any]]:
         return [dict(r) for r in c.execute(q, (user_id,)).fetchall()]
 
 
+@timed(DB_SECONDS)
 def get_chat_by_id(id: int) -> Optional[Dict[str, Any]]:
     """Obtiene un chat por su ID numérico."""
     with _conn() as c:
@@ -127,6 +207,7 @@ def get_chat_by_id(id: int) -> Optional[Dict[str, Any]]:
         return dict(r) if r else None
 
 
+@timed(DB_SECONDS)
 def get_chat_by_thread(thread_id: str) -> Optional[Dict[str, Any]]:
     """Obtiene un chat por su thread_id."""
     with _conn() as c:
@@ -134,6 +215,7 @@ def get_chat_by_thread(thread_id: str) -> Optional[Dict[str, Any]]:
         return dict(r) if r else None
 
 
+@timed(DB_SECONDS)
 def get_chat_id_by_thread(thread_id: str) -> Optional[int]:
     """Obtiene el ID numérico de un chat dado su thread_id."""
     with _conn() as c:
@@ -141,6 +223,7 @@ def get_chat_id_by_thread(thread_id: str) -> Optional[int]:
         return r["id"] if r else None
 
 
+@timed(DB_SECONDS)
 def get_last_thread_id_for_user(user_id: int) -> Optional[str]:
     """Obtiene el thread_id del último chat modificado por el usuario."""
     with _conn() as c:
@@ -151,6 +234,7 @@ def get_last_thread_id_for_user(user_id: int) -> Optional[str]:
         return r["thread_id"] if r else None
 
 
+@timed(DB_SECONDS)
 def create_chat(user_id: int, title: str) -> int:
     """Crea un nuevo chat y devuelve su ID numérico."""
     now = time.time()
@@ -163,6 +247,18 @@ def create_chat(user_id: int, title: str) -> int:
         return int(cur.lastrowid)
 
 
+@timed(DB_SECONDS)
+def chats_version(user_id: int) -> Tuple[int, float]:
+    """Cantidad de chats del usuario y último updated_at; cambia con cualquier alta, baja o edición."""
+    with _conn() as c:
+        r = c.execute(
+            "SELECT COUNT(*) AS n, COALESCE(MAX(updated_at), 0) AS last FROM chats WHERE user_id=?",
+            (user_id,),
+        ).fetchone()
+        return int(r["n"]), float(r["last"])
+
+
+@timed(DB_SECONDS)
 def rename_chat(thread_id: str, title: str) -> None:
     """Renombra un chat existente."""
     with _conn() as c:
@@ -172,6 +268,7 @@ def rename_chat(thread_id: str, title: str) -> None:
         )
 
 
+@timed(DB_SECONDS)
 def touch_chat(thread_id: str) -> None:
     """Actualiza la fecha de modificación de un chat."""
     with _conn() as c:
@@ -180,13 +277,92 @@ def touch_chat(thread_id: str) -> None:
         )
 
 
+@timed(DB_SECONDS)
+def add_thread_documents(thread_id: str, count: int = 1) -> None:
+    """Suma (o resta, con count negativo) documentos indexados al hilo."""
+    with _conn() as c:
+        c.execute(
+            "UPDATE chats SET doc_count = MAX(0, doc_count + ?) WHERE thread_id=?",
+            (count, thread_id),
+        )
+
+
+@timed(DB_SECONDS)
+def thread_doc_count(thread_id: str) -> int:
+    """Cantidad de documentos indexados en el hilo (0 si no existe)."""
+    with _conn() as c:
+        r = c.execute("SELECT doc_count FROM chats WHERE thread_id=?", (thread_id,)).fetchone()
+        return int(r["doc_count"]) if r else 0
+
+
+@timed(DB_SECONDS)
 def delete_chat_by_thread(thread_id: str) -> None:
-    """Elimina un chat dado su thread_id."""
+    """Elimina un chat dado su thread_id y deja una lápida para limpiar el resto de almacenes."""
     with _conn() as c:
+        c.execute(
+            "INSERT OR REPLACE INTO chat_tombstones(thread_id, user_id, deleted_at) "
+            "SELECT thread_id, user_id, ? FROM chats WHERE thread_id=?",
+            (time.time(), thread_id),
+        )
         c.execute("DELETE FROM chats WHERE thread_id=?", (thread_id,))
 
 
+@timed(DB_SECONDS)
+def list_live_threads() -> Dict[str, int]:
+    """Devuelve {thread_id: user_id} de todos los chats existentes."""
+    with _conn() as c:
+        return {
+            r["thread_id"]: int(r["user_id"])
+            for r in c.execute("SELECT thread_id, user_id FROM chats").fetchall()
+        }
+
+
+@timed(DB_SECONDS)
+def list_tombstones(status: Optional[str] = "pending") -> List[Dict[str, Any]]:
+    """Lista las lápidas de chats eliminados (todas si status es None)."""
+    q = "SELECT * FROM chat_tombstones"
+    params: tuple = ()
+    if status is not None:
+        q += " WHERE status=?"
+        params = (status,)
+    with _conn() as c:
+        return [dict(r) for r in c.execute(q + " ORDER BY deleted_at ASC", params)]
+
+
+@timed(DB_SECONDS)
+def mark_tombstone(thread_id: str, status: str, error: Optional[str] = None) -> None:
+    """Actualiza el estado de limpieza de un chat eliminado."""
+    with _conn() as c:
+        c.execute(
+            "UPDATE chat_tombstones SET status=?, attempts=attempts+1, last_error=?, "
+            "completed_at=? WHERE thread_id=?",
+            (status, error, time.time() if status == "done" else None, thread_id),
+        )
+
+
+@timed(DB_SECONDS)
+def delete_orphan_rows(dry_run: bool = False) -> Dict[str, int]:
+    """Borra mensajes y archivos cuyo chat ya no existe."""
+    counts = {}
+    with _conn() as c:
+        for table in ("messages", "files"):
+            where = "WHERE chat_id NOT IN (SELECT id FROM chats)"
+            if dry_run:
+                counts[table] = c.execute(
+                    f"SELECT COUNT(*) FROM {table} {where}"
+                ).fetchone()[0]
+            else:
+                counts[table] = c.execute(f"DELETE FROM {table} {where}").rowcount
+    return counts
+
+
+def thread_upload_dir(user_id: int, thread_id: str) -> Path:
+    """Directorio donde se copian los archivos subidos a un hilo."""
+    return UPLOADS_DIR / str(user_id) / f"thread_{thread_id}"
+
+
 # Mensajes
+@timed(DB_SECONDS)
 def persist_message(
     content: str, role: str, type: str, chat_id: int, thread_id: str
 ) -> int:
@@ -200,17 +376,61 @@ def persist_message(
         return int(cur.lastrowid)
 
 
+@timed(DB_SECONDS)
 def load_chat_messages(chat_id: int) -> List[Dict[str, Any]]:
     """Carga todos los mensajes de un chat específico."""
     with _conn() as c:
         r = c.execute(
             """SELECT content, role, type, chat_id, thread_id, created_at 
-            FROM messages WHERE chat_id=? ORDER BY created_at ASC""",
+            FROM messages WHERE chat_id=? ORDER BY created_at ASC, id ASC""",
             (chat_id,),
         ).fetchall()
         return [dict(row) for row in r]
 
 
+@timed(DB_SECONDS)
+def load_thread_context(thread_id: str) -> Dict[str, Any]:
+    """Resumen del hilo y mensajes de texto posteriores a él (ver history.py)."""
+    with _conn() as c:
+        chat = c.execute(
+            "SELECT id, summary, summary_upto FROM chats WHERE thread_id=?", (thread_id,)
+        ).fetchone()
+        if chat is None:
+            return {"summary": "", "summary_upto": 0, "messages": []}
+        rows = c.execute(
+            """SELECT id, content, role FROM messages
+            WHERE chat_id=? AND id>? AND type='text' ORDER BY id""",
+            (chat["id"], chat["summary_upto"]),
+        ).fetchall()
+        return {
+            "summary": chat["summary"],
+            "summary_upto": chat["summary_upto"],
+            "messages": [dict(r) for r in rows],
+        }
+
+
+@timed(DB_SECONDS)
+def thread_user_messages(thread_id: str) -> List[Dict[str, Any]]:
+    """Mensajes de texto del usuario en el hilo (id y contenido), en orden."""
+    with _conn() as c:
+        rows = c.execute(
+            """SELECT m.id, m.content FROM messages m JOIN chats c ON c.id = m.chat_id
+            WHERE c.thread_id=? AND m.role='user' AND m.type='text' ORDER BY m.id""",
+            (thread_id,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+
+@timed(DB_SECONDS)
+def set_thread_summary(thread_id: str, summary: str, upto: int) -> None:
+    """Guarda el resumen del hilo y el último mensaje que cubre."""
+    with _conn() as c:
+        c.execute(
+            "UPDATE chats SET summary=?, summary_upto=? WHERE thread_id=?",
+            (summary, upto, thread_id),
+        )
+
+
 # ---- Archivos ----
 def _sha256(path: Path) -> str:
     """Calcula el hash SHA256 de un archivo."""
@@ -221,6 +441,7 @@ def _sha256(path: Path) -> str:
     return h.hexdigest()
 
 
+@timed(DB_SECONDS)
 def get_sha(id: int) -> str:
     """Obtiene el hash SHA256 de un archivo guardado."""
     with _conn() as c:
@@ -229,18 +450,31 @@ def get_sha(id: int) -> str:
         ]
 
 
+@timed(DB_SECONDS)
+def has_file(user_id: int, chat_id: int, sha256: str) -> bool:
+    """Indica si el chat ya tiene un archivo con ese contenido."""
+    with _conn() as c:
+        row = c.execute(
+            "SELECT 1 FROM files WHERE sha256=? AND chat_id=? AND user_id=?",
+            (sha256, chat_id, user_id),
+        ).fetchone()
+        return row is not None
+
+
+@timed(DB_SECONDS)
 def add_file(
     user_id: int,
     chat_id: int,
     original_name: str,
     stored_path: Path,
     meta: Optional[Dict] = None,
+    sha256: Optional[str] = None,
 ) -> int:
-    """Registra un nuevo archivo en la base de datos."""
+    """Registra un nuevo archivo. Si ya se conoce el `sha256`, no se vuelve a leer."""
     if meta is None:
         meta = {}
     now = time.time()
-    checksum = _sha256(stored_path) if stored_path.exists() else None
+    checksum = sha256 or (_sha256(stored_path) if stored_path.exists() else None)
     with _conn() as c:
         cur = c.execute(
             "INSERT OR IGNORE INTO files(user_id, chat_id, original_name, stored_path, sha256, created_at, meta) "
@@ -258,6 +492,7 @@ def add_file(
         return int(cur.lastrowid)
 
 
+@timed(DB_SECONDS)
 def get_files_by_chat_id(chat_id: int) -> List[Dict[str, Any]]:
     """Obtiene todos los archivos asociados a un chat."""
     q = """SELECT id, original_name, stored_path, created_at, meta 
@@ -266,12 +501,124 @@ def get_files_by_chat_id(chat_id: int) -> List[Dict[str, Any]]:
         return [dict(r) for r in c.execute(q, (chat_id,)).fetchall()]
 
 
+# ---- Ingestas en curso ----
+@timed(DB_SECONDS)
+def get_ingest_job(thread_id: str, sha256: str) -> Optional[Dict[str, Any]]:
+    with _conn() as c:
+        r = c.execute(
+            "SELECT * FROM ingest_jobs WHERE thread_id=? AND sha256=?", (thread_id, sha256)
+        ).fetchone()
+        return dict(r) if r else None
+
+
+@timed(DB_SECONDS)
+def list_ingest_jobs() -> List[Dict[str, Any]]:
+    with _conn() as c:
+        return [dict(r) for r in c.execute("SELECT * FROM ingest_jobs ORDER BY updated_at")]
+
+
+@timed(DB_SECONDS)
+def create_ingest_job(
+    thread_id: str, sha256: str, user_id: int, source: str, pages: int, owner: int
+) -> Dict[str, Any]:
+    """Crea la ingesta si no existe y devuelve su fila (nueva o la anterior)."""
+    with _conn() as c:
+        c.execute(
+            "INSERT OR IGNORE INTO ingest_jobs(thread_id, sha256, user_id, source, pages, owner, updated_at) "
+            "VALUES (?,?,?,?,?,?,?)",
+            (thread_id, sha256, user_id, source, pages, owner, time.time()),
+        )
+        r = c.execute(
+            "SELECT * FROM ingest_jobs WHERE thread_id=? AND sha256=?", (thread_id, sha256)
+        ).fetchone()
+        return dict(r)
+
+
+@timed(DB_SECONDS)
+def take_ingest_job(thread_id: str, sha256: str, owner: int, prev_owner: Optional[int]) -> bool:
+    """Pasa la ingesta a `owner` si su dueño sigue siendo `prev_owner`."""
+    with _conn() as c:
+        cur = c.execute(
+            "UPDATE ingest_jobs SET owner=?, updated_at=? WHERE thread_id=? AND sha256=? AND owner IS ?",
+            (owner, time.time(), thread_id, sha256, prev_owner),
+        )
+        return cur.rowcount == 1
+
+
+@timed(DB_SECONDS)
+def save_ingest_progress(
+    thread_id: str,
+    sha256: str,
+    owner: int,
+    next_page: int,
+    parents: int,
+    carry: str,
+    carry_page: int,
+) -> bool:
+    """Guarda el avance. False si la ingesta ya no existe (chat borrado) o cambió de dueño."""
+    with _conn() as c:
+        cur = c.execute(
+            "UPDATE ingest_jobs SET next_page=?, parents=?, carry=?, carry_page=?, updated_at=? "
+            "WHERE thread_id=? AND sha256=? AND owner=?",
+            (next_page, parents, carry, carry_page, time.time(), thread_id, sha256, owner),
+        )
+        return cur.rowcount == 1
+
+
+@timed(DB_SECONDS)
+def finish_ingest_job(thread_id: str, sha256: str) -> None:
+    with _conn() as c:
+        c.execute("DELETE FROM ingest_jobs WHERE thread_id=? AND sha256=?", (thread_id, sha256))
+
+
+# ---- Consumo de tokens ----
+@timed(DB_SECONDS)
+def add_usage(rows: List[Dict[str, Any]]) -> None:
+    """Acumula filas de consumo (day, user_id, thread_id, node, model, calls, tokens) en una transacción."""
+    with _conn() as c:
+        c.executemany(
+            """INSERT INTO usage(day, user_id, thread_id, node, model, calls, input_tokens, output_tokens)
+               VALUES (:day, :user_id, :thread_id, :node, :model, :calls, :input_tokens, :output_tokens)
+               ON CONFLICT(day, user_id, thread_id, node, model) DO UPDATE SET
+                 calls = calls + excluded.calls,
+                 input_tokens = input_tokens + excluded.input_tokens,
+                 output_tokens = output_tokens + excluded.output_tokens""",
+            rows,
+        )
+
+
+@timed(DB_SECONDS)
+def usage_by(group: str, since_day: str) -> List[Dict[str, Any]]:
+    """
+    Consumo agregado desde `since_day` (YYYY-MM-DD) agrupado por `group`
+    ('user', 'thread' o 'node') y modelo, con nombre de usuario y título del chat.
+    """
+    columns = {
+        "user": "u.user_id",
+        "thread": "u.user_id, u.thread_id",
+        "node": "u.node",
+    }[group]
+    q = f"""SELECT {columns}, u.model,
+                   MAX(us.username) AS username, MAX(ch.title) AS title,
+                   SUM(u.calls) AS calls,
+                   SUM(u.input_tokens) AS input_tokens,
+                   SUM(u.output_tokens) AS output_tokens
+            FROM usage u
+            LEFT JOIN users us ON us.id = u.user_id
+            LEFT JOIN chats ch ON ch.thread_id = u.thread_id
+            WHERE u.day >= ?
+            GROUP BY {columns}, u.model"""
+    with _conn() as c:
+        return [dict(r) for r in c.execute(q, (since_day,)).fetchall()]
+
+
 # CLI
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Uso:")
         print("  python src/db.py init")
         print("  python src/db.py add <username>")
+        print("  python src/db.py gc [--dry-run]")
         sys.exit(1)
 
     cmd = sys.argv[1]
@@ -298,6 +645,12 @@ if __name__ == "__main__":
             id = sys.argv[2]
             new_content = sys.argv[3]
             c.execute("UPDATE messages SET content = ? WHERE id = ?", (new_content, id))
+    elif cmd == "gc":
+        # Importación diferida: carga Chroma, docstore y checkpointer
+        from cleanup import collect_garbage, print_gc_report
+
+        dry_run = "--dry-run" in sys.argv[2:]
+        print_gc_report(collect_garbage(dry_run=dry_run), dry_run)
     elif cmd == "list":
         users = list_users()
         print("Usuarios:")
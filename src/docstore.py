@@ -0,0 +1,173 @@
+# Backends del docstore de documentos padre.
+# - "file": LocalFileStore("./parent"), un archivo por documento padre (por defecto).
+# - "sqlite": un único archivo SQLite con mget/mset en una sola consulta/transacción
+#   y compresión zstd opcional del contenido.
+# Migración: python src/docstore.py migrate --src ./parent --dst parent.db
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.stores import BaseStore
+from langchain_classic.storage import LocalFileStore
+
+try:
+    import zstandard
+except ImportError:  # compresión opcional
+    zstandard = None
+
+PARENT_STORE_BACKEND = os.getenv("PARENT_STORE_BACKEND", "file")
+PARENT_STORE_DIR = Path(os.getenv("PARENT_STORE_DIR", "./parent"))
+PARENT_STORE_DB = Path(os.getenv("PARENT_STORE_DB", "parent.db"))
+PARENT_STORE_COMPRESS = os.getenv("PARENT_STORE_COMPRESS", "0") == "1"
+
+# Límite de parámetros por consulta en SQLite
+_MAX_VARS = 900
+_CODEC_RAW = 0
+_CODEC_ZSTD = 1
+
+
+class SQLiteByteStore(BaseStore[str, bytes]):
+    """
+    Almacén clave/valor de bytes sobre un único archivo SQLite.
+
+    Cada hilo usa su propia conexión (WAL permite lecturas concurrentes).
+    Los valores se guardan comprimidos con zstd si `compress` es True; la
+    lectura acepta ambos formatos, por lo que se puede activar o desactivar
+    la compresión sin migrar.
+    """
+
+    def __init__(self, path: Path, compress: bool = False, level: int = 3):
+        if compress and zstandard is None:
+            raise ImportError("La compresión requiere el paquete 'zstandard'.")
+        self.path = Path(path)
+        self.compress = compress
+        self.level = level
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as c:
+            c.execute(
+                """CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    codec INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID"""
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _encode(self, value: bytes) -> Tuple[bytes, int]:
+        if not self.compress:
+            return value, _CODEC_RAW
+        cctx = getattr(self._local, "cctx", None)
+        if cctx is None:
+            cctx = self._local.cctx = zstandard.ZstdCompressor(level=self.level)
+        return cctx.compress(value), _CODEC_ZSTD
+
+    def _decode(self, value: bytes, codec: int) -> bytes:
+        if codec == _CODEC_RAW:
+            return value
+        if zstandard is None:
+            raise ImportError("Hay valores comprimidos y falta el paquete 'zstandard'.")
+        dctx = getattr(self._local, "dctx", None)
+        if dctx is None:
+            dctx = self._local.dctx = zstandard.ZstdDecompressor()
+        return dctx.decompress(value)
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        found = {}
+        c = self._conn()
+        for i in range(0, len(keys), _MAX_VARS):
+            batch = list(keys[i : i + _MAX_VARS])
+            marks = ",".join("?" * len(batch))
+            for key, value, codec in c.execute(
+                f"SELECT key, value, codec FROM kv WHERE key IN ({marks})", batch
+            ):
+                found[key] = self._decode(value, codec)
+        return [found.get(k) for k in keys]
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        rows = [(k, *self._encode(v)) for k, v in key_value_pairs]
+        with self._conn() as c:
+            c.executemany(
+                "INSERT OR REPLACE INTO kv(key, value, codec) VALUES (?,?,?)", rows
+            )
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        with self._conn() as c:
+            c.executemany("DELETE FROM kv WHERE key=?", [(k,) for k in keys])
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        c = self._conn()
+        if prefix:
+            cur = c.execute(
+                "SELECT key FROM kv WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            )
+        else:
+            cur = c.execute("SELECT key FROM kv")
+        for (key,) in cur:
+            yield key
+
+
+def build_parent_byte_store(
+    backend: str = PARENT_STORE_BACKEND,
+) -> BaseStore[str, bytes]:
+    """Construye el almacén de bytes de documentos padre según la configuración."""
+    if backend == "file":
+        return LocalFileStore(str(PARENT_STORE_DIR))
+    if backend == "sqlite":
+        return SQLiteByteStore(PARENT_STORE_DB, compress=PARENT_STORE_COMPRESS)
+    raise ValueError(f"PARENT_STORE_BACKEND desconocido: {backend}")
+
+
+def migrate(
+    src: BaseStore[str, bytes], dst: BaseStore[str, bytes], batch_size: int = 1000
+) -> int:
+    """Copia todas las claves de `src` a `dst` en lotes. Devuelve la cantidad copiada."""
+    total = 0
+    batch: List[str] = []
+    for key in src.yield_keys():
+        batch.append(key)
+        if len(batch) >= batch_size:
+            total += _copy_batch(src, dst, batch)
+            batch = []
+    if batch:
+        total += _copy_batch(src, dst, batch)
+    return total
+
+
+def _copy_batch(src, dst, keys: List[str]) -> int:
+    pairs = [(k, v) for k, v in zip(keys, src.mget(keys)) if v is not None]
+    dst.mset(pairs)
+    return len(pairs)
+
+
+# CLI
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Docstore de documentos padre")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_migrate = sub.add_parser("migrate", help="Copia ./parent a un archivo SQLite")
+    p_migrate.add_argument("--src", type=Path, default=PARENT_STORE_DIR)
+    p_migrate.add_argument("--dst", type=Path, default=PARENT_STORE_DB)
+    p_migrate.add_argument("--compress", action="store_true")
+    args = parser.parse_args()
+
+    if args.cmd == "migrate":
+        t0 = time.perf_counter()
+        dst = SQLiteByteStore(args.dst, compress=args.compress)
+        n = migrate(LocalFileStore(str(args.src)), dst)
+        copied = sum(1 for _ in dst.yield_keys())
+        print(f"Migrados {n} documentos en {time.perf_counter() - t0:.1f}s")
+        print(f"Claves en destino: {copied}  Tamaño: {args.dst.stat().st_size / 1e6:.1f} MB")
+        print("Activar con PARENT_STORE_BACKEND=sqlite PARENT_STORE_DB=" + str(args.dst))
@@ -0,0 +1,211 @@
+# Servidor local compatible con la API de OpenAI (chat completions y embeddings).
+# Responde con la lógica de FakeChatModel/FakeEmbeddings (fakes.py), pero por
+# HTTP: sirve para probar el cliente real (ChatOpenAI, timeouts, reintentos,
+# hedging) sin red. Inyecta picos de latencia: con probabilidad --spike-prob
+# la respuesta tarda --spike-ms adicionales. Con --cert/--key sirve HTTPS.
+#
+#   uv run python src/fake_openai.py --port 8100 --spike-prob 0.05 --spike-ms 3000
+#   OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake uv run python src/main.py
+
+import argparse
+import json
+import random
+import ssl
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from fakes import FakeChatModel, FakeEmbeddings
+
+
+def _to_messages(raw: List[Dict[str, Any]]) -> List[BaseMessage]:
+    # A FakeChatModel solo le importan el texto y el último mensaje del usuario
+    out: List[BaseMessage] = []
+    for m in raw:
+        content = m.get("content") or ""
+        if not isinstance(content, str):
+            content = " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+        cls = {"user": HumanMessage, "system": SystemMessage, "developer": SystemMessage}
+        out.append(cls.get(m.get("role"), AIMessage)(content=content))
+    return out
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        spike_prob: float = 0.0,
+        spike_ms: float = 0.0,
+        seed: Optional[int] = None,
+        tls: Optional[Tuple[str, str]] = None,
+    ):
+        super().__init__((host, port), _Handler)
+        self.tls = tls is not None
+        if tls is not None:
+            # (certificado, clave). El handshake se hace en el hilo de cada conexión
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ctx.load_cert_chain(*tls)
+            self.socket = ctx.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+        self.spike_prob = spike_prob
+        self.spike_ms = spike_ms
+        self.requests = 0
+        self.spikes = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._models: Dict[str, FakeChatModel] = {}
+        self.embeddings = FakeEmbeddings.from_env()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{'https' if self.tls else 'http'}://{host}:{port}/v1"
+
+    def finish_request(self, request, client_address) -> None:
+        if self.tls:
+            try:
+                request.do_handshake()
+            except (ssl.SSLError, OSError):
+                return
+        super().finish_request(request, client_address)
+
+    def model(self, name: str) -> FakeChatModel:
+        with self._lock:
+            if name not in self._models:
+                self._models[name] = FakeChatModel.from_env(model_name=name)
+            return self._models[name]
+
+    def spike(self) -> float:
+        with self._lock:
+            self.requests += 1
+            if self._rng.random() < self.spike_prob:
+                self.spikes += 1
+                return self.spike_ms / 1000
+        return 0.0
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True)
+        thread.start()
+        return thread
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        try:
+            if self.path.endswith("/chat/completions"):
+                self._send(200, self._chat(body))
+            elif self.path.endswith("/embeddings"):
+                self._send(200, self._embeddings(body))
+            else:
+                self._send(404, {"error": {"message": f"Ruta desconocida: {self.path}"}})
+        except Exception as e:
+            # FAKE_LLM_RATE_LIMIT_PROB: el 429 viaja como en la API real
+            status = getattr(e, "status_code", 500)
+            self._send(status, {"error": {"message": str(e), "type": "fake_error", "code": None}})
+
+    def _chat(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        model = self.server.model(body.get("model", "fake"))
+        messages = _to_messages(body.get("messages", []))
+        tools = body.get("tools") or []
+        tool_choice = body.get("tool_choice")
+        if isinstance(tool_choice, dict):
+            tool_choice = tool_choice.get("function", {}).get("name")
+        elif tool_choice == "required" and tools:
+            tool_choice = tools[0]["function"]["name"]
+        # Salida estructurada con json_schema: se arma como una tool forzada
+        schema = (body.get("response_format") or {}).get("json_schema")
+        if schema:
+            fn = {"name": schema.get("name", "output"), "parameters": schema.get("schema", {})}
+            tools = [{"type": "function", "function": fn}]
+            tool_choice = tools[0]["function"]["name"]
+
+        first, tool_call, words, usage = model._plan(messages, tools=tools, tool_choice=tool_choice)
+        time.sleep(first + len(words) * model.token_ms / 1000 + self.server.spike())
+
+        message: Dict[str, Any] = {"role": "assistant", "content": " ".join(words) or None}
+        finish = "stop"
+        if tool_call and schema:
+            message["content"] = json.dumps(tool_call["args"])
+        elif tool_call:
+            message["tool_calls"] = [
+                {
+                    "id": tool_call["id"],
+                    "type": "function",
+                    "function": {"name": tool_call["name"], "arguments": json.dumps(tool_call["args"])},
+                }
+            ]
+            finish = "tool_calls"
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model.model_name,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish, "logprobs": None}],
+            "usage": {
+                "prompt_tokens": usage["input_tokens"],
+                "completion_tokens": usage["output_tokens"],
+                "total_tokens": usage["total_tokens"],
+            },
+        }
+
+    def _embeddings(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        texts = body.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        # El cliente puede mandar tokens en lugar de texto
+        texts = [t if isinstance(t, str) else " ".join(map(str, t)) for t in texts]
+        time.sleep(self.server.spike())
+        vectors = self.server.embeddings.embed_documents(texts)
+        tokens = sum(len(t) // 4 + 1 for t in texts)
+        return {
+            "object": "list",
+            "model": body.get("model", "fake"),
+            "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor falso compatible con OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--spike-prob", type=float, default=0.0)
+    parser.add_argument("--spike-ms", type=float, default=3000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--cert", default=None, help="Certificado PEM (con --key, HTTPS)")
+    parser.add_argument("--key", default=None)
+    args = parser.parse_args()
+
+    tls = (args.cert, args.key) if args.cert else None
+    server = FakeOpenAIServer(args.host, args.port, args.spike_prob, args.spike_ms, args.seed, tls)
+    print(f"Escuchando en {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
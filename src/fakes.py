@@ -0,0 +1,263 @@
+# Modelos falsos deterministas para pruebas de carga y benchmarks sin red.
+# - FakeChatModel: latencia log-normal configurable, streaming por tokens,
+#   tool calls (retriever_tool), salida estructurada (grader, memorias) y
+#   respuestas 429 con probabilidad FAKE_LLM_RATE_LIMIT_PROB.
+# - FakeEmbeddings: vectores deterministas por hash del texto, con latencia.
+# Se activan con LLM_PROVIDER=fake (ver providers.py).
+
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import BaseModel, PrivateAttr
+
+_VOCAB = (
+    "el la los las un una de del en con por para que se su al es son fue como "
+    "proceso modelo fase datos proyecto sistema análisis documento sección "
+    "definición dominio calidad resultado objetivo tarea información método "
+    "propuesta conocimiento explotación preparación comprensión evaluación"
+).split()
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, int(len(text.split()) * 1.3))
+
+
+def _text_of(messages: List[BaseMessage]) -> str:
+    return "\n".join(m.content if isinstance(m.content, str) else str(m.content) for m in messages)
+
+
+def _last_human(messages: List[BaseMessage]) -> str:
+    for m in reversed(messages):
+        if m.type == "human":
+            return m.content if isinstance(m.content, str) else str(m.content)
+    return ""
+
+
+class FakeRateLimitError(Exception):
+    """Imita el 429 del proveedor (mismo status_code que openai.RateLimitError)."""
+
+    status_code = 429
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model determinista con latencia y comportamiento de tools configurables."""
+
+    model_name: str = "fake"
+    first_token_ms: float = 300.0
+    latency_sigma: float = 0.5
+    token_ms: float = 10.0
+    answer_tokens: int = 60
+    tool_call_prob: float = 0.9
+    grade_yes_prob: float = 0.8
+    rate_limit_prob: float = 0.0
+    seed: Optional[int] = None
+
+    _rng: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+
+    @classmethod
+    def from_env(cls, model_name: str = "fake", **overrides) -> "FakeChatModel":
+        """Construye el modelo leyendo FAKE_LLM_* del entorno."""
+        seed = os.getenv("FAKE_LLM_SEED")
+        params = dict(
+            model_name=model_name,
+            first_token_ms=_env_float("FAKE_LLM_LATENCY_MS", 300),
+            latency_sigma=_env_float("FAKE_LLM_LATENCY_SIGMA", 0.5),
+            token_ms=_env_float("FAKE_LLM_TOKEN_MS", 10),
+            answer_tokens=int(_env_float("FAKE_LLM_ANSWER_TOKENS", 60)),
+            tool_call_prob=_env_float("FAKE_LLM_TOOL_PROB", 0.9),
+            grade_yes_prob=_env_float("FAKE_LLM_GRADE_YES_PROB", 0.8),
+            rate_limit_prob=_env_float("FAKE_LLM_RATE_LIMIT_PROB", 0.0),
+            seed=int(seed) if seed is not None else None,
+        )
+        params.update(overrides)
+        return cls(**params)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        formatted = [convert_to_openai_tool(t) for t in tools]
+        return self.bind(tools=formatted, tool_choice=tool_choice, **kwargs)
+
+    # -- Planificación de la respuesta --
+
+    def _sample(self) -> Tuple[float, float]:
+        with self._lock:
+            first = self.first_token_ms * math.exp(self._rng.gauss(0, self.latency_sigma))
+            return first / 1000, self._rng.random()
+
+    def _tool_args(self, fn: Dict[str, Any], messages: List[BaseMessage], draw: float) -> Dict[str, Any]:
+        if fn["name"] == "GradeDocuments":
+            return {"binary_score": "yes" if draw < self.grade_yes_prob else "no"}
+        if fn["name"] == "Reformulations":
+            question = _last_human(messages).rsplit("Question:", 1)[-1].split()
+            return {"queries": [" ".join(question[i:]) for i in range(1, 4) if question[i:]]}
+        params = fn.get("parameters", {})
+        args: Dict[str, Any] = {}
+        for name in params.get("required", []):
+            kind = params.get("properties", {}).get(name, {}).get("type")
+            if name == "query":
+                args[name] = _last_human(messages)
+            elif kind == "boolean":
+                args[name] = False
+            elif kind == "array":
+                args[name] = []
+            elif kind in ("integer", "number"):
+                args[name] = 0
+            elif kind == "object":
+                args[name] = {}
+            else:
+                args[name] = "fake"
+        return args
+
+    def _plan(self, messages: List[BaseMessage], **kwargs) -> Tuple[float, Optional[Dict], List[str], Dict]:
+        first, draw = self._sample()
+        if self.rate_limit_prob:
+            with self._lock:
+                limited = self._rng.random() < self.rate_limit_prob
+            if limited:
+                time.sleep(first / 10)
+                raise FakeRateLimitError("Rate limit reached (fake)")
+        tools = kwargs.get("tools") or []
+        tool_choice = kwargs.get("tool_choice")
+        tool_call = None
+        if tools:
+            forced = tool_choice not in (None, "auto", "none")
+            if forced or draw < self.tool_call_prob:
+                fn = tools[0]["function"]
+                if isinstance(tool_choice, str):
+                    fn = next((t["function"] for t in tools if t["function"]["name"] == tool_choice), fn)
+                tool_call = {
+                    "name": fn["name"],
+                    "args": self._tool_args(fn, messages, draw),
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "tool_call",
+                }
+        prompt = _text_of(messages)
+        words: List[str] = []
+        if tool_call is None:
+            h = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16], 16)
+            wrng = random.Random(h)
+            words = [wrng.choice(_VOCAB) for _ in range(self.answer_tokens)]
+        out_tokens = len(words) if words else _approx_tokens(json.dumps(tool_call["args"]))
+        in_tokens = _approx_tokens(prompt)
+        usage = {
+            "input_tokens": in_tokens,
+            "output_tokens": out_tokens,
+            "total_tokens": in_tokens + out_tokens,
+        }
+        return first, tool_call, words, usage
+
+    # -- Interfaz de BaseChatModel --
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        first, tool_call, words, usage = self._plan(messages, **kwargs)
+        time.sleep(first + len(words) * self.token_ms / 1000)
+        msg = AIMessage(
+            content=" ".join(words),
+            tool_calls=[tool_call] if tool_call else [],
+            usage_metadata=usage,
+            response_metadata={"model_name": self.model_name},
+        )
+        return ChatResult(generations=[ChatGeneration(message=msg)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        first, tool_call, words, usage = self._plan(messages, **kwargs)
+        time.sleep(first)
+        if tool_call:
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": tool_call["name"],
+                            "args": json.dumps(tool_call["args"]),
+                            "id": tool_call["id"],
+                            "index": 0,
+                        }
+                    ],
+                )
+            )
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else f" {word}"))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(
+                content="",
+                usage_metadata=usage,
+                response_metadata={"model_name": self.model_name},
+            )
+        )
+
+
+class FakeEmbeddings(BaseModel, Embeddings):
+    """Embeddings deterministas (hash del texto) con latencia por lote y por texto."""
+
+    size: int = 256
+    batch_latency_ms: float = 20.0
+    per_text_ms: float = 0.05
+
+    @classmethod
+    def from_env(cls, **overrides) -> "FakeEmbeddings":
+        params = dict(
+            size=int(_env_float("FAKE_EMBED_SIZE", 256)),
+            batch_latency_ms=_env_float("FAKE_EMBED_LATENCY_MS", 20),
+            per_text_ms=_env_float("FAKE_EMBED_PER_TEXT_MS", 0.05),
+        )
+        params.update(overrides)
+        return cls(**params)
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+        v = np.random.default_rng(seed).standard_normal(self.size)
+        return (v / np.linalg.norm(v)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep((self.batch_latency_ms + self.per_text_ms * len(texts)) / 1000)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
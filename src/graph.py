@@ -1,23 +1,24 @@
 # Sistema multi-usuario Chroma: colección única + filtros por usuario/hilo
+# (o colecciones particionadas, ver partitions.py)
 # - Vector store persistente
 # - La herramienta aplica {user_id, thread_id} desde el contexto del servidor (no input de usuario)
 # - Sistema de memorias de usuario
+# - Los recursos pesados (modelos, Chroma, docstore, SQLite, grafo compilado) se
+#   construyen al primer uso o en el warm-up (ver startup.py). Los nombres
+#   históricos (graph, vs, store, checkpointer...) siguen disponibles vía __getattr__.
 
+import os
 import sqlite3
+import threading
 import dotenv
 import json
 import logging
-from typing import List, Literal, Dict, Any
+from pathlib import Path
+from typing import List, Literal, Dict, Any, Tuple
 
 from langchain_core.tools import tool
-from langchain_core.documents import Document
-from langchain_core.messages import BaseMessage, ToolMessage
-from langchain_chroma import Chroma
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langchain_openai import OpenAIEmbeddings
-from langchain.chat_models import init_chat_model
+from langchain_core.messages import BaseMessage, ToolMessage, RemoveMessage
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_classic.storage import LocalFileStore
 from langgraph.graph import MessagesState, StateGraph, START, END
 from langchain_classic.retrievers import ParentDocumentRetriever
 from langchain_classic.storage import create_kv_docstore
@@ -25,34 +26,109 @@ from langgraph.prebuilt import ToolNode, tools_condition
 from langchain_core.runnables import RunnableConfig
 from pydantic import BaseModel, Field
 
+from checkpoints import CHECKPOINT_DB_PATH
+from db import thread_doc_count
+from docstore import build_parent_byte_store
+from history import HISTORY_STORE
+from metrics import REWRITES
+from multiquery import MULTI_QUERY_RETRIEVAL, multi_query_search
+from partitions import VectorPartitions
+from resilient import invoke_model
+from routing import chat_model, router
+from scheduler import in_lane, retry_policy, with_backoff
+import speculative
+from startup import component
+from usage import TrackedEmbeddings
+
 # Configuración de Logging
 logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv()
 
-PERSIST_DIR = "./chroma_multi"
-_embeddings = OpenAIEmbeddings()
-RESPONSE_MODEL = init_chat_model("openai:gpt-4o", temperature=0)
-GRADER_MODEL = init_chat_model("openai:gpt-4o", temperature=0)
-MEMORY_MODEL = init_chat_model("openai:gpt-4o", temperature=0)
+PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_multi")
+# Con varios procesos (serve.py) Chroma corre como servidor y cada worker es cliente
+CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", "8000"))
+MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH", "user_memories.db")
+# Espera ante bloqueos de otros procesos sobre las bases SQLite
+SQLITE_TIMEOUT = 30
 COLLECTION_NAME = "child_store"
-vs = Chroma(
-    embedding_function=_embeddings,
-    collection_name=COLLECTION_NAME,
-    persist_directory=PERSIST_DIR,
-)
-
-fs = LocalFileStore("./parent")
-store = create_kv_docstore(fs)
 parent_splitter = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=800)
-child_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=60)
+# start_index: posición del fragmento dentro del padre (spans de los registros de búsqueda)
+child_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=60, add_start_index=True)
 
-retriever = ParentDocumentRetriever(
-    vectorstore=vs,
-    docstore=store,
-    child_splitter=child_splitter,
-    parent_splitter=parent_splitter,
-)
+# Orden de registro = orden del warm-up (las dependencias primero)
+
+
+@component("embeddings")
+def get_embeddings():
+    return TrackedEmbeddings(router.embeddings())
+
+
+# Modelos por rol según config.yaml (ver routing.py); se recargan si el archivo cambia
+@component("chat_models")
+def _chat_models():
+    return router.warm()
+
+
+@component("chroma")
+def get_vectorstore():
+    from langchain_chroma import Chroma
+
+    if CHROMA_SERVER_HOST:
+        import chromadb
+
+        return Chroma(
+            client=chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT),
+            embedding_function=get_embeddings(),
+            collection_name=COLLECTION_NAME,
+        )
+    return Chroma(
+        embedding_function=get_embeddings(),
+        collection_name=COLLECTION_NAME,
+        persist_directory=PERSIST_DIR,
+    )
+
+
+@component("parent_store")
+def get_byte_store():
+    return build_parent_byte_store()
+
+
+@component("docstore")
+def get_docstore():
+    return create_kv_docstore(get_byte_store())
+
+
+@component("retriever")
+def get_base_retriever() -> ParentDocumentRetriever:
+    return ParentDocumentRetriever(
+        vectorstore=get_vectorstore(),
+        docstore=get_docstore(),
+        child_splitter=child_splitter,
+        parent_splitter=parent_splitter,
+    )
+
+
+# Enrutamiento a colección por usuario/hilo (VECTOR_PARTITIONING, por defecto 'none')
+@component("partitions")
+def get_partitions() -> VectorPartitions:
+    return VectorPartitions(get_vectorstore(), get_embeddings())
+
+
+def get_retriever(user_id: int, thread_id: str, **search_kwargs) -> ParentDocumentRetriever:
+    """
+    Retriever del hilo: usa la partición de Chroma y el filtro que correspondan.
+    Devuelve una copia para no compartir search_kwargs entre requests concurrentes.
+    """
+    partitions = get_partitions()
+    kwargs = dict(search_kwargs)
+    search_filter = partitions.search_filter(user_id, thread_id)
+    if search_filter is not None:
+        kwargs["filter"] = search_filter
+    return get_base_retriever().model_copy(
+        update={"vectorstore": partitions.get(user_id, thread_id), "search_kwargs": kwargs}
+    )
 
 # -----------------------------
 # Sistema de Memorias de Usuario
@@ -61,7 +137,8 @@ retriever = ParentDocumentRetriever(
 # Inicializar base de datos de memorias
 def init_memory_db():
     """Inicializa la base de datos SQLite para memorias de usuario."""
-    conn = sqlite3.connect("user_memories.db", check_same_thread=False)
+    conn = sqlite3.connect(MEMORY_DB_PATH, timeout=SQLITE_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS user_memories (
@@ -76,7 +153,22 @@ def init_memory_db():
     return conn
 
 
-memory_conn = init_memory_db()
+@component("memory_db")
+def _memory_db_ready() -> bool:
+    init_memory_db().close()
+    return True
+
+
+_memory_local = threading.local()
+
+
+def get_memory_conn() -> sqlite3.Connection:
+    """Conexión a user_memories.db propia del hilo (y del proceso) actual."""
+    conn = getattr(_memory_local, "conn", None)
+    if conn is None:
+        _memory_db_ready()
+        conn = _memory_local.conn = sqlite3.connect(MEMORY_DB_PATH, timeout=SQLITE_TIMEOUT)
+    return conn
 
 
 class Memory(BaseModel):
@@ -126,12 +218,15 @@ def extract_and_save_memories(message: str, user_id: int):
     """Extrae memorias del mensaje del usuario y las guarda en la base de datos."""
     prompt = MEMORY_EXTRACTION_PROMPT.format(message=message)
 
-    response = MEMORY_MODEL.with_structured_output(UserMemory).invoke(
-        [{"role": "user", "content": prompt}]
-    )
+    with in_lane("aux"):
+        response = invoke_model(
+            "memory",
+            chat_model("memory").with_structured_output(UserMemory),
+            [{"role": "user", "content": prompt}],
+        )
 
     if response.has_memories and response.memories:
-        cursor = memory_conn.cursor()
+        cursor = get_memory_conn().cursor()
         saved_memories = {}
         for memory in response.memories:
             cursor.execute(
@@ -142,7 +237,7 @@ def extract_and_save_memories(message: str, user_id: int):
                 (user_id, memory.key, memory.value),
             )
             saved_memories[memory.key] = memory.value
-        memory_conn.commit()
+        get_memory_conn().commit()
         return saved_memories
 
     return None
@@ -150,7 +245,7 @@ def extract_and_save_memories(message: str, user_id: int):
 
 def get_user_memories(user_id: int) -> Dict[str, str]:
     """Recupera todas las memorias de un usuario."""
-    cursor = memory_conn.cursor()
+    cursor = get_memory_conn().cursor()
     cursor.execute(
         """
         SELECT memory_key, memory_value 
@@ -179,26 +274,194 @@ def format_memories_for_context(memories: Dict[str, str]) -> str:
     return memory_text
 
 
+# -----------------------------
+# Gestión del historial
+# -----------------------------
+# Se conservan textualmente los últimos HISTORY_KEEP_TURNS turnos; los anteriores
+# se resumen de forma incremental en state["summary"] y se eliminan del estado.
+# Los ToolMessages de turnos pasados se reemplazan por un marcador corto.
+
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "6"))
+# Turnos excedentes acumulados antes de resumir (evita una llamada por turno)
+HISTORY_SUMMARY_BATCH = int(os.getenv("HISTORY_SUMMARY_BATCH", "4"))
+STALE_TOOL_PLACEHOLDER = "[documentos recuperados en un turno anterior omitidos]"
+
+
+class ChatState(MessagesState):
+    """Estado del grafo: mensajes más el resumen de los turnos antiguos."""
+
+    summary: str
+
+
+SUMMARY_PROMPT = """Mantienes un resumen breve de una conversación entre un usuario y un asistente.
+
+Resumen actual:
+{summary}
+
+Nuevos mensajes a incorporar:
+{messages}
+
+Devuelve el resumen actualizado en español. Conserva los hechos, preguntas y
+decisiones relevantes para continuar la conversación. Máximo 200 palabras."""
+
+
+# Nombre de los mensajes "user" que agrega rewrite_question: no son turnos y
+# no están en app.db.messages
+REWRITE_NAME = "rewrite"
+
+
+def _is_rewrite(msgs: List[BaseMessage], i: int) -> bool:
+    # Checkpoints anteriores al nombre: la reescritura siempre sigue al ToolMessage de retrieve
+    return msgs[i].name == REWRITE_NAME or (i > 0 and msgs[i - 1].type == "tool")
+
+
+def _turn_starts(msgs: List[BaseMessage]) -> List[int]:
+    """Índices de los mensajes humanos que abren cada turno (sin las reescrituras)."""
+    return [i for i, m in enumerate(msgs) if m.type == "human" and not _is_rewrite(msgs, i)]
+
+
+def _format_for_summary(msgs: List[BaseMessage]) -> str:
+    lines = []
+    for m in msgs:
+        if m.type in ("human", "ai") and isinstance(m.content, str) and m.content:
+            role = "Usuario" if m.type == "human" else "Asistente"
+            lines.append(f"{role}: {m.content}")
+    return "\n".join(lines)
+
+
+def summarize_messages(summary: str, msgs: List[BaseMessage]) -> str:
+    """Incorpora mensajes antiguos al resumen existente."""
+    text = _format_for_summary(msgs)
+    if not text:
+        return summary
+    prompt = SUMMARY_PROMPT.format(summary=summary or "(vacío)", messages=text)
+    response = invoke_model("memory", chat_model("memory"), [{"role": "user", "content": prompt}])
+    return (response.content or "").strip() or summary
+
+
+def manage_history(state: ChatState):
+    """Acota el historial: resume turnos viejos y descarta payloads de herramientas."""
+    msgs = state["messages"]
+    starts = _turn_starts(msgs)
+    if not starts:
+        return {}
+
+    update: Dict[str, Any] = {}
+    removed = []
+    if len(starts) > HISTORY_KEEP_TURNS + HISTORY_SUMMARY_BATCH:
+        cut = starts[-HISTORY_KEEP_TURNS]
+        old = msgs[:cut]
+        update["summary"] = summarize_messages(state.get("summary", ""), old)
+        removed = [RemoveMessage(id=m.id) for m in old]
+        logger.info(f"Historial resumido: {len(old)} mensajes plegados")
+    else:
+        cut = 0
+
+    # ToolMessages de turnos anteriores al actual: se mantiene el mensaje
+    # (la API exige respuesta a cada tool_call) pero sin el contenido.
+    stale = [
+        m.model_copy(update={"content": STALE_TOOL_PLACEHOLDER})
+        for m in msgs[cut : starts[-1]]
+        if isinstance(m, ToolMessage) and m.content != STALE_TOOL_PLACEHOLDER
+    ]
+
+    if removed or stale:
+        update["messages"] = removed + stale
+    return update
+
+
 # -----------------------------
 # Tools
 # -----------------------------
 
+RETRIEVER_K = 4
+
+
+def _last_human(msgs: List[BaseMessage]) -> str:
+    """Contenido del último mensaje del usuario."""
+    for m in reversed(msgs):
+        if m.type == "human":
+            return m.content if isinstance(m.content, str) else str(m.content)
+    return ""
 
-@tool
-def retriever_tool(query: str, config: RunnableConfig, k: int = 4) -> List[Document]:
+
+# La búsqueda devuelve registros compactos de los documentos padre (id en el
+# docstore, distancia, fuente y spans de los fragmentos que coincidieron), no
+# su texto. El ToolMessage lleva un resumen corto y los registros en `artifact`,
+# así que ni el checkpoint ni el historial que se reenvía a los modelos cargan
+# los ~16k caracteres de contexto. El texto se arma desde el docstore solo al
+# construir los prompts del grader y de generate_answer.
+
+
+def search_parents(user_id: int, thread_id: str, query: str, k: int = RETRIEVER_K) -> List[Dict[str, Any]]:
+    """Padres de los `k` fragmentos más cercanos, en orden de relevancia."""
+    retriever = get_retriever(user_id, thread_id, k=k)
+    id_key = retriever.id_key
+    hits = retriever.vectorstore.similarity_search_with_score(query, **retriever.search_kwargs)
+    records: Dict[str, Dict[str, Any]] = {}
+    for child, distance in hits:
+        parent_id = child.metadata.get(id_key)
+        if parent_id is None:
+            continue
+        record = records.get(parent_id)
+        if record is None:
+            record = records[parent_id] = {"id": parent_id, "score": round(float(distance), 4)}
+            for key in ("source", "page"):
+                if child.metadata.get(key) is not None:
+                    record[key] = child.metadata[key]
+        start = child.metadata.get("start_index")
+        if start is not None:
+            record.setdefault("spans", []).append([start, start + len(child.page_content)])
+    return list(records.values())
+
+
+def _source_label(record: Dict[str, Any]) -> str:
+    name = Path(str(record.get("source", "documento"))).name
+    page = record.get("page")
+    return f"{name} (p. {page + 1})" if isinstance(page, int) else name
+
+
+def _describe(records: List[Dict[str, Any]]) -> str:
+    """Contenido del ToolMessage: qué se recuperó, sin el texto."""
+    if not records:
+        return "No se encontraron documentos relevantes."
+    return f"{len(records)} documentos recuperados: " + ", ".join(map(_source_label, records))
+
+
+def materialize_context(records: List[Dict[str, Any]]) -> str:
+    """Texto de los padres desde el docstore, numerados y con su fuente."""
+    docs = get_docstore().mget([r["id"] for r in records])
+    parts = []
+    for i, (record, doc) in enumerate(zip(records, docs), start=1):
+        if doc is None:
+            # El padre se borró (chat eliminado) después de la búsqueda
+            continue
+        parts.append(f"[{i}] {_source_label(record)}\n{doc.page_content}")
+    return "\n\n".join(parts)
+
+
+@tool(response_format="content_and_artifact")
+def retriever_tool(
+    query: str, config: RunnableConfig, k: int = RETRIEVER_K
+) -> Tuple[str, List[Dict[str, Any]]]:
     """
     Recupera documentos relevantes para el usuario/hilo actual.
     NOTA: user_id/thread_id se resuelven del contexto del servidor, no del input del usuario.
     """
-    filter = {
-        "$and": [
-            {"user_id": {"$eq": int(config["configurable"].get("user_id"))}},
-            {"thread_id": {"$eq": str(config["configurable"].get("thread_id"))}},
-        ]
-    }
-    retriever.search_kwargs["filter"] = filter
-    retriever.search_kwargs["k"] = k
-    return retriever.invoke(query)
+    user_id = int(config["configurable"].get("user_id"))
+    thread_id = str(config["configurable"].get("thread_id"))
+    prefetched = None
+    if speculative.SPECULATIVE_RETRIEVAL:
+        prefetched = speculative.claim(thread_id, query, k)
+    if MULTI_QUERY_RETRIEVAL:
+        records = multi_query_search(
+            query, lambda q: search_parents(user_id, thread_id, q, k), k, first=prefetched
+        )
+    elif prefetched is not None:
+        records = prefetched
+    else:
+        records = search_parents(user_id, thread_id, query, k)
+    return _describe(records), records
 
 
 # -----------------------------
@@ -225,24 +488,61 @@ def extract_memories_node(state: MessagesState, config: RunnableConfig):
     return state
 
 
-def generate_query_or_respond(state: MessagesState, config: RunnableConfig):
-    """Consulta al modelo; decidirá si llamar a la herramienta de recuperación o responder directamente."""
-    user_id = int(config["configurable"].get("user_id"))
-
-    # Obtener memorias del usuario
+def _with_context(state: ChatState, user_id: int) -> List[Any]:
+    """Mensajes del estado con memorias y resumen en un mensaje de sistema."""
     memories = get_user_memories(user_id)
     memory_context = format_memories_for_context(memories)
 
-    # Agregar contexto de memorias al mensaje del sistema si existen
+    # Agregar contexto de memorias y resumen al mensaje del sistema si existen
     messages = state["messages"].copy()
+    system_parts = []
     if memory_context:
-        system_message = {
-            "role": "system",
-            "content": f"{memory_context}\nUsa esta información para personalizar tus respuestas cuando sea relevante.",
-        }
-        messages.insert(0, system_message)
+        system_parts.append(
+            f"{memory_context}\nUsa esta información para personalizar tus respuestas cuando sea relevante."
+        )
+    if state.get("summary"):
+        system_parts.append(f"Resumen de la conversación previa:\n{state['summary']}")
+    if system_parts:
+        messages.insert(0, {"role": "system", "content": "\n\n".join(system_parts)})
+    return messages
+
+
+def route_by_index(state: ChatState, config: RunnableConfig) -> Literal["generate_query_or_respond", "respond"]:
+    """Los hilos sin documentos indexados no necesitan la herramienta de búsqueda."""
+    thread_id = str(config["configurable"].get("thread_id"))
+    return "generate_query_or_respond" if thread_doc_count(thread_id) > 0 else "respond"
 
-    response = RESPONSE_MODEL.bind_tools([retriever_tool]).invoke(messages)
+
+def generate_query_or_respond(state: ChatState, config: RunnableConfig):
+    """Consulta al modelo; decidirá si llamar a la herramienta de recuperación o responder directamente."""
+    user_id = int(config["configurable"].get("user_id"))
+    thread_id = str(config["configurable"].get("thread_id"))
+    messages = _with_context(state, user_id)
+    if speculative.SPECULATIVE_RETRIEVAL:
+        # Este camino solo se toma en hilos con documentos: la búsqueda arranca
+        # con la pregunta tal cual mientras el modelo decide
+        question = _last_human(state["messages"])
+        if question:
+            speculative.start(
+                thread_id,
+                question,
+                RETRIEVER_K,
+                lambda q: search_parents(user_id, thread_id, q, RETRIEVER_K),
+            )
+    response = invoke_model(
+        "tool_routing", chat_model("tool_routing").bind_tools([retriever_tool]), messages
+    )
+    if speculative.SPECULATIVE_RETRIEVAL and not any(
+        tc["name"] == retriever_tool.name for tc in response.tool_calls
+    ):
+        speculative.discard(thread_id)
+    return {"messages": [response]}
+
+
+def respond(state: ChatState, config: RunnableConfig):
+    """Respuesta directa, sin herramientas (hilo sin documentos)."""
+    user_id = int(config["configurable"].get("user_id"))
+    response = invoke_model("answer", chat_model("answer"), _with_context(state, user_id))
     return {"messages": [response]}
 
 
@@ -263,9 +563,13 @@ class GradeDocuments(BaseModel):
     )
 
 
-def _last_tool_payload(msgs: List[BaseMessage]) -> str:
+def _retrieved_context(msgs: List[BaseMessage]) -> str:
+    """Texto de la última búsqueda, armado desde el docstore."""
     for m in reversed(msgs):
         if isinstance(m, ToolMessage):
+            if isinstance(m.artifact, list):
+                return materialize_context(m.artifact)
+            # ToolMessages de checkpoints anteriores: los documentos van en el contenido
             return m.content if isinstance(m.content, str) else str(m.content)
     return ""
 
@@ -273,17 +577,16 @@ def _last_tool_payload(msgs: List[BaseMessage]) -> str:
 def grade_documents(
     state: MessagesState,
 ) -> Literal["generate_answer", "rewrite_question"]:
-    # latest user message
-    question = ""
-    for m in reversed(state["messages"]):
-        if m.type == "human":
-            question = m.content
-            break
-    context = _last_tool_payload(state["messages"])
+    question = _last_human(state["messages"])
+    context = _retrieved_context(state["messages"])
 
     prompt = GRADE_PROMPT.format(question=question, context=context)
-    resp = GRADER_MODEL.with_structured_output(GradeDocuments).invoke(
-        [{"role": "user", "content": prompt}]
+    # Función de arista: la RetryPolicy de los nodos no la cubre
+    resp = with_backoff(
+        invoke_model,
+        "grader",
+        chat_model("grader").with_structured_output(GradeDocuments),
+        [{"role": "user", "content": prompt}],
     )
     return (
         "generate_answer"
@@ -304,11 +607,11 @@ REWRITE_PROMPT = (
 
 def rewrite_question(state: MessagesState):
     """Reescribe la pregunta original del usuario."""
-    messages = state["messages"]
-    question = messages[0].content
+    REWRITES.inc()
+    question = _last_human(state["messages"])
     prompt = REWRITE_PROMPT.format(question=question)
-    response = RESPONSE_MODEL.invoke([{"role": "user", "content": prompt}])
-    return {"messages": [{"role": "user", "content": response.content}]}
+    response = invoke_model("rewrite", chat_model("rewrite"), [{"role": "user", "content": prompt}])
+    return {"messages": [{"role": "user", "content": response.content, "name": REWRITE_NAME}]}
 
 
 GENERATE_PROMPT = (
@@ -325,14 +628,8 @@ GENERATE_PROMPT = (
 def generate_answer(state: MessagesState, config: RunnableConfig):
     """Genera una respuesta con el contexto de las memorias del usuario."""
     user_id = int(config["configurable"].get("user_id"))
-
-    question = ""
-    for m in reversed(state["messages"]):
-        if m.type == "human":
-            question = m.content
-            break
-
-    context = _last_tool_payload(state["messages"])
+    question = _last_human(state["messages"])
+    context = _retrieved_context(state["messages"])
 
     # Agregar memorias del usuario al contexto
     memories = get_user_memories(user_id)
@@ -343,25 +640,33 @@ def generate_answer(state: MessagesState, config: RunnableConfig):
         full_context = f"{memory_context}\n\nDocumentos recuperados:\n{context}"
 
     prompt = GENERATE_PROMPT.format(question=question, context=full_context)
-    response = RESPONSE_MODEL.invoke([{"role": "user", "content": prompt}])
+    response = invoke_model("answer", chat_model("answer"), [{"role": "user", "content": prompt}])
     return {"messages": [response]}
 
 
 # -----------------------------
 # Graph
 # -----------------------------
-workflow = StateGraph(MessagesState)
+workflow = StateGraph(ChatState)
+
+# Los nodos que llaman a chat models se reintentan ante 429 (ver scheduler.py);
+# los embeddings de la búsqueda ya reintentan en TrackedEmbeddings
+llm_retry = retry_policy()
 
 # Define the nodes we will cycle between
-workflow.add_node("extract_memories", extract_memories_node)
-workflow.add_node(generate_query_or_respond)
+workflow.add_node("extract_memories", extract_memories_node, retry_policy=llm_retry)
+workflow.add_node(manage_history, retry_policy=llm_retry)
+workflow.add_node(generate_query_or_respond, retry_policy=llm_retry)
+workflow.add_node(respond, retry_policy=llm_retry)
 workflow.add_node("retrieve", ToolNode([retriever_tool]))
-workflow.add_node(rewrite_question)
-workflow.add_node(generate_answer)
+workflow.add_node(generate_answer, retry_policy=llm_retry)
 
 # Primero extraemos memorias
 workflow.add_edge(START, "extract_memories")
-workflow.add_edge("extract_memories", "generate_query_or_respond")
+workflow.add_edge("extract_memories", "manage_history")
+# Con documentos: enrutamiento con la herramienta; sin documentos: respuesta directa
+workflow.add_conditional_edges("manage_history", route_by_index)
+workflow.add_edge("respond", END)
 
 # Decide whether to retrieve
 workflow.add_conditional_edges(
@@ -376,18 +681,37 @@ workflow.add_conditional_edges(
 )
 
 # Edges taken after the `action` node is called.
-workflow.add_conditional_edges(
-    "retrieve",
-    # Assess agent decision
-    grade_documents,
-)
+if MULTI_QUERY_RETRIEVAL:
+    # Una sola ronda: las reformulaciones ya se buscaron y fusionaron en la tool
+    workflow.add_edge("retrieve", "generate_answer")
+else:
+    workflow.add_node(rewrite_question, retry_policy=llm_retry)
+    workflow.add_conditional_edges(
+        "retrieve",
+        # Assess agent decision
+        grade_documents,
+    )
+    workflow.add_edge("rewrite_question", "generate_query_or_respond")
 workflow.add_edge("generate_answer", END)
-workflow.add_edge("rewrite_question", "generate_query_or_respond")
 
-# Compile
-conn = sqlite3.connect("chat.db", check_same_thread=False)
-checkpointer = SqliteSaver(conn)
-graph = workflow.compile(checkpointer=checkpointer)
+
+# Compile (al primer uso)
+@component("checkpointer")
+def get_checkpointer():
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    # SqliteSaver serializa el acceso de los hilos con un lock; entre procesos, WAL
+    conn = sqlite3.connect(CHECKPOINT_DB_PATH, check_same_thread=False, timeout=SQLITE_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return SqliteSaver(conn)
+
+
+@component("graph")
+def get_graph():
+    if HISTORY_STORE == "messages":
+        # El historial sale de app.db (history.graph_input): sin checkpoints
+        return workflow.compile()
+    return workflow.compile(checkpointer=get_checkpointer())
 
 
 # -----------------------------
@@ -397,7 +721,7 @@ graph = workflow.compile(checkpointer=checkpointer)
 
 def delete_user_memory(user_id: int, memory_key: str):
     """Elimina una memoria específica de un usuario."""
-    cursor = memory_conn.cursor()
+    cursor = get_memory_conn().cursor()
     cursor.execute(
         """
         DELETE FROM user_memories 
@@ -405,12 +729,12 @@ def delete_user_memory(user_id: int, memory_key: str):
     """,
         (user_id, memory_key),
     )
-    memory_conn.commit()
+    get_memory_conn().commit()
 
 
 def clear_all_user_memories(user_id: int):
     """Elimina todas las memorias de un usuario."""
-    cursor = memory_conn.cursor()
+    cursor = get_memory_conn().cursor()
     cursor.execute(
         """
         DELETE FROM user_memories 
@@ -418,4 +742,28 @@ def clear_all_user_memories(user_id: int):
     """,
         (user_id,),
     )
-    memory_conn.commit()
+    get_memory_conn().commit()
+
+
+# Compatibilidad: `from graph import graph, vs, store, ...` construye al acceder
+_LAZY_ATTRS = {
+    "graph": get_graph,
+    "checkpointer": get_checkpointer,
+    "conn": lambda: get_checkpointer().conn,
+    "vs": get_vectorstore,
+    "fs": get_byte_store,
+    "store": get_docstore,
+    "retriever": get_base_retriever,
+    "partitions": get_partitions,
+    "memory_conn": get_memory_conn,
+    "_embeddings": get_embeddings,
+    "RESPONSE_MODEL": lambda: chat_model("answer"),
+    "GRADER_MODEL": lambda: chat_model("grader"),
+    "MEMORY_MODEL": lambda: chat_model("memory"),
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRS:
+        return _LAZY_ATTRS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
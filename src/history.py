@@ -0,0 +1,146 @@
+# Fuente única del historial de conversación.
+# Con HISTORY_STORE=checkpoints (por defecto) cada turno se guarda dos veces:
+# en app.db.messages para la interfaz y en los checkpoints de chat.db para el
+# grafo, con una copia completa del estado por nodo. Con HISTORY_STORE=messages
+# la tabla messages es el único registro: el grafo se compila sin checkpointer
+# y cada turno arranca con el resumen del hilo (chats.summary) y los mensajes
+# posteriores a él. Cuando manage_history pliega turnos viejos en el resumen,
+# se guarda el resumen nuevo y hasta qué mensaje cubre (chats.summary_upto). Un
+# turno que falla no deja nada escrito, así que interfaz y grafo no divergen.
+#
+# Para pasar un despliegue existente a HISTORY_STORE=messages, `migrate` copia
+# el resumen del último checkpoint de cada hilo (los mensajes ya están en
+# app.db) y opcionalmente borra los checkpoints:
+#
+#   uv run python src/history.py migrate --dry-run
+#   uv run python src/history.py migrate --drop-checkpoints
+
+import argparse
+import logging
+import os
+from typing import Any, Dict, List
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+
+from db import list_live_threads, load_thread_context, set_thread_summary, thread_user_messages
+
+logger = logging.getLogger(__name__)
+
+HISTORY_STORE = os.getenv("HISTORY_STORE", "checkpoints")
+if HISTORY_STORE not in ("checkpoints", "messages"):
+    raise ValueError(f"HISTORY_STORE inválido: {HISTORY_STORE!r} (checkpoints o messages)")
+
+_ID_PREFIX = "msg-"
+
+
+def _to_message(row: Dict[str, Any]) -> BaseMessage:
+    # El id permite mapear los RemoveMessage de manage_history a filas de app.db
+    cls = HumanMessage if row["role"] == "user" else AIMessage
+    return cls(content=row["content"], id=f"{_ID_PREFIX}{row['id']}")
+
+
+def _row_ids(messages: List[BaseMessage]) -> List[int]:
+    return [int(m.id[len(_ID_PREFIX) :]) for m in messages if (m.id or "").startswith(_ID_PREFIX)]
+
+
+def graph_input(thread_id: str, text: str) -> Dict[str, Any]:
+    """Entrada del grafo para un turno nuevo del hilo."""
+    if HISTORY_STORE == "checkpoints":
+        return {"messages": [HumanMessage(content=text)]}
+    ctx = load_thread_context(thread_id)
+    messages: List[BaseMessage] = [_to_message(r) for r in ctx["messages"]]
+    return {"messages": messages + [HumanMessage(content=text)], "summary": ctx["summary"]}
+
+
+def after_turn(thread_id: str, inputs: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """Guarda el resumen si el turno plegó mensajes viejos (solo en modo messages)."""
+    if HISTORY_STORE == "checkpoints":
+        return
+    summary = result.get("summary") or ""
+    if summary == (inputs.get("summary") or ""):
+        return
+    loaded = _row_ids(inputs["messages"])
+    kept = set(_row_ids(result.get("messages", [])))
+    # El resumen cubre todo lo cargado que no sobrevivió
+    folded = [i for i in loaded if i not in kept]
+    if folded:
+        set_thread_summary(thread_id, summary, max(folded))
+
+
+# -----------------------------
+# Migración desde checkpoints
+# -----------------------------
+
+
+def migrate_thread(thread_id: str, saver: Any, dry_run: bool = False) -> str:
+    """
+    Copia el resumen del último checkpoint del hilo a chats.summary.
+
+    El checkpoint conserva los últimos turnos completos; el resumen cubre los
+    mensajes de app.db anteriores al primer turno conservado. Devuelve el
+    resultado: sin_checkpoint, sin_resumen, migrado o divergente (el último
+    mensaje del usuario no coincide entre ambos almacenes).
+    """
+    from graph import _turn_starts
+
+    cfg = RunnableConfig({"configurable": {"thread_id": thread_id}})
+    tup = saver.get_tuple(cfg)
+    if tup is None:
+        return "sin_checkpoint"
+    values = tup.checkpoint.get("channel_values", {})
+    msgs = values.get("messages", [])
+    # Solo los mensajes del usuario: las preguntas reescritas no están en app.db
+    humans = [msgs[i] for i in _turn_starts(msgs)]
+    summary = values.get("summary") or ""
+    rows = thread_user_messages(thread_id)
+
+    diverged = bool(humans) and (not rows or rows[-1]["content"] != humans[-1].content)
+    if not summary:
+        return "divergente" if diverged else "sin_resumen"
+    if len(humans) > len(rows):
+        # app.db tiene menos turnos que el checkpoint: el resumen no se puede ubicar
+        return "divergente"
+    if humans:
+        upto = rows[-len(humans)]["id"] - 1
+    else:
+        # Todo el hilo quedó en el resumen
+        upto = max((m["id"] for m in load_thread_context(thread_id)["messages"]), default=0)
+    if not dry_run:
+        set_thread_summary(thread_id, summary, upto)
+    return "divergente" if diverged else "migrado"
+
+
+def migrate(drop_checkpoints: bool = False, dry_run: bool = False) -> Dict[str, int]:
+    """Migra todos los hilos de app.db; con `drop_checkpoints` borra los ya migrados."""
+    from graph import get_checkpointer
+
+    saver = get_checkpointer()
+    counts: Dict[str, int] = {}
+    for thread_id in list_live_threads():
+        outcome = migrate_thread(thread_id, saver, dry_run)
+        counts[outcome] = counts.get(outcome, 0) + 1
+        if outcome == "divergente":
+            logger.warning(f"Hilo {thread_id}: app.db y checkpoints no coinciden")
+        if drop_checkpoints and not dry_run and outcome in ("migrado", "sin_resumen"):
+            saver.delete_thread(thread_id)
+    return counts
+
+
+# CLI
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Historial con app.db.messages como fuente única")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_migrate = sub.add_parser("migrate", help="Copia los resúmenes de los checkpoints a app.db")
+    p_migrate.add_argument("--drop-checkpoints", action="store_true", help="Borra los checkpoints migrados")
+    p_migrate.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.cmd == "migrate":
+        from db import init_db
+
+        init_db()
+        print(migrate(drop_checkpoints=args.drop_checkpoints, dry_run=args.dry_run))
+        if args.drop_checkpoints and not args.dry_run:
+            print("Para devolver el espacio: uv run python src/checkpoints.py vacuum")
@@ -0,0 +1,182 @@
+# Clientes HTTP compartidos por todos los modelos y embeddings de OpenAI.
+# Un httpx.Client y un httpx.AsyncClient por proceso (con el mismo pool de
+# conexiones para cada variante), con keep-alive, límites configurables y
+# HTTP/2 si está instalado el paquete h2. providers.py los inyecta en
+# ChatOpenAI y OpenAIEmbeddings, así que los roles reutilizan conexiones en
+# lugar de abrir una (TCP + TLS) por cliente. El transporte cuenta requests,
+# conexiones nuevas y handshakes TLS vía el trace de httpcore (/metrics y stats()).
+#
+#   uv run python src/bench_http.py --requests 200
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+import httpx
+
+from metrics import HTTP_CONNECT_SECONDS, HTTP_CONNECTIONS, HTTP_REQUESTS, HTTP_TLS_HANDSHAKES
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # HTTP/2 opcional
+    h2 = None
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+# "auto": HTTP/2 si h2 está instalado
+HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "auto")
+
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def http2_enabled() -> bool:
+    if HTTP_HTTP2 == "auto":
+        return h2 is not None
+    return HTTP_HTTP2 == "1" and h2 is not None
+
+
+def _count(name: str, key: str, amount: float = 1) -> None:
+    with _stats_lock:
+        s = _stats.setdefault(
+            name, {"requests": 0, "connections": 0, "tls_handshakes": 0, "connect_s": 0.0}
+        )
+        s[key] += amount
+
+
+def _on_event(name: str, started: Dict[str, float], event: str) -> None:
+    # Eventos de httpcore: connection.connect_tcp.started/complete, connection.start_tls.*
+    if event.endswith(".started"):
+        started[event[: -len(".started")]] = time.perf_counter()
+        return
+    if not event.endswith(".complete"):
+        return
+    step = event[: -len(".complete")]
+    t0 = started.pop(step, None)
+    if step == "connection.connect_tcp":
+        HTTP_CONNECTIONS.inc(client=name)
+        _count(name, "connections")
+    elif step == "connection.start_tls":
+        HTTP_TLS_HANDSHAKES.inc(client=name)
+        _count(name, "tls_handshakes")
+    else:
+        return
+    if t0 is not None:
+        elapsed = time.perf_counter() - t0
+        HTTP_CONNECT_SECONDS.observe(elapsed, client=name)
+        _count(name, "connect_s", elapsed)
+
+
+class InstrumentedTransport(httpx.HTTPTransport):
+    """HTTPTransport que cuenta requests, conexiones nuevas y handshakes."""
+
+    def __init__(self, name: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.name = name
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started: Dict[str, float] = {}
+        previous = request.extensions.get("trace")
+
+        def trace(event: str, info: Dict[str, Any]) -> None:
+            _on_event(self.name, started, event)
+            if previous is not None:
+                previous(event, info)
+
+        request.extensions["trace"] = trace
+        HTTP_REQUESTS.inc(client=self.name)
+        _count(self.name, "requests")
+        return super().handle_request(request)
+
+
+class InstrumentedAsyncTransport(httpx.AsyncHTTPTransport):
+    """Variante async de InstrumentedTransport."""
+
+    def __init__(self, name: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.name = name
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started: Dict[str, float] = {}
+        previous = request.extensions.get("trace")
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            _on_event(self.name, started, event)
+            if previous is not None:
+                await previous(event, info)
+
+        request.extensions["trace"] = trace
+        HTTP_REQUESTS.inc(client=self.name)
+        _count(self.name, "requests")
+        return await super().handle_async_request(request)
+
+
+def _transport_kwargs(overrides: Dict[str, Any]) -> Dict[str, Any]:
+    kwargs = {
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "http2": http2_enabled(),
+    }
+    # Con un transporte propio httpx no lee las variables de proxy
+    proxy = os.getenv("HTTPS_PROXY") or os.getenv("https_proxy")
+    if proxy:
+        kwargs["proxy"] = proxy
+    kwargs.update(overrides)
+    return kwargs
+
+
+# El timeout de lectura lo pone cada llamada (timeout del rol); aquí solo el de conexión
+_TIMEOUT = httpx.Timeout(None, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def make_client(name: str = "sync", **overrides: Any) -> httpx.Client:
+    """Cliente síncrono instrumentado; `overrides` va al transporte (verify, limits, http2)."""
+    return httpx.Client(
+        transport=InstrumentedTransport(name, **_transport_kwargs(overrides)), timeout=_TIMEOUT
+    )
+
+
+def make_async_client(name: str = "async", **overrides: Any) -> httpx.AsyncClient:
+    """Cliente async instrumentado; `overrides` va al transporte."""
+    return httpx.AsyncClient(
+        transport=InstrumentedAsyncTransport(name, **_transport_kwargs(overrides)), timeout=_TIMEOUT
+    )
+
+
+_shared: Dict[str, Any] = {}
+_shared_lock = threading.Lock()
+
+
+def _get(key: str, factory: Callable[[], Any]) -> Any:
+    client = _shared.get(key)
+    if client is None:
+        with _shared_lock:
+            client = _shared.get(key)
+            if client is None:
+                client = _shared[key] = factory()
+    return client
+
+
+def sync_client() -> httpx.Client:
+    """Cliente síncrono compartido del proceso."""
+    return _get("sync", make_client)
+
+
+def async_client() -> httpx.AsyncClient:
+    """Cliente async compartido del proceso."""
+    return _get("async", make_async_client)
+
+
+def stats() -> Dict[str, Dict[str, float]]:
+    """Totales por cliente, con la fracción de requests que reutilizó una conexión."""
+    with _stats_lock:
+        out = {name: dict(s) for name, s in _stats.items()}
+    for s in out.values():
+        s["reuse_ratio"] = 1 - s["connections"] / s["requests"] if s["requests"] else 0.0
+    return out
@@ -0,0 +1,369 @@
+# Ingesta de PDFs: copia al almacén de blobs (una lectura, con hash), descarte
+# de repetidos, carga, enlace en el directorio del hilo, registro en app.db e
+# indexación padre/hijo en el vector store.
+#
+# Los PDFs de más de LARGE_PDF_MB (manuales, tesis) no se cargan enteros: se
+# dividen en rangos de INGEST_RANGE_PAGES páginas que un pool de procesos
+# parsea con PyMuPDF. Los rangos se consumen en orden y a lo sumo
+# INGEST_INFLIGHT esperan parseados, así que si el embedder va más lento el
+# parseo se frena (la memoria depende del rango, no del archivo). El texto se
+# corta en padres a medida que llega y cada INGEST_FLUSH_PARENTS padres se
+# escriben hijos y padres y se guarda el avance en ingest_jobs. Los ids salen
+# del hilo, el hash y el número de padre: si el proceso muere, la ingesta se
+# retoma desde la última página guardada (resume_pending, o al volver a subir
+# el archivo) y lo que se reescriba pisa lo mismo.
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import fitz
+from langchain_community.document_loaders import PyMuPDFLoader
+from langchain_core.documents import Document
+
+import blobs
+from db import (
+    add_file,
+    add_thread_documents,
+    create_ingest_job,
+    finish_ingest_job,
+    get_chat_id_by_thread,
+    get_ingest_job,
+    has_file,
+    list_ingest_jobs,
+    save_ingest_progress,
+    take_ingest_job,
+    thread_upload_dir,
+)
+from graph import get_retriever, parent_splitter
+from usage import usage_scope
+
+logger = logging.getLogger(__name__)
+
+LARGE_PDF_MB = float(os.getenv("LARGE_PDF_MB", "20"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+INGEST_RANGE_PAGES = int(os.getenv("INGEST_RANGE_PAGES", "32"))
+INGEST_INFLIGHT = int(os.getenv("INGEST_INFLIGHT", str(2 * INGEST_WORKERS)))
+INGEST_FLUSH_PARENTS = int(os.getenv("INGEST_FLUSH_PARENTS", "64"))
+
+
+@contextmanager
+def _stage(timings: Optional[Dict[str, float]], name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - t0
+
+
+def ingest_pdf(
+    path: str,
+    user_id: int,
+    thread_id: str,
+    timings: Optional[Dict[str, float]] = None,
+) -> Optional[str]:
+    """
+    Indexa un PDF subido en el hilo. Devuelve el nombre con el que se guardó, o
+    None si el archivo ya estaba registrado en el chat. Si se pasa `timings`, se
+    acumulan allí los segundos de cada etapa (store, parse, link, register, index).
+    """
+    with _stage(timings, "store"):
+        sha, blob = blobs.store(path)
+        chat_id = get_chat_id_by_thread(thread_id)
+        # Una ingesta grande sin terminar se retoma aunque el archivo ya esté registrado
+        resuming = get_ingest_job(thread_id, sha) is not None
+        # Repetido en el chat: se descarta sin parsearlo
+        if not resuming and has_file(user_id, chat_id, sha):
+            return None
+
+    # Sanitize and save file
+    safe_filename = Path(path).name
+    if resuming or blob.stat().st_size > LARGE_PDF_MB * 1e6:
+        return ingest_large(blob, sha, safe_filename, user_id, thread_id, timings)
+
+    with _stage(timings, "parse"):
+        page_docs = PyMuPDFLoader(str(blob)).load()
+
+    save_path = thread_upload_dir(user_id, thread_id) / safe_filename
+    with _stage(timings, "link"):
+        blobs.link_into(blob, save_path)
+
+    with _stage(timings, "register"):
+        file_id = add_file(
+            user_id,
+            chat_id,
+            original_name=safe_filename,
+            stored_path=save_path,
+            sha256=sha,
+        )
+    if not file_id:
+        return None
+
+    with _stage(timings, "index"), usage_scope(node="ingest"):
+        full_text = "\n".join(d.page_content for d in page_docs)
+        docs = [
+            Document(
+                page_content=full_text,
+                metadata={
+                    "source": safe_filename,
+                    "user_id": user_id,
+                    "thread_id": thread_id,
+                },
+            )
+        ]
+        get_retriever(user_id, thread_id).add_documents(docs)
+    add_thread_documents(thread_id)
+    return safe_filename
+
+
+# -----------------------------
+# Documentos grandes
+# -----------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# Ingestas que corren en este proceso (ingest_jobs.owner solo distingue procesos)
+_active: Set[Tuple[str, str]] = set()
+_active_lock = threading.Lock()
+
+# En cada proceso del pool: último PDF abierto, para no reabrirlo por rango
+_open_doc: Dict[str, Any] = {}
+
+
+def _page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def _extract_pages(path: str, start: int, stop: int) -> List[str]:
+    """Corre en el pool: texto de las páginas [start, stop)."""
+    doc = _open_doc.get(path)
+    if doc is None:
+        for old in _open_doc.values():
+            old.close()
+        _open_doc.clear()
+        doc = _open_doc[path] = fitz.open(path)
+    return [doc[i].get_text() for i in range(start, stop)]
+
+
+def start_parse_pool() -> ProcessPoolExecutor:
+    """
+    Crea el pool de parseo y levanta sus procesos.
+
+    No usa fork: cuando se crea, el pool de auth ya tiene su hilo de gestión y
+    un fork con hilos vivos puede heredar un lock tomado. Con forkserver los
+    procesos salen de un servidor que importa main.py una sola vez (como
+    __mp_main__, sin lanzar la app); main.py lo llama al arrancar para no
+    pagar eso en la primera subida.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            method = "forkserver" if "forkserver" in methods else "spawn"
+            _pool = ProcessPoolExecutor(
+                max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context(method)
+            )
+            # Los procesos se crean en los primeros submit
+            for f in [_pool.submit(len, "") for _ in range(INGEST_WORKERS)]:
+                f.result()
+        return _pool
+
+
+def shutdown_parse_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def _alive(pid: Optional[int]) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _page_ranges(
+    path: str, start: int, pages: int, timings: Optional[Dict[str, float]]
+) -> Iterator[Tuple[int, List[str]]]:
+    """(primera página, textos) de cada rango, en orden y con a lo sumo INGEST_INFLIGHT en vuelo."""
+    pool = start_parse_pool()
+    starts = iter(range(start, pages, INGEST_RANGE_PAGES))
+    inflight: deque = deque()
+
+    def submit() -> None:
+        s = next(starts, None)
+        if s is not None:
+            inflight.append((s, pool.submit(_extract_pages, path, s, min(s + INGEST_RANGE_PAGES, pages))))
+
+    for _ in range(INGEST_INFLIGHT):
+        submit()
+    try:
+        while inflight:
+            s, fut = inflight[0]
+            with _stage(timings, "parse"):
+                texts = fut.result()
+            inflight.popleft()
+            # Se pide otro rango solo cuando se consume uno
+            submit()
+            yield s, texts
+    except BrokenProcessPool:
+        # Un proceso murió (p. ej. OOM): la próxima ingesta arranca un pool nuevo
+        shutdown_parse_pool()
+        raise
+    finally:
+        for _, fut in inflight:
+            fut.cancel()
+
+
+def _write_parents(
+    retriever: Any, parents: List[Document], first: int, thread_id: str, sha: str
+) -> Tuple[List[str], List[str]]:
+    """
+    Escribe hijos y padres con ids fijos, para que un reintento pise lo mismo.
+    Devuelve (ids de padres, ids de hijos).
+    """
+    ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{thread_id}/{sha}/{first + i}")) for i in range(len(parents))]
+    children, child_ids = [], []
+    for pid, parent in zip(ids, parents):
+        for j, child in enumerate(retriever.child_splitter.split_documents([parent])):
+            child.metadata[retriever.id_key] = pid
+            children.append(child)
+            child_ids.append(f"{pid}-{j}")
+    if children:
+        retriever.vectorstore.add_documents(children, ids=child_ids)
+    retriever.docstore.mset(list(zip(ids, parents)))
+    return ids, child_ids
+
+
+def ingest_large(
+    blob: Path,
+    sha: str,
+    name: str,
+    user_id: int,
+    thread_id: str,
+    timings: Optional[Dict[str, float]] = None,
+) -> Optional[str]:
+    """
+    Ingesta por rangos de páginas de un PDF grande, retomando la que haya
+    quedado a medias. None si otro proceso o hilo ya la está haciendo, o si el
+    chat se borró mientras tanto.
+    """
+    key = (thread_id, sha)
+    with _active_lock:
+        if key in _active:
+            return None
+        _active.add(key)
+    try:
+        save_path = thread_upload_dir(user_id, thread_id) / name
+        with _stage(timings, "link"):
+            blobs.link_into(blob, save_path)
+        with _stage(timings, "register"):
+            # Al retomar ya está registrado y add_file no inserta nada
+            add_file(
+                user_id,
+                get_chat_id_by_thread(thread_id),
+                original_name=name,
+                stored_path=save_path,
+                sha256=sha,
+            )
+            pages = start_parse_pool().submit(_page_count, str(blob)).result()
+            owner = os.getpid()
+            job = create_ingest_job(thread_id, sha, user_id, name, pages, owner)
+            if job["owner"] != owner:
+                if _alive(job["owner"]) or not take_ingest_job(thread_id, sha, owner, job["owner"]):
+                    return None
+        if job["next_page"]:
+            logger.info(f"Retomando {name} en el hilo {thread_id} desde la página {job['next_page'] + 1}")
+
+        retriever = get_retriever(user_id, thread_id)
+        meta = {"source": name, "user_id": user_id, "thread_id": thread_id}
+        written = job["parents"]
+        carry, carry_page = job["carry"], job["carry_page"]
+        batch: List[Document] = []
+        for first, texts in _page_ranges(str(blob), job["next_page"], pages, timings):
+            with _stage(timings, "index"), usage_scope(node="ingest"):
+                # Texto pendiente + el rango, con el offset donde empieza cada página
+                buffer, marks = carry, [0]
+                page_of = [carry_page]
+                for i, text in enumerate(texts):
+                    if buffer:
+                        buffer += "\n"
+                    marks.append(len(buffer))
+                    page_of.append(first + i)
+                    buffer += text
+                end = first + len(texts)
+                parts = parent_splitter.split_text(buffer)
+                # El último trozo puede seguir en el rango siguiente: queda pendiente
+                keep = parts.pop() if parts and end < pages else ""
+                cursor = 0
+                for part in parts:
+                    cursor = max(buffer.find(part, cursor), cursor)
+                    page = page_of[bisect_right(marks, cursor) - 1]
+                    batch.append(Document(page_content=part, metadata={**meta, "page": page}))
+                    cursor += 1
+                carry_off = max(buffer.rfind(keep), 0) if keep else len(buffer)
+                carry, carry_page = keep, page_of[bisect_right(marks, carry_off) - 1]
+
+                if len(batch) >= INGEST_FLUSH_PARENTS or end >= pages:
+                    # Borrar el chat borra la fila (ON DELETE CASCADE): se deja de escribir
+                    if get_ingest_job(thread_id, sha) is None:
+                        logger.warning(f"Ingesta de {name} cancelada: el hilo {thread_id} ya no existe")
+                        return None
+                    parent_ids, child_ids = _write_parents(retriever, batch, written, thread_id, sha)
+                    written += len(batch)
+                    batch = []
+                    if not save_ingest_progress(thread_id, sha, owner, end, written, carry, carry_page):
+                        # El chat se borró durante la escritura y la limpieza del hilo
+                        # pudo correr antes: este lote lo borra la ingesta misma
+                        if child_ids:
+                            retriever.vectorstore.delete(ids=child_ids)
+                        retriever.docstore.mdelete(parent_ids)
+                        logger.warning(f"Ingesta de {name} cancelada: el hilo {thread_id} ya no existe")
+                        return None
+        finish_ingest_job(thread_id, sha)
+        add_thread_documents(thread_id)
+        return name
+    finally:
+        with _active_lock:
+            _active.discard(key)
+
+
+def resume_pending() -> int:
+    """Retoma las ingestas cuyo proceso murió. Devuelve cuántas terminó."""
+    done = 0
+    for job in list_ingest_jobs():
+        # Un owner igual al pid propio es de una corrida anterior (pids reusados en contenedores)
+        if (job["thread_id"], job["sha256"]) in _active or (
+            job["owner"] != os.getpid() and _alive(job["owner"])
+        ):
+            continue
+        blob = blobs.blob_path(job["sha256"])
+        if not blob.exists():
+            logger.error(f"No se puede retomar {job['source']}: falta el blob {job['sha256']}")
+            finish_ingest_job(job["thread_id"], job["sha256"])
+            continue
+        try:
+            if ingest_large(blob, job["sha256"], job["source"], job["user_id"], job["thread_id"]):
+                done += 1
+        except Exception as e:
+            logger.error(f"Error retomando {job['source']} en el hilo {job['thread_id']}: {e}")
+    return done
@@ -0,0 +1,278 @@
+# Generador de carga offline.
+# Simula N usuarios concurrentes que conversan con el bot usando los modelos
+# falsos de fakes.py (LLM_PROVIDER=fake), en un directorio de trabajo aislado
+# (app.db, chat.db, Chroma y docstore propios). Reporta throughput y latencias
+# p50/p95/p99 por nodo del grafo y de punta a punta. No requiere red.
+#
+#   uv run python src/loadgen.py --users 20 --turns 5 --mode bot
+#   uv run python src/loadgen.py --users 50 --turns 3 --mode graph --out carga.json
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+QUESTIONS = [
+    "¿Cuáles son las cinco fases del modelo de proceso propuesto?",
+    "¿Qué tareas se realizan en la fase de Project Definition?",
+    "¿Qué objetivo tiene la fase de Domain Survey?",
+    "¿Qué beneficios busca la metodología respecto a la calidad de los datos?",
+    "Me llamo Ana y soy ingeniera, ¿me resumís el documento?",
+    "¿Qué sección menciona la Data and Knowledge Exploitation phase?",
+]
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Mide la duración de cada nodo del grafo (y del grader) vía callbacks."""
+
+    # Funciones de aristas condicionales que se miden aparte
+    EXTRA_RUNS = {"grade_documents"}
+
+    def __init__(self) -> None:
+        self._starts: Dict[UUID, Any] = {}
+        self._lock = threading.Lock()
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        node = (metadata or {}).get("langgraph_node")
+        if node and (name == node or name in self.EXTRA_RUNS):
+            self._starts[run_id] = (name, time.perf_counter())
+
+    def _finish(self, run_id) -> None:
+        started = self._starts.pop(run_id, None)
+        if started:
+            name, t0 = started
+            with self._lock:
+                self.samples[name].append(time.perf_counter() - t0)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+
+# Registra el timer en todas las ejecuciones de LangChain del hilo actual,
+# incluidas las de graph.invoke dentro de bot(), sin modificar la app.
+_node_timer_var: ContextVar[Optional[NodeTimer]] = ContextVar("loadgen_node_timer", default=None)
+register_configure_hook(_node_timer_var, inheritable=True)
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if len(samples) < 2:
+        v = samples[0] * 1000 if samples else 0.0
+        return {"n": len(samples), "p50_ms": v, "p95_ms": v, "p99_ms": v}
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "n": len(samples),
+        "p50_ms": q[49] * 1000,
+        "p95_ms": q[94] * 1000,
+        "p99_ms": q[98] * 1000,
+    }
+
+
+def prepare_workdir(workdir: Path) -> None:
+    """Aísla el estado de la app en `workdir` antes de importar sus módulos."""
+    workdir.mkdir(parents=True, exist_ok=True)
+    assets = workdir / "assets"
+    if not assets.exists():
+        assets.symlink_to(REPO_ROOT / "assets", target_is_directory=True)
+    os.chdir(workdir)
+    os.environ.setdefault("LLM_PROVIDER", "fake")
+    os.environ["APP_DB_PATH"] = str(workdir / "app.db")
+    os.environ["CHECKPOINT_DB_PATH"] = str(workdir / "chat.db")
+    os.environ["UPLOADS_DIR"] = str(workdir / "uploads")
+
+
+def _setup_users(
+    n_users: int, with_docs: bool, seed: int, prefix: str = "carga"
+) -> List[Dict[str, Any]]:
+    from langchain_core.documents import Document
+
+    import db
+    from graph import get_retriever
+
+    db.init_db()
+    rng = random.Random(seed)
+    users = []
+    for i in range(n_users):
+        username = f"{prefix}_{i}"
+        uid = db.get_user_id(username) or db.create_user(username, "carga")
+        chat_id = db.create_chat(uid, "Chat 1")
+        tid = db.get_chat_by_id(chat_id)["thread_id"]
+        if with_docs:
+            text = " ".join(rng.choice(QUESTIONS) for _ in range(300))
+            doc = Document(
+                page_content=text,
+                metadata={"source": "carga.pdf", "user_id": uid, "thread_id": tid},
+            )
+            get_retriever(uid, tid).add_documents([doc])
+            db.add_thread_documents(tid)
+        users.append({"user_id": uid, "thread_id": tid})
+    return users
+
+
+def run_load(args: argparse.Namespace, ready: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """
+    Corre la simulación. `ready` se llama tras crear usuarios y documentos, justo
+    antes de empezar a medir (bench_workers lo usa para arrancar todos a la vez).
+    """
+    from langchain_core.messages import HumanMessage
+    from langchain_core.runnables import RunnableConfig
+
+    from graph import graph
+
+    bot = None
+    if args.mode == "bot":
+        import main as app
+
+        bot = app.bot
+
+    users = _setup_users(args.users, not args.no_docs, args.seed, args.user_prefix)
+    timer = NodeTimer()
+    e2e: List[float] = []
+    queue_wait: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    # Emula demo.queue(default_concurrency_limit=...) de Gradio
+    slots = threading.Semaphore(args.concurrency_limit) if args.concurrency_limit else None
+
+    def simulate(idx: int) -> None:
+        nonlocal errors
+        _node_timer_var.set(timer)
+        rng = random.Random(args.seed + idx)
+        u = users[idx]
+        history: List[Dict[str, Any]] = []
+        for _ in range(args.turns):
+            time.sleep(rng.expovariate(1 / args.think_time) if args.think_time else 0)
+            question = rng.choice(QUESTIONS)
+            t_enq = time.perf_counter()
+            if slots:
+                slots.acquire()
+            t0 = time.perf_counter()
+            failed = False
+            try:
+                if bot is not None:
+                    history = history + [{"role": "user", "content": question}]
+                    history, _ = bot(history, {"text": question, "files": []}, u["thread_id"], u["user_id"])
+                    failed = "ocurrió un error" in str(history[-1]["content"])
+                else:
+                    cfg = RunnableConfig(
+                        {"configurable": {"thread_id": u["thread_id"], "user_id": u["user_id"]}}
+                    )
+                    graph.invoke({"messages": [HumanMessage(content=question)]}, cfg)
+            except Exception:
+                failed = True
+            finally:
+                if slots:
+                    slots.release()
+            t1 = time.perf_counter()
+            with lock:
+                e2e.append(t1 - t0)
+                queue_wait.append(t0 - t_enq)
+                errors += failed
+
+    if ready is not None:
+        ready()
+    started_at = time.time()
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(simulate, range(args.users)))
+    wall = time.perf_counter() - t_start
+
+    import speculative
+
+    spec = speculative.stats() if speculative.SPECULATIVE_RETRIEVAL else None
+    if spec:
+        spec["saved_ms_per_turn"] = spec["saved_s"] * 1000 / len(e2e) if e2e else 0.0
+    return {
+        "mode": args.mode,
+        "users": args.users,
+        "turns": len(e2e),
+        "errors": errors,
+        "wall_s": wall,
+        "started_at": started_at,
+        "throughput_turns_s": len(e2e) / wall if wall else 0.0,
+        "end_to_end": _percentiles(e2e),
+        "queue_wait": _percentiles(queue_wait),
+        "nodes": {name: _percentiles(v) for name, v in sorted(timer.samples.items())},
+        "speculative": spec,
+    }
+
+
+def print_report(r: Dict[str, Any]) -> None:
+    print(
+        f"Modo={r['mode']} usuarios={r['users']} turnos={r['turns']} "
+        f"errores={r['errors']} duración={r['wall_s']:.1f}s "
+        f"throughput={r['throughput_turns_s']:.2f} turnos/s"
+    )
+    print(f"{'etapa':<28} {'n':>6} {'p50':>10} {'p95':>10} {'p99':>10}")
+    rows = [("punta a punta", r["end_to_end"]), ("espera en cola", r["queue_wait"])]
+    rows += [(f"nodo {k}", v) for k, v in r["nodes"].items()]
+    for name, p in rows:
+        print(
+            f"{name:<28} {p['n']:>6} {p['p50_ms']:>8.1f}ms {p['p95_ms']:>8.1f}ms {p['p99_ms']:>8.1f}ms"
+        )
+    spec = r.get("speculative")
+    if spec:
+        print(
+            f"Recuperación especulativa: {spec['hit']}/{spec['attempts']} aciertos "
+            f"({spec['hit_rate']:.0%}), {spec['saved_ms_per_hit']:.0f} ms ahorrados por acierto, "
+            f"{spec['saved_ms_per_turn']:.0f} ms por turno"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prueba de carga offline del chatbot")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--mode", choices=["bot", "graph"], default="bot")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Media (s) entre turnos")
+    parser.add_argument("--concurrency-limit", type=int, default=5, help="0 = sin límite")
+    parser.add_argument("--no-docs", action="store_true", help="Hilos sin documentos indexados")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--user-prefix", default="carga", help="Prefijo de los usuarios simulados")
+    parser.add_argument("--workdir", type=Path, default=None, help="Por defecto, temporal")
+    parser.add_argument("--out", type=Path, default=None, help="Guardar resultados en JSON")
+    args = parser.parse_args()
+
+    out = args.out.resolve() if args.out else None
+    tmp = None
+    if args.workdir is None:
+        tmp = tempfile.TemporaryDirectory(prefix="gemis_load_")
+        args.workdir = Path(tmp.name)
+    prepare_workdir(args.workdir.resolve())
+    try:
+        result = run_load(args)
+    finally:
+        # El consumo pendiente va a app.db antes de borrar el workdir; en atexit ya no existe
+        usage = sys.modules.get("usage")
+        if usage is not None:
+            usage.recorder.flush()
+        os.chdir(REPO_ROOT)
+        if tmp:
+            tmp.cleanup()
+    print_report(result)
+    if out:
+        out.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,10 @@
 import gradio as gr
-import time
 import os
-import shutil
+import sys
 import logging
+import threading
 from pathlib import Path
 from typing import List, Tuple, Optional, Dict, Any, Union
-from langchain_core.documents import Document
-from langchain_core.messages import HumanMessage
-from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_core.runnables import RunnableConfig
 from db import (
     get_user_id,
@@ -15,17 +12,28 @@ from db import (
     list_chats,
     create_chat,
     touch_chat,
-    add_file,
     get_chat_id_by_thread,
     get_files_by_chat_id,
     delete_chat_by_thread,
     persist_message,
     load_chat_messages,
     rename_chat,
+    chats_version,
+    init_db,
 )
-from auth import verify
+import sessions
+from auth import AUTH_MAX_PENDING, averify, start_pool
 from title_setter import _generate_title_openai
-from graph import graph, retriever
+from graph import get_graph
+from history import after_turn, graph_input
+from ingest import ingest_pdf, resume_pending, start_parse_pool
+from checkpoints import CheckpointCompactor
+from cleanup import CleanupWorker
+from profiler import profile_request, span
+from metrics import INFLIGHT, METRICS_ENABLED, QUEUE_DEPTH, REQUEST_SECONDS, metrics_route
+from usage import record_turn, usage_scope
+from scheduler import QUEUE_CONCURRENCY, SCHEDULER_ENABLED, is_rate_limit, log_rate_limits, schedule
+from startup import profile_startup, warm_up_in_background
 from gradio import ChatMessage
 from style import gemis_theme, custom_css
 
@@ -37,9 +45,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Constantes
-MAX_FILE_SIZE_MB = 10
+# Los PDFs de más de LARGE_PDF_MB se ingieren por rangos de páginas (ver ingest.py)
+MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "500"))
 ALLOWED_FILE_TYPES = [".pdf"]
-SESSION_TIMEOUT = 3600  # 1 hora
+SESSION_TIMEOUT = sessions.SESSION_TTL  # 1 hora por defecto
+# Índice del proceso cuando corre detrás de serve.py (0 si es el único)
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+
+# Limpieza en segundo plano de los datos de chats eliminados
+cleanup_worker = CleanupWorker()
 
 
 def _to_history(message: Dict[str, Any]) -> Optional[ChatMessage]:
@@ -56,42 +70,49 @@ def _to_history(message: Dict[str, Any]) -> Optional[ChatMessage]:
     return None
 
 
-def _reload_chats(uid: int) -> gr.update:
-    """Recarga la lista de chats del usuario."""
+def _user_chats(uid: int) -> Dict[str, Any]:
+    """Chats del usuario y último hilo abierto, desde la caché de sesiones si siguen vigentes."""
+    version = chats_version(uid)
+    entry = sessions.cache.get(uid, version)
+    if entry is not None:
+        return entry
+
     threads = list_chats(uid)
     if len(threads) == 0:
-        chat_id = create_chat(uid, "Chat 1")
-        tid = get_chat_by_id(chat_id).get("thread_id")
-        choices = [("Chat 1", tid)]
-    else:
-        tid = threads[0].get("thread_id")
-        choices = [
-            (f"{t.get('title', 'Sin título')}", t.get("thread_id")) for t in threads
-        ]
-    return gr.update(choices=choices, value=tid)
+        create_chat(uid, "Chat 1")
+        threads = list_chats(uid)
+        version = chats_version(uid)
+    choices = [(f"{t.get('title', 'Sin título')}", t.get("thread_id")) for t in threads]
+    tid = sessions.cache.last_thread(uid)
+    if tid not in {c[1] for c in choices}:
+        tid = choices[0][1]
+    entry = {"chats": choices, "thread_id": tid, "version": version}
+    sessions.cache.put(uid, entry)
+    return entry
+
+
+def _reload_chats(uid: int) -> gr.update:
+    """Recarga la lista de chats del usuario."""
+    choices = _user_chats(uid)["chats"]
+    return gr.update(choices=choices, value=choices[0][1])
 
 
 def _reload(user: Dict[str, Any]) -> Tuple[Any, Any, Any, Any]:
     """Recarga la sesión del usuario y el historial del chat."""
-    if user is None or user.get("username") is None or user.get("ttl", 0) < time.time():
+    claims = sessions.load((user or {}).get("token"))
+    if claims is None:
         return gr.update(), None, None, gr.update(choices=[], value=None)
 
     try:
-        username = user.get("username")
-        uid = get_user_id(username)
+        # El user_id viene firmado en el token: no hace falta buscarlo por nombre
+        uid = claims["uid"]
+        username = claims["usr"]
         # Check: No emojis in text
         placeholder = f"Hola, {username.capitalize()} ¿En qué puedo ayudarte hoy?"
 
-        threads = list_chats(uid)
-        if len(threads) == 0:
-            chat_id = create_chat(uid, "Chat 1")
-            tid = get_chat_by_id(chat_id).get("thread_id")
-            choices = [("Chat 1", tid)]
-        else:
-            tid = threads[0].get("thread_id")
-            choices = [
-                (f"{t.get('title', 'Sin título')}", t.get("thread_id")) for t in threads
-            ]
+        entry = _user_chats(uid)
+        tid = entry["thread_id"]
+        choices = entry["chats"]
 
         cfg = RunnableConfig({"configurable": {"thread_id": tid, "user_id": uid}})
         hist = load_persisted_chat_history(cfg)
@@ -124,6 +145,7 @@ def _new_chat(user_id: int) -> Tuple[Any, Any, Any, Any]:
         tid = get_chat_by_id(id).get("thread_id")
 
         new_choices = [(title, tid)] + dd_choices
+        sessions.cache.set_thread(int(user_id), tid)
 
         return (
             [],
@@ -141,6 +163,7 @@ def _delete_chat(user_id: int, thread_id: str) -> Tuple[Any, Any, Any, Any]:
     """Borra el chat actual manejando errores."""
     try:
         delete_chat_by_thread(thread_id)
+        cleanup_worker.enqueue(thread_id)
         remaining_threads = list_chats(user_id)
 
         if len(remaining_threads) > 0:
@@ -148,6 +171,7 @@ def _delete_chat(user_id: int, thread_id: str) -> Tuple[Any, Any, Any, Any]:
             new_choices = [
                 (f"{t.get('title', '')}", t.get("thread_id")) for t in remaining_threads
             ]
+            sessions.cache.set_thread(user_id, new_tid)
             return (
                 [],
                 new_tid,
@@ -186,6 +210,8 @@ def _switch_chat(tid: str, user_id: int) -> Tuple[Any, str, List[str]]:
         cfg = RunnableConfig({"configurable": {"thread_id": tid, "user_id": user_id}})
         hist = load_persisted_chat_history(cfg)
         archivos = get_files(tid)
+        # Al recargar la página se vuelve a este hilo
+        sessions.cache.set_thread(user_id, tid)
         return hist, tid, archivos
     except Exception as e:
         logger.error(f"Error cambiando de chat: {e}")
@@ -248,6 +274,22 @@ def add_message(history: List[Any], message: Dict[str, Any]) -> Tuple[List[Any],
 
 def bot(history: List[Any], message: Dict[str, Any], thread_id: str, user_id: int) -> Tuple[List[Any], List[str]]:
     """Procesa el mensaje del usuario y genera la respuesta del bot."""
+    INFLIGHT.inc()
+    only_files = message["files"] and not (message["text"] or "").strip()
+    try:
+        with REQUEST_SECONDS.time(kind="upload" if only_files else "chat"), profile_request(
+            user_id=user_id,
+            thread_id=thread_id,
+            message_chars=len(message["text"] or ""),
+            files=len(message["files"]),
+            history_len=len(history),
+        ), usage_scope(user_id=user_id, thread_id=thread_id):
+            return _bot(history, message, thread_id, user_id)
+    finally:
+        INFLIGHT.dec()
+
+
+def _bot(history: List[Any], message: Dict[str, Any], thread_id: str, user_id: int) -> Tuple[List[Any], List[str]]:
     try:
         touch_chat(thread_id)
         config = RunnableConfig(
@@ -275,43 +317,10 @@ def bot(history: List[Any], message: Dict[str, Any], thread_id: str, user_id: in
                         thread_id=thread_id,
                     )
 
-                    # Load PDF content
-                    loader = PyMuPDFLoader(path)
-                    page_docs = loader.load()
-
-                    # Sanitize and save file
-                    safe_filename = Path(path).name
-                    save_dir = f"test_data/{user_id}/thread_{thread_id}"
-                    save_path = os.path.join(save_dir, safe_filename)
-
-                    os.makedirs(save_dir, exist_ok=True)
-                    shutil.copy2(path, save_path)
-
-                    # Add to database
-                    chat_id = get_chat_id_by_thread(thread_id)
-                    file_id = add_file(
-                        user_id,
-                        chat_id,
-                        original_name=safe_filename,
-                        stored_path=Path(save_path),
-                    )
-
-                    if file_id:
-                        # Add to vector store
-                        full_text = "\n".join(d.page_content for d in page_docs)
-                        docs = [
-                            Document(
-                                page_content=full_text,
-                                metadata={
-                                    "source": safe_filename,
-                                    "user_id": user_id,
-                                    "thread_id": thread_id,
-                                },
-                            )
-                        ]
-                        retriever.add_documents(docs)
-                        uploaded_files.append(safe_filename)
-
+                    with schedule("ingest", user_id), span("ingest_pdf"):
+                        stored_name = ingest_pdf(path, user_id, thread_id)
+                    if stored_name:
+                        uploaded_files.append(stored_name)
                 except Exception as e:
                     print(f"Error processing PDF {path}: {e}")
                     gr.Warning(f"Error al procesar {Path(path).name}")
@@ -321,7 +330,8 @@ def bot(history: List[Any], message: Dict[str, Any], thread_id: str, user_id: in
         )
         if uploaded_files and user_message.strip() == "":
             if should_generate_title:
-                title = _generate_title_openai(f"files: {uploaded_files}")
+                with schedule("aux", user_id):
+                    title = _generate_title_openai(f"files: {uploaded_files}")
                 rename_chat(thread_id, title)
             response = "Tus archivos han sido subidos correctamente. ¿En qué puedo ayudarte con ellos?"
             history = history + [{"role": "assistant", "content": response}]
@@ -335,9 +345,10 @@ def bot(history: List[Any], message: Dict[str, Any], thread_id: str, user_id: in
             return history, get_files(thread_id)
 
         if user_message.strip():
-            result = graph.invoke(
-                {"messages": [HumanMessage(content=user_message)]}, config
-            )
+            inputs = graph_input(thread_id, user_message)
+            with schedule("chat", user_id), span("graph.invoke"):
+                result = get_graph().invoke(inputs, config)
+            after_turn(thread_id, inputs, result)
 
             ai_messages = result.get("messages", [])
             answer = ""
@@ -345,6 +356,7 @@ def bot(history: List[Any], message: Dict[str, Any], thread_id: str, user_id: in
                 answer = getattr(ai_messages[-1], "content", "") or str(ai_messages[-1])
 
             history = history + [{"role": "assistant", "content": answer}]
+            record_turn(user_id, thread_id)
 
             persist_message(
                 content=user_message,
@@ -362,19 +374,37 @@ def bot(history: List[Any], message: Dict[str, Any], thread_id: str, user_id: in
             )
 
             if should_generate_title:
-                title = _generate_title_openai(user_message)
+                with schedule("aux", user_id), span("title"):
+                    title = _generate_title_openai(user_message)
                 rename_chat(thread_id, title)
 
         return history, get_files(thread_id)
 
     except Exception as e:
         logger.error(f"Error en función bot: {e}")
-        error_msg = "Lo siento, ocurrió un error al procesar tu mensaje. Por favor, intenta nuevamente."
+        if is_rate_limit(e):
+            # Se agotaron los reintentos: el proveedor sigue saturado
+            error_msg = "El servicio está recibiendo muchas consultas. Por favor, intenta de nuevo en unos segundos."
+        else:
+            error_msg = "Lo siento, ocurrió un error al procesar tu mensaje. Por favor, intenta nuevamente."
         history = history + [{"role": "assistant", "content": error_msg}]
         return history, get_files(thread_id)
 
 
-def do_login(user: str, password: str) -> Tuple[gr.update, gr.update, Union[gr.Text, gr.Markdown], Dict[str, Any]]:
+def _client_ip(request: Optional[gr.Request]) -> Optional[str]:
+    """IP del cliente; detrás del balancer de serve.py viene en X-Forwarded-For."""
+    if request is None or request.client is None:
+        return None
+    host = request.client.host
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and host in ("127.0.0.1", "::1"):
+        return forwarded.split(",")[-1].strip()
+    return host
+
+
+async def do_login(
+    user: str, password: str, request: gr.Request = None
+) -> Tuple[gr.update, gr.update, Union[gr.Text, gr.Markdown], Dict[str, Any]]:
     """Maneja el inicio de sesión del usuario."""
     if not user or not password:
         return (
@@ -388,13 +418,14 @@ def do_login(user: str, password: str) -> Tuple[gr.update, gr.update, Union[gr.T
             gr.update(),
         )
 
-    ok, _ = verify(user, password)
+    # async: la espera por bcrypt no ocupa un hilo del pool de Gradio
+    ok, message = await averify(user, password, _client_ip(request))
     if not ok:
         return (
             gr.update(),
             gr.update(),
             gr.Markdown(
-                "Usuario o contraseña inválidos.",
+                message,
                 elem_id="login-message",
                 elem_classes=["error"],
             ),
@@ -405,46 +436,49 @@ def do_login(user: str, password: str) -> Tuple[gr.update, gr.update, Union[gr.T
         gr.update(visible=False),
         gr.update(visible=True),
         gr.Markdown("", elem_id="login-message", elem_classes=["success"]),
-        {"username": user, "ttl": time.time() + SESSION_TIMEOUT},
+        {"token": sessions.issue(get_user_id(user), user, SESSION_TIMEOUT)},
     )
 
 
 def do_logout(user_id: int) -> Tuple[gr.update, gr.update, gr.Markdown, Dict[str, Any]]:
     """Maneja el cierre de sesión."""
+    if user_id is not None:
+        sessions.cache.drop(user_id)
     return (
         gr.update(visible=True),
         gr.update(visible=False),
         gr.Markdown("", elem_id="login-message"),
-        {"username": None, "ttl": 0},
+        {"token": None},
     )
 
 
 def restore_session(stored_user: Dict[str, Any]) -> Tuple[gr.update, gr.update, str, gr.update]:
     """Restaura la sesión del usuario al cargar la página."""
-    if (
-        stored_user is None
-        or stored_user.get("username") is None
-        or stored_user.get("ttl", 0) < time.time()
-    ):
+    # Token firmado: un BrowserState editado o vencido vuelve al login
+    claims = sessions.load((stored_user or {}).get("token"))
+    if claims is None:
         return (
             gr.update(visible=True),
             gr.update(visible=False),
             "",
-            {"username": None, "ttl": 0},
+            {"token": None},
         )
 
     return (
         gr.update(visible=False),
         gr.update(visible=True),
         # Removed emoji per user request
-        f"Hola, **{stored_user.get('username')}**",
+        f"Hola, **{claims['usr']}**",
         gr.update(),
     )
 
 
 # Interfaz Principal de Gradio
 with gr.Blocks(title="Chatbot GEMIS", theme=gemis_theme, css=custom_css) as demo:
-    auth = gr.BrowserState({"username": None, "ttl": 0})
+    # Clave y secreto fijos: la sesión sobrevive a reinicios y vale en todos los workers
+    auth = gr.BrowserState(
+        {"token": None}, storage_key="gemis_session", secret=sessions.SESSION_SECRET
+    )
 
     # Pantalla de Login
     with gr.Column(elem_id="login-wrapper", visible=True) as login_column:
@@ -575,7 +609,7 @@ with gr.Blocks(title="Chatbot GEMIS", theme=gemis_theme, css=custom_css) as demo
                 multimodal = gr.MultimodalTextbox(
                     interactive=True,
                     file_count="multiple",
-                    placeholder="Escribí tu mensaje o subí archivos (PDF, max 10MB)...",
+                    placeholder=f"Escribí tu mensaje o subí archivos (PDF, max {MAX_FILE_SIZE_MB}MB)...",
                     show_label=False,
                     file_types=[".pdf"],
                 )
@@ -633,6 +667,9 @@ with gr.Blocks(title="Chatbot GEMIS", theme=gemis_theme, css=custom_css) as demo
             fn=do_login,
             inputs=[user, pwd],
             outputs=[login_column, sidebar_and_chat, login_msg, auth],
+            # Cola propia: una ráfaga de logins no ocupa los lugares del chat
+            concurrency_limit=AUTH_MAX_PENDING,
+            concurrency_id="login",
         ).success(
             _reload,
             inputs=auth,
@@ -663,4 +700,37 @@ with gr.Blocks(title="Chatbot GEMIS", theme=gemis_theme, css=custom_css) as demo
 
 
 if __name__ == "__main__":
-    demo.queue(default_concurrency_limit=5).launch()
+    if "--profile-startup" in sys.argv:
+        profile_startup()
+        sys.exit(0)
+    init_db()
+    log_rate_limits()
+    # Antes de lanzar hilos: los procesos de bcrypt se crean con fork
+    start_pool()
+    # Los de parseo, con forkserver (ver ingest.start_parse_pool)
+    start_parse_pool()
+    if WORKER_INDEX == 0:
+        # Con varios workers la compactación de chat.db la hace uno solo
+        CheckpointCompactor().start()
+    cleanup_worker.start()
+    # Ingestas grandes que quedaron a medias en una corrida anterior
+    threading.Thread(target=resume_pending, name="ingest-resume", daemon=True).start()
+    # /metrics (Prometheus) se registra en la app FastAPI que crea Gradio
+    app_kwargs = {"routes": [metrics_route()]} if METRICS_ENABLED else None
+    # Se lee de la cola de Gradio al consultar: un contador propio se desbalancea
+    # cuando el cliente se desconecta antes de que su evento corra
+    QUEUE_DEPTH.set_function(
+        lambda: sum(len(q.queue) for q in demo._queue.event_queue_per_concurrency_id.values())
+    )
+    # El servidor queda escuchando antes de cargar modelos, Chroma y el grafo
+    # Con el planificador, la cola de Gradio solo admite: el orden justo y la
+    # concurrencia por tipo de trabajo los deciden los carriles de scheduler.py
+    concurrency = QUEUE_CONCURRENCY if SCHEDULER_ENABLED else 5
+    # Los handlers sync (el chat) corren en un pool de max_threads hilos: tiene que
+    # alcanzar para la cola del chat más el resto de los eventos. Los logins son
+    # async y no ocupan hilos de ese pool.
+    demo.queue(default_concurrency_limit=concurrency).launch(
+        app_kwargs=app_kwargs, prevent_thread_lock=True, max_threads=max(40, concurrency + 8)
+    )
+    warm_up_in_background()
+    demo.block_thread()
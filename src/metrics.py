@@ -0,0 +1,327 @@
+# Métricas operativas en formato de texto de Prometheus.
+# Registro mínimo en memoria (contadores, gauges e histogramas con etiquetas):
+# registrar un valor es un incremento bajo lock y el texto solo se arma cuando
+# alguien consulta /metrics. Los nodos del grafo, las llamadas a LLMs (cantidad,
+# latencia y tokens por modelo) y las tools se miden con un callback de
+# LangChain instalado globalmente; db.py, auth.verify y los títulos usan `timed`.
+
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_REGISTRY: List["_Metric"] = []
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{str(v).replace(chr(34), chr(39))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self._samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._fn: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float]) -> None:
+        """El valor se calcula al momento de la consulta."""
+        self._fn = fn
+
+    def _samples(self) -> List[str]:
+        if self._fn is not None:
+            try:
+                return [f"{self.name} {float(self._fn())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = _DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self._values.items()]
+        lines = []
+        for key, (counts, total, n) in items:
+            acc = 0
+            for bound, c in zip(self.buckets, counts):
+                acc += c
+                le = _fmt_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {acc}")
+            le = _fmt_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {n}")
+            labels = _fmt_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {n}")
+        return lines
+
+
+def render() -> str:
+    """Texto de exposición de todas las métricas registradas."""
+    return "\n".join(m.render() for m in _REGISTRY) + "\n"
+
+
+def timed(histogram: Histogram, label: Optional[str] = None):
+    """Decorador: observa la duración de la función (etiqueta = nombre de la función)."""
+
+    def decorator(fn):
+        value = label or fn.__name__
+        labels = {histogram.labelnames[0]: value} if histogram.labelnames else {}
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - t0, **labels)
+
+        return wrapper
+
+    return decorator
+
+
+# -----------------------------
+# Métricas de la aplicación
+# -----------------------------
+
+NODE_SECONDS = Histogram("gemis_graph_node_seconds", "Duración de cada nodo del grafo", ["node"])
+NODE_ERRORS = Counter("gemis_graph_node_errors_total", "Nodos del grafo que fallaron", ["node"])
+LLM_CALLS = Counter("gemis_llm_calls_total", "Llamadas a chat models", ["model"])
+LLM_SECONDS = Histogram("gemis_llm_call_seconds", "Duración de llamadas a chat models", ["model"])
+LLM_TOKENS = Counter("gemis_llm_tokens_total", "Tokens por modelo y dirección", ["model", "direction"])
+TOOL_SECONDS = Histogram("gemis_tool_seconds", "Duración de tools", ["tool"])
+REWRITES = Counter("gemis_rewrite_iterations_total", "Reescrituras de la pregunta")
+SPECULATIVE = Counter(
+    "gemis_speculative_retrieval_total", "Recuperaciones especulativas por resultado", ["outcome"]
+)
+SPECULATIVE_SAVED_SECONDS = Histogram(
+    "gemis_speculative_saved_seconds", "Latencia de recuperación ahorrada por acierto especulativo"
+)
+CACHE_HITS = Counter("gemis_cache_hits_total", "Aciertos de caché", ["cache"])
+CACHE_MISSES = Counter("gemis_cache_misses_total", "Fallos de caché", ["cache"])
+DB_SECONDS = Histogram(
+    "gemis_db_query_seconds",
+    "Duración de consultas a app.db",
+    ["query"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+AUTH_SECONDS = Histogram("gemis_auth_verify_seconds", "Duración de verify()", ["result"])
+AUTH_THROTTLED = Counter("gemis_auth_throttled_total", "Logins rechazados por exceso de fallos", ["scope"])
+AUTH_REHASHES = Counter("gemis_auth_rehashes_total", "Contraseñas rehasheadas con el costo actual")
+SESSIONS_REJECTED = Counter("gemis_sessions_rejected_total", "Tokens de sesión rechazados", ["reason"])
+TITLE_SECONDS = Histogram("gemis_title_seconds", "Duración de la generación de títulos")
+REQUEST_SECONDS = Histogram("gemis_request_seconds", "Duración de bot() por tipo de turno", ["kind"])
+SCHED_WAIT_SECONDS = Histogram(
+    "gemis_scheduler_wait_seconds", "Espera por un lugar en el carril del planificador", ["lane"]
+)
+SCHED_WAITING = Gauge("gemis_scheduler_waiting", "Trabajos esperando lugar por carril", ["lane"])
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "gemis_rate_limit_wait_seconds", "Espera por presupuesto de requests/tokens del modelo", ["model"]
+)
+RATE_LIMITED = Counter("gemis_rate_limited_total", "Respuestas 429 del proveedor", ["model"])
+HEDGES = Counter("gemis_hedged_requests_total", "Llamadas duplicadas por hedging", ["role", "outcome"])
+MODEL_TIMEOUTS = Counter("gemis_model_timeouts_total", "Llamadas a modelos que vencieron", ["role"])
+HTTP_REQUESTS = Counter("gemis_http_requests_total", "Requests de los clientes HTTP de modelos", ["client"])
+HTTP_CONNECTIONS = Counter(
+    "gemis_http_connections_total", "Conexiones nuevas de los clientes HTTP de modelos", ["client"]
+)
+HTTP_TLS_HANDSHAKES = Counter("gemis_http_tls_handshakes_total", "Handshakes TLS", ["client"])
+HTTP_CONNECT_SECONDS = Histogram(
+    "gemis_http_connect_seconds", "Duración de conexión TCP y handshake TLS", ["client"]
+)
+UPLOADS = Counter("gemis_uploads_total", "Archivos subidos por resultado del almacén de blobs", ["result"])
+INFLIGHT = Gauge("gemis_inflight_requests", "Turnos de bot() en curso")
+QUEUE_DEPTH = Gauge("gemis_queue_depth", "Eventos en la cola de Gradio que todavía no empezaron")
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Alimenta las métricas de nodos, LLMs y tools desde los callbacks de LangChain."""
+
+    def __init__(self) -> None:
+        self._runs: Dict[UUID, Tuple[str, str, float]] = {}
+
+    def _start(self, run_id: UUID, kind: str, name: str) -> None:
+        self._runs[run_id] = (kind, name, time.perf_counter())
+
+    def _end(self, run_id: UUID, error: bool = False) -> Optional[Tuple[str, str]]:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        kind, name, t0 = run
+        elapsed = time.perf_counter() - t0
+        if kind == "node":
+            NODE_SECONDS.observe(elapsed, node=name)
+            if error:
+                NODE_ERRORS.inc(node=name)
+        elif kind == "llm":
+            LLM_SECONDS.observe(elapsed, model=name)
+        elif kind == "tool":
+            TOOL_SECONDS.observe(elapsed, tool=name)
+        return kind, name
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        if name and name == (metadata or {}).get("langgraph_node"):
+            self._start(run_id, "node", name)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = (
+            (metadata or {}).get("ls_model_name")
+            or params.get("model")
+            or params.get("model_name")
+            or "desconocido"
+        )
+        LLM_CALLS.inc(model=model)
+        self._start(run_id, "llm", model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        ended = self._end(run_id)
+        if ended is None:
+            return
+        model = ended[1]
+        tokens_in = tokens_out = 0
+        for gens in response.generations:
+            for gen in gens:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                if usage:
+                    tokens_in += usage.get("input_tokens", 0)
+                    tokens_out += usage.get("output_tokens", 0)
+        if tokens_in or tokens_out:
+            LLM_TOKENS.inc(tokens_in, model=model, direction="input")
+            LLM_TOKENS.inc(tokens_out, model=model, direction="output")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "tool", kwargs.get("name") or (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+
+# El handler se aplica a toda ejecución de LangChain del proceso (el default de
+# la ContextVar es visible desde cualquier hilo).
+_handler_var: ContextVar[Optional[MetricsCallbackHandler]] = ContextVar(
+    "gemis_metrics_handler",
+    default=MetricsCallbackHandler() if METRICS_ENABLED else None,
+)
+register_configure_hook(_handler_var, inheritable=True)
+
+
+def metrics_route():
+    """Ruta de Starlette GET /metrics para montar en la app de Gradio."""
+    from starlette.responses import Response
+    from starlette.routing import Route
+
+    async def endpoint(request):
+        return Response(render(), media_type=CONTENT_TYPE)
+
+    return Route("/metrics", endpoint, methods=["GET"])
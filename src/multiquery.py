@@ -0,0 +1,112 @@
+# Recuperación multi-consulta (opcional: MULTI_QUERY_RETRIEVAL=1).
+# En lugar del ciclo secuencial grade → rewrite → enrutamiento → búsqueda,
+# retriever_tool pide en una sola llamada al modelo del rol 'rewrite'
+# MULTI_QUERY_N reformulaciones, busca la consulta original y las
+# reformulaciones en paralelo (todas con el filtro del hilo) y fusiona los
+# resultados con Reciprocal Rank Fusion. El grafo pasa directo a generate_answer.
+# Los resultados son registros de graph.search_parents (se fusionan por id del
+# padre) o Documents (por contenido).
+
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from langchain_core.documents import Document
+from pydantic import BaseModel, Field
+
+from resilient import invoke_model
+from routing import chat_model
+
+logger = logging.getLogger(__name__)
+
+MULTI_QUERY_RETRIEVAL = os.getenv("MULTI_QUERY_RETRIEVAL", "0") == "1"
+MULTI_QUERY_N = int(os.getenv("MULTI_QUERY_N", "3"))
+# Constante de RRF: score = Σ 1 / (RRF_K + rank)
+RRF_K = int(os.getenv("MULTI_QUERY_RRF_K", "60"))
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="multi-query")
+
+MULTI_QUERY_PROMPT = (
+    "You are helping search a user's documents. Write {n} different search queries "
+    "that could retrieve passages answering the question below. Vary wording, use "
+    "synonyms and make implicit terms explicit. Keep the language of the question.\n"
+    "Question: {question}"
+)
+
+
+class Reformulations(BaseModel):
+    """Search queries equivalent to the user question."""
+
+    queries: List[str] = Field(description="Alternative search queries")
+
+
+def generate_queries(question: str, n: int = MULTI_QUERY_N) -> List[str]:
+    """Reformulaciones de la pregunta (una sola llamada al modelo); [] si falla."""
+    prompt = MULTI_QUERY_PROMPT.format(n=n, question=question)
+    try:
+        resp = invoke_model(
+            "rewrite",
+            chat_model("rewrite").with_structured_output(Reformulations),
+            [{"role": "user", "content": prompt}],
+        )
+    except Exception as e:
+        logger.warning(f"No se pudieron generar reformulaciones: {e}")
+        return []
+    seen = {question.strip().lower()}
+    queries = []
+    for q in resp.queries:
+        q = q.strip()
+        if q and q.lower() not in seen:
+            seen.add(q.lower())
+            queries.append(q)
+    return queries[:n]
+
+
+Hit = Union[Document, Dict[str, Any]]
+
+
+def _doc_key(doc: Hit) -> str:
+    if isinstance(doc, dict):
+        return str(doc["id"])
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(rankings: List[List[Hit]], k: int = RRF_K) -> List[Hit]:
+    """Fusiona listas ordenadas de documentos (sin duplicados) por RRF."""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Hit] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = _doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+def multi_query_search(
+    question: str,
+    search: Callable[[str], List[Hit]],
+    top_k: int,
+    first: Optional[List[Hit]] = None,
+) -> List[Hit]:
+    """
+    Busca la pregunta y sus reformulaciones en paralelo y devuelve los `top_k`
+    documentos fusionados. `first` es el resultado ya calculado para la pregunta
+    original (p. ej. el de la recuperación especulativa).
+    """
+    original = None
+    if first is None:
+        original = _executor.submit(copy_context().run, search, question)
+    queries = generate_queries(question)
+    futures = [_executor.submit(copy_context().run, search, q) for q in queries]
+
+    rankings = [first if first is not None else original.result()]
+    for q, f in zip(queries, futures):
+        try:
+            rankings.append(f.result())
+        except Exception as e:
+            logger.warning(f"Falló la búsqueda de la reformulación {q!r}: {e}")
+    return reciprocal_rank_fusion(rankings)[:top_k]
@@ -0,0 +1,192 @@
+# Particionado de la colección de vectores hijos por usuario o por hilo.
+# - "none":   colección única `child_store` filtrada por {user_id, thread_id} (por defecto).
+# - "user":   una colección por usuario, filtrada solo por thread_id.
+# - "thread": una colección por (usuario, hilo), sin filtro de metadatos.
+# Las colecciones se abren de forma diferida y se mantiene un LRU de handles.
+# Migración: python src/partitions.py migrate --mode thread
+
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+
+from metrics import CACHE_HITS, CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+VECTOR_PARTITIONING = os.getenv("VECTOR_PARTITIONING", "none")
+VECTOR_PARTITIONS_OPEN = int(os.getenv("VECTOR_PARTITIONS_OPEN", "64"))
+PARTITION_PREFIX = "child_u"
+_MODES = ("none", "user", "thread")
+
+
+class VectorPartitions:
+    """Enruta cada (user_id, thread_id) a su colección de Chroma."""
+
+    def __init__(
+        self,
+        base: Chroma,
+        embedding: Embeddings,
+        mode: str = VECTOR_PARTITIONING,
+        max_open: int = VECTOR_PARTITIONS_OPEN,
+    ):
+        if mode not in _MODES:
+            raise ValueError(f"VECTOR_PARTITIONING desconocido: {mode}")
+        self.base = base
+        self.client = base._client
+        self.embedding = embedding
+        self.mode = mode
+        self.max_open = max_open
+        self._open: "OrderedDict[str, Chroma]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def collection_name(self, user_id: int, thread_id: str) -> Optional[str]:
+        """Nombre de la colección de la partición (None en modo 'none')."""
+        if self.mode == "user":
+            return f"{PARTITION_PREFIX}{int(user_id)}"
+        if self.mode == "thread":
+            return f"{PARTITION_PREFIX}{int(user_id)}_t{str(thread_id).replace('-', '')}"
+        return None
+
+    def _open_collection(self, name: str) -> Chroma:
+        with self._lock:
+            vs = self._open.get(name)
+            if vs is not None:
+                self._open.move_to_end(name)
+                CACHE_HITS.inc(cache="vector_partitions")
+                return vs
+        CACHE_MISSES.inc(cache="vector_partitions")
+        vs = Chroma(
+            client=self.client,
+            collection_name=name,
+            embedding_function=self.embedding,
+        )
+        with self._lock:
+            self._open[name] = vs
+            self._open.move_to_end(name)
+            while len(self._open) > self.max_open:
+                evicted, _ = self._open.popitem(last=False)
+                logger.debug(f"Partición cerrada (LRU): {evicted}")
+        return vs
+
+    def get(self, user_id: int, thread_id: str) -> Chroma:
+        """Vector store de la partición; la abre si no está en el LRU."""
+        name = self.collection_name(user_id, thread_id)
+        return self.base if name is None else self._open_collection(name)
+
+    def peek(self, user_id: int, thread_id: str) -> Optional[Chroma]:
+        """Como get(), pero devuelve None si la partición no existe (no la crea)."""
+        name = self.collection_name(user_id, thread_id)
+        if name is None:
+            return self.base
+        if name not in self._open:
+            try:
+                self.client.get_collection(name)
+            except Exception:
+                return None
+        return self._open_collection(name)
+
+    def search_filter(self, user_id: int, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Filtro de metadatos necesario dentro de la partición."""
+        thread_filter = {"thread_id": {"$eq": str(thread_id)}}
+        if self.mode == "thread":
+            return None
+        if self.mode == "user":
+            return thread_filter
+        return {"$and": [{"user_id": {"$eq": int(user_id)}}, thread_filter]}
+
+    def drop(self, user_id: int, thread_id: str) -> None:
+        """Elimina la colección del hilo (solo en modo 'thread')."""
+        name = self.collection_name(user_id, thread_id)
+        if self.mode != "thread" or name is None:
+            return
+        with self._lock:
+            self._open.pop(name, None)
+        try:
+            self.client.delete_collection(name)
+        except Exception:
+            pass  # la colección no existía
+
+    def all_stores(self) -> Iterator[Chroma]:
+        """Todas las colecciones de hijos: la global y las particiones existentes."""
+        yield self.base
+        for col in self.client.list_collections():
+            name = col if isinstance(col, str) else col.name
+            if name.startswith(PARTITION_PREFIX):
+                yield self._open_collection(name)
+
+    def open_count(self) -> int:
+        return len(self._open)
+
+
+def migrate(
+    partitions: VectorPartitions, batch_size: int = 2000, delete_source: bool = False
+) -> Dict[str, int]:
+    """
+    Copia los vectores de la colección global a sus particiones reutilizando los
+    embeddings existentes (no se vuelve a llamar al proveedor).
+    """
+    if partitions.mode == "none":
+        raise ValueError("Elegir modo 'user' o 'thread' para migrar")
+    src = partitions.base._collection
+    copied, offset, moved_ids = 0, 0, []
+    per_partition: Dict[str, int] = {}
+    while True:
+        got = src.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=batch_size,
+            offset=offset,
+        )
+        if not got["ids"]:
+            break
+        groups: Dict[Tuple[int, str], Dict[str, list]] = {}
+        for i, vid in enumerate(got["ids"]):
+            meta = got["metadatas"][i] or {}
+            key = (int(meta["user_id"]), str(meta["thread_id"]))
+            g = groups.setdefault(key, {"ids": [], "embeddings": [], "documents": [], "metadatas": []})
+            g["ids"].append(vid)
+            g["embeddings"].append(got["embeddings"][i])
+            g["documents"].append(got["documents"][i])
+            g["metadatas"].append(meta)
+        for (user_id, thread_id), g in groups.items():
+            dst = partitions.get(user_id, thread_id)
+            dst._collection.upsert(**g)
+            name = partitions.collection_name(user_id, thread_id)
+            per_partition[name] = per_partition.get(name, 0) + len(g["ids"])
+            moved_ids.extend(g["ids"])
+        copied += len(got["ids"])
+        offset += len(got["ids"])
+    if delete_source:
+        for i in range(0, len(moved_ids), batch_size):
+            src.delete(ids=moved_ids[i : i + batch_size])
+    return {"vectors": copied, "partitions": len(per_partition)}
+
+
+# CLI
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Particionado de la colección de hijos")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_migrate = sub.add_parser("migrate", help="Copia child_store a colecciones particionadas")
+    p_migrate.add_argument("--mode", choices=["user", "thread"], required=True)
+    p_migrate.add_argument("--delete-source", action="store_true")
+    sub.add_parser("list", help="Colecciones y cantidad de vectores")
+    args = parser.parse_args()
+
+    from graph import vs, _embeddings
+
+    if args.cmd == "migrate":
+        t0 = time.perf_counter()
+        parts = VectorPartitions(vs, _embeddings, mode=args.mode, max_open=1024)
+        stats = migrate(parts, delete_source=args.delete_source)
+        print(f"{stats} en {time.perf_counter() - t0:.1f}s")
+        print(f"Activar con VECTOR_PARTITIONING={args.mode}")
+    elif args.cmd == "list":
+        for col in vs._client.list_collections():
+            name = col if isinstance(col, str) else col.name
+            print(f"{name:<60} {vs._client.get_collection(name).count():>10}")
@@ -0,0 +1,301 @@
+# Perfilado de requests lentos (opcional: PROFILE_SLOW_REQUESTS=1).
+# Mientras dura un turno, un hilo muestreador toma el stack del hilo del request
+# cada PROFILE_INTERVAL_MS y un callback de LangChain registra la línea de tiempo
+# de nodos del grafo. Si el turno supera PROFILE_THRESHOLD_S se guarda en
+# profiles/ un JSON con metadatos, línea de tiempo y stacks agregados, más un
+# .folded compatible con flamegraph.pl / speedscope. Se conservan las últimas
+# PROFILE_MAX_FILES capturas.
+# Solo se muestrea el hilo del request: las llamadas a modelos corren en el pool
+# de resilient.py, así que en los stacks su tiempo aparece como la espera de
+# future.result(); cuánto tardó cada llamada está en la línea de tiempo.
+#
+#   uv run python src/profiler.py list --top 10
+#   uv run python src/profiler.py show profiles/<captura>.json
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SLOW_REQUESTS = os.getenv("PROFILE_SLOW_REQUESTS", "0") == "1"
+PROFILE_THRESHOLD_S = float(os.getenv("PROFILE_THRESHOLD_S", "10"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+_MAX_DEPTH = 128
+
+
+class _Capture:
+    """Estado de un request perfilado."""
+
+    def __init__(self, thread_id: int, meta: Dict[str, Any]):
+        self.thread_id = thread_id
+        self.meta = meta
+        self.t0 = time.perf_counter()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.timeline: List[Dict[str, Any]] = []
+        self._open: Dict[Any, Any] = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key: Any, name: str, kind: str) -> None:
+        self._open[key] = (name, kind, time.perf_counter())
+
+    def end(self, key: Any, error: bool = False) -> None:
+        started = self._open.pop(key, None)
+        if started is None:
+            return
+        name, kind, t = started
+        with self._lock:
+            self.timeline.append(
+                {
+                    "name": name,
+                    "kind": kind,
+                    "start_ms": (t - self.t0) * 1000,
+                    "duration_ms": (time.perf_counter() - t) * 1000,
+                    "error": error,
+                }
+            )
+
+
+_current: ContextVar[Optional[_Capture]] = ContextVar("gemis_profile_capture", default=None)
+
+
+class _TimelineHandler(BaseCallbackHandler):
+    """Registra inicio/fin de nodos del grafo, llamadas a LLM y tools del request."""
+
+    def __init__(self, capture: _Capture):
+        self.capture = capture
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        if name and name == (metadata or {}).get("langgraph_node"):
+            self.capture.begin(run_id, name, "node")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self.capture.end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.capture.end(run_id, error=True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self.capture.begin(run_id, (metadata or {}).get("ls_model_name", "llm"), "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.capture.end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.capture.end(run_id, error=True)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self.capture.begin(run_id, kwargs.get("name") or "tool", "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self.capture.end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.capture.end(run_id, error=True)
+
+
+_handler_var: ContextVar[Optional[_TimelineHandler]] = ContextVar(
+    "gemis_profile_handler", default=None
+)
+register_configure_hook(_handler_var, inheritable=True)
+
+
+def _fold(frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < _MAX_DEPTH:
+        code = frame.f_code
+        parts.append(f"{Path(code.co_filename).name}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class SlowRequestProfiler:
+    """Muestreador compartido por todos los requests perfilados en curso."""
+
+    def __init__(
+        self,
+        threshold_s: float = PROFILE_THRESHOLD_S,
+        interval_ms: float = PROFILE_INTERVAL_MS,
+        out_dir: Path = PROFILE_DIR,
+        max_files: int = PROFILE_MAX_FILES,
+    ):
+        self.threshold_s = threshold_s
+        self.interval = interval_ms / 1000
+        self.out_dir = out_dir
+        self.max_files = max_files
+        self._active: Dict[int, _Capture] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self._lock:
+                active = list(self._active.values())
+                if not active:
+                    self._sampler = None
+                    return
+            frames = sys._current_frames()
+            for cap in active:
+                frame = frames.get(cap.thread_id)
+                if frame is not None:
+                    cap.stacks[_fold(frame)] += 1
+                    cap.samples += 1
+            del frames
+            time.sleep(self.interval)
+
+    @contextmanager
+    def profile(self, **meta: Any) -> Iterator[_Capture]:
+        """Perfila el bloque; guarda la captura si supera el umbral."""
+        cap = _Capture(threading.get_ident(), meta)
+        cap_token = _current.set(cap)
+        handler_token = _handler_var.set(_TimelineHandler(cap))
+        with self._lock:
+            self._active[cap.thread_id] = cap
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample_loop, name="slow-request-profiler", daemon=True
+                )
+                self._sampler.start()
+        try:
+            yield cap
+        finally:
+            with self._lock:
+                self._active.pop(cap.thread_id, None)
+            _handler_var.reset(handler_token)
+            _current.reset(cap_token)
+            elapsed = time.perf_counter() - cap.t0
+            if elapsed >= self.threshold_s:
+                try:
+                    self._dump(cap, elapsed)
+                except Exception as e:
+                    logger.error(f"No se pudo guardar el perfil: {e}")
+
+    def _dump(self, cap: _Capture, elapsed: float) -> Path:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        base = self.out_dir / f"{stamp}_{int(elapsed * 1000)}ms"
+        folded = "\n".join(f"{stack} {n}" for stack, n in cap.stacks.most_common())
+        base.with_suffix(".folded").write_text(folded + "\n")
+        data = {
+            "captured_at": datetime.now().isoformat(),
+            "duration_ms": elapsed * 1000,
+            "threshold_ms": self.threshold_s * 1000,
+            "interval_ms": self.interval * 1000,
+            "samples": cap.samples,
+            "meta": cap.meta,
+            "timeline": sorted(cap.timeline, key=lambda e: e["start_ms"]),
+            "stacks": dict(cap.stacks.most_common()),
+        }
+        path = base.with_suffix(".json")
+        path.write_text(json.dumps(data, indent=2, ensure_ascii=False))
+        logger.info(f"Request lento ({elapsed:.1f}s) perfilado en {path}")
+        self._rotate()
+        return path
+
+    def _rotate(self) -> None:
+        captures = sorted(self.out_dir.glob("*.json"))
+        for old in captures[: max(0, len(captures) - self.max_files)]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".folded").unlink(missing_ok=True)
+
+
+_profiler = SlowRequestProfiler() if PROFILE_SLOW_REQUESTS else None
+
+
+def profile_request(**meta: Any):
+    """Context manager para perfilar un request; no hace nada si está desactivado."""
+    return _profiler.profile(**meta) if _profiler else nullcontext()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Marca un tramo (p. ej. graph.invoke) en la línea de tiempo del request actual."""
+    cap = _current.get()
+    if cap is None:
+        yield
+        return
+    key = object()
+    cap.begin(key, name, "span")
+    try:
+        yield
+    except BaseException:
+        cap.end(key, error=True)
+        raise
+    cap.end(key)
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+
+def _load(path: Path) -> Dict[str, Any]:
+    return json.loads(path.read_text())
+
+
+def _top_functions(stacks: Dict[str, int], n: int) -> List[tuple]:
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        self_counts[frames[-1]] += count
+        for f in set(frames):
+            total_counts[f] += count
+    return [(f, self_counts[f], total_counts[f]) for f, _ in self_counts.most_common(n)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capturas de requests lentos")
+    parser.add_argument("--dir", type=Path, default=PROFILE_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_list = sub.add_parser("list", help="Capturas ordenadas por duración")
+    p_list.add_argument("--top", type=int, default=10)
+    p_show = sub.add_parser("show", help="Resumen de una captura")
+    p_show.add_argument("path", type=Path)
+    p_show.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    if args.cmd == "list":
+        captures = [(p, _load(p)) for p in args.dir.glob("*.json")]
+        captures.sort(key=lambda c: c[1]["duration_ms"], reverse=True)
+        print(f"{'duración':>10}  {'fecha':<26} {'usuario':>7}  {'nodo más lento':<28} archivo")
+        for path, d in captures[: args.top]:
+            nodes = [e for e in d["timeline"] if e["kind"] == "node"]
+            slowest = max(nodes, key=lambda e: e["duration_ms"], default=None)
+            slow_txt = f"{slowest['name']} ({slowest['duration_ms'] / 1000:.1f}s)" if slowest else "-"
+            print(
+                f"{d['duration_ms'] / 1000:>9.1f}s  {d['captured_at']:<26} "
+                f"{str(d['meta'].get('user_id', '-')):>7}  {slow_txt:<28} {path.name}"
+            )
+    elif args.cmd == "show":
+        d = _load(args.path)
+        print(f"Duración: {d['duration_ms'] / 1000:.2f}s  Muestras: {d['samples']}")
+        print(f"Metadatos: {json.dumps(d['meta'], ensure_ascii=False)}")
+        print("\nLínea de tiempo:")
+        for e in d["timeline"]:
+            flag = " (error)" if e["error"] else ""
+            print(
+                f"  {e['start_ms']:>9.0f}ms +{e['duration_ms']:>8.0f}ms  {e['kind']:<5} {e['name']}{flag}"
+            )
+        print("\nFunciones con más muestras (propias / inclusivas):")
+        total = max(1, d["samples"])
+        for f, own, incl in _top_functions(d["stacks"], args.top):
+            print(f"  {own / total:>6.1%} {incl / total:>6.1%}  {f}")
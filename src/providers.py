@@ -0,0 +1,102 @@
+# Inyección de proveedores de modelos.
+# Todos los chat models y embeddings se construyen a través de este módulo, de
+# modo que se puede reemplazar OpenAI por modelos falsos (LLM_PROVIDER=fake) o
+# por un proveedor propio registrado con register_provider(), sin tocar graph.py
+# ni title_setter.py. La elección debe hacerse antes de construir los modelos
+# (primer uso o warm-up, ver startup.py).
+
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+
+ChatFactory = Callable[..., BaseChatModel]
+EmbeddingsFactory = Callable[[Optional[str]], Embeddings]
+
+
+def _openai_chat(model: str, **kwargs: Any) -> BaseChatModel:
+    from langchain.chat_models import init_chat_model
+
+    from http_clients import async_client, sync_client
+    from scheduler import SCHEDULER_ENABLED
+
+    if model.startswith("openai:"):
+        # Todos los roles comparten el pool de conexiones (ver http_clients.py)
+        kwargs.setdefault("http_client", sync_client())
+        kwargs.setdefault("http_async_client", async_client())
+        if SCHEDULER_ENABLED:
+            # Los 429 los reintenta scheduler.py; si el cliente también, se multiplican
+            kwargs.setdefault("max_retries", 0)
+    return init_chat_model(model, **kwargs)
+
+
+def _openai_embeddings(model: Optional[str] = None) -> Embeddings:
+    from langchain_openai import OpenAIEmbeddings
+
+    from http_clients import async_client, sync_client
+    from scheduler import SCHEDULER_ENABLED
+
+    clients: Dict[str, Any] = {"http_client": sync_client(), "http_async_client": async_client()}
+    if SCHEDULER_ENABLED:
+        # Pasan por TrackedEmbeddings (usage.py), que reintenta los 429
+        clients["max_retries"] = 0
+    if model is None:
+        return OpenAIEmbeddings(**clients)
+    return OpenAIEmbeddings(model=model.removeprefix("openai:"), **clients)
+
+
+def _fake_chat(model: str, **kwargs: Any) -> BaseChatModel:
+    from fakes import FakeChatModel
+
+    return FakeChatModel.from_env(model_name=model)
+
+
+def _fake_embeddings(model: Optional[str] = None) -> Embeddings:
+    from fakes import FakeEmbeddings
+
+    return FakeEmbeddings.from_env()
+
+
+_PROVIDERS: Dict[str, Tuple[ChatFactory, EmbeddingsFactory]] = {
+    "openai": (_openai_chat, _openai_embeddings),
+    "fake": (_fake_chat, _fake_embeddings),
+}
+# None: se usa LLM_PROVIDER (leído al construir, después de load_dotenv)
+_active: Optional[str] = None
+
+
+def register_provider(
+    name: str, chat_factory: ChatFactory, embeddings_factory: EmbeddingsFactory
+) -> None:
+    """Registra un proveedor (p. ej. un servidor local compatible)."""
+    _PROVIDERS[name] = (chat_factory, embeddings_factory)
+
+
+def use_provider(name: str) -> None:
+    """Selecciona el proveedor activo para los modelos que se construyan después."""
+    global _active
+    if name not in _PROVIDERS:
+        raise ValueError(f"Proveedor desconocido: {name}")
+    _active = name
+
+
+def active_provider() -> str:
+    return _active or os.getenv("LLM_PROVIDER", "openai")
+
+
+def _factories() -> Tuple[ChatFactory, EmbeddingsFactory]:
+    name = active_provider()
+    if name not in _PROVIDERS:
+        raise ValueError(f"Proveedor desconocido: {name}")
+    return _PROVIDERS[name]
+
+
+def make_chat_model(model: str, **kwargs: Any) -> BaseChatModel:
+    """Construye un chat model con el proveedor activo."""
+    return _factories()[0](model, **kwargs)
+
+
+def make_embeddings(model: Optional[str] = None) -> Embeddings:
+    """Construye el modelo de embeddings con el proveedor activo."""
+    return _factories()[1](model)
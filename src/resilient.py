@@ -0,0 +1,175 @@
+# Llamadas a modelos con timeout por rol y hedging.
+# invoke_model(role, runnable, input) corre la llamada en un hilo y espera a lo
+# sumo el `timeout` del rol en config.yaml (todo incluido: reintentos del
+# cliente y cola); si vence, ModelTimeoutError. En los roles con `hedge: true`
+# (solo llamadas cortas e idempotentes: grader, memory, rewrite, title), si la
+# respuesta tarda más que el p95 reciente del rol se lanza una segunda llamada
+# idéntica y se usa la primera que termine. HEDGE_BUDGET acota las llamadas
+# extra a una fracción de las normales.
+# Cada llamada recibe como `timeout` del cliente lo que queda del plazo, así que
+# la que se abandona (por timeout o porque ganó la otra) se corta en el cliente
+# en vez de seguir corriendo. A lo sumo MODEL_CALL_WORKERS llamadas en curso: la
+# principal espera un lugar dentro de su plazo y el hedge, si no hay, no sale.
+#
+#   uv run python src/bench_hedging.py --calls 300
+
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Any, Deque, Dict, List, Optional
+
+from langchain_core.runnables import Runnable
+
+from metrics import HEDGES, MODEL_TIMEOUTS
+from routing import router
+
+logger = logging.getLogger(__name__)
+
+HEDGEABLE_ROLES = ("grader", "memory", "rewrite", "title")
+# Llamadas extra permitidas por llamada normal, y acumulado máximo (ráfaga)
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+HEDGE_BURST = float(os.getenv("HEDGE_BURST", "10"))
+# Muestras necesarias antes de estimar el p95, y espera mínima antes del hedge
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY_MS", "50")) / 1000
+LATENCY_WINDOW = 200
+
+MODEL_CALL_WORKERS = int(os.getenv("MODEL_CALL_WORKERS", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=MODEL_CALL_WORKERS, thread_name_prefix="model-call")
+# Lugares del executor: sin esto la cola interna crece sin límite con llamadas abandonadas
+_slots = threading.BoundedSemaphore(MODEL_CALL_WORKERS)
+
+
+class ModelTimeoutError(TimeoutError):
+    """La llamada al modelo superó el timeout de su rol."""
+
+
+class LatencyTracker:
+    """Latencias recientes de llamadas exitosas por rol."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def add(self, role: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[role].append(seconds)
+
+    def p95(self, role: str) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples[role])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+class HedgeBudget:
+    """Cada llamada suma `ratio` créditos (hasta `burst`); cada hedge gasta uno."""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET, burst: float = HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.credits = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self) -> None:
+        with self._lock:
+            self.credits = min(self.burst, self.credits + self.ratio)
+
+    def spend(self) -> bool:
+        with self._lock:
+            if self.credits < 1:
+                return False
+            self.credits -= 1
+            return True
+
+    def reset(self) -> None:
+        with self._lock:
+            self.credits = 0.0
+
+
+latencies = LatencyTracker()
+budget = HedgeBudget()
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(0.0, deadline - time.perf_counter())
+
+
+def _submit(runnable: Runnable, input: Any, config: Optional[dict], deadline: Optional[float]) -> Future:
+    if deadline is not None:
+        runnable = runnable.bind(timeout=_remaining(deadline))
+    # El contexto lleva la config del nodo de LangGraph (callbacks, metadata)
+    future = _executor.submit(copy_context().run, runnable.invoke, input, config)
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def _first_result(role: str, futures: List[Future], deadline: Optional[float]) -> Any:
+    """Resultado de la primera llamada exitosa; si fallan todas, el error de la primera."""
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=_remaining(deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for f in done:
+            if f.exception() is None:
+                if f is not futures[0]:
+                    HEDGES.inc(role=role, outcome="won")
+                return f.result()
+        if not pending:
+            raise futures[0].exception()
+    MODEL_TIMEOUTS.inc(role=role)
+    logger.warning(f"Timeout del rol '{role}' ({len(futures)} llamadas en curso)")
+    raise ModelTimeoutError(f"El modelo del rol '{role}' no respondió a tiempo")
+
+
+def invoke_model(role: str, runnable: Runnable, input: Any, config: Optional[dict] = None) -> Any:
+    """`runnable.invoke(input)` con el timeout del rol y, si corresponde, hedging."""
+    spec = router.spec(role)
+    timeout = spec.get("timeout")
+    t0 = time.perf_counter()
+    deadline = t0 + timeout if timeout else None
+
+    if not _slots.acquire(timeout=_remaining(deadline)):
+        MODEL_TIMEOUTS.inc(role=role)
+        logger.warning(f"Timeout del rol '{role}' esperando lugar ({MODEL_CALL_WORKERS} llamadas en curso)")
+        raise ModelTimeoutError(f"El modelo del rol '{role}' no respondió a tiempo")
+    primary = _submit(runnable, input, config, deadline)
+
+    def _observe(f: Future) -> None:
+        # Latencia de la llamada original aunque la haya ganado el hedge
+        if not f.cancelled() and f.exception() is None:
+            latencies.add(role, time.perf_counter() - t0)
+
+    primary.add_done_callback(_observe)
+    futures = [primary]
+
+    if spec.get("hedge") and role in HEDGEABLE_ROLES:
+        budget.earn()
+        delay = latencies.p95(role)
+        if delay is not None:
+            delay = max(delay, HEDGE_MIN_DELAY)
+            remaining = _remaining(deadline)
+            done, _ = wait(futures, timeout=delay if remaining is None else min(delay, remaining))
+            if (
+                not done
+                and (remaining is None or remaining > delay)
+                and _slots.acquire(blocking=False)
+            ):
+                if budget.spend():
+                    HEDGES.inc(role=role, outcome="fired")
+                    futures.append(_submit(runnable, input, config, deadline))
+                else:
+                    _slots.release()
+
+    return _first_result(role, futures, deadline)
@@ -0,0 +1,171 @@
+# Modelo por rol, configurado en config.yaml (sección MODELS).
+# Roles: answer (generate_answer), tool_routing (generate_query_or_respond, que
+# también responde cuando no hace falta buscar), grader, memory (extracción de
+# memorias y resumen del historial), rewrite, title y embeddings. Cada rol
+# acepta un string ("openai:gpt-4o-mini") o un mapa con model, temperature,
+# timeout (segundos), max_retries y hedge (solo grader, memory, rewrite y
+# title; ver resilient.py); lo que falte se toma de CHAT_MODEL / TEMPERATURE /
+# EMBED_MODEL y de DEFAULT_ROLES.
+#
+# El archivo se relee si cambió (a lo sumo cada MODEL_CONFIG_RELOAD_INTERVAL
+# segundos) y los roles modificados usan un modelo nuevo en la siguiente
+# llamada. Los embeddings no se recargan: cambiarlos exige reindexar.
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import yaml
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from providers import make_chat_model, make_embeddings
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = Path(
+    os.getenv("MODEL_CONFIG_PATH", Path(__file__).resolve().parents[1] / "config.yaml")
+)
+MODEL_CONFIG_RELOAD_INTERVAL = float(os.getenv("MODEL_CONFIG_RELOAD_INTERVAL", "5"))
+
+CHAT_ROLES = ("answer", "tool_routing", "grader", "memory", "rewrite", "title")
+# Opciones de la llamada (resilient.py), no del constructor del modelo
+CALL_OPTIONS = ("hedge",)
+
+# Valores previos a la configuración por rol; aplican si config.yaml no dice otra cosa
+DEFAULT_ROLES: Dict[str, Dict[str, Any]] = {
+    "answer": {"model": "openai:gpt-4o", "temperature": 0, "timeout": 60},
+    "tool_routing": {"model": "openai:gpt-4o", "temperature": 0, "timeout": 60},
+    "grader": {"model": "openai:gpt-4o", "temperature": 0, "timeout": 30},
+    "memory": {"model": "openai:gpt-4o", "temperature": 0, "timeout": 30},
+    "rewrite": {"model": "openai:gpt-4o", "temperature": 0, "timeout": 30},
+    "title": {"model": "openai:gpt-4o-mini", "temperature": 0.2, "timeout": 15},
+}
+
+
+def _read(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def resolve_roles(raw: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Especificación efectiva de cada rol a partir del contenido de config.yaml."""
+    models = raw.get("MODELS") or {}
+    specs: Dict[str, Dict[str, Any]] = {}
+    for role in CHAT_ROLES:
+        entry = models.get(role) or {}
+        if isinstance(entry, str):
+            entry = {"model": entry}
+        spec = dict(DEFAULT_ROLES[role])
+        if "CHAT_MODEL" in raw:
+            spec["model"] = raw["CHAT_MODEL"]
+        if "TEMPERATURE" in raw:
+            spec["temperature"] = raw["TEMPERATURE"]
+        spec.update(entry)
+        specs[role] = spec
+    entry = models.get("embeddings") or {}
+    if isinstance(entry, str):
+        entry = {"model": entry}
+    specs["embeddings"] = {"model": raw.get("EMBED_MODEL"), **entry}
+    return specs
+
+
+def _spec_key(spec: Dict[str, Any]) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in spec.items()))
+
+
+class ModelRouter:
+    """Construye y cachea el chat model de cada rol según config.yaml."""
+
+    def __init__(self, path: Path = CONFIG_PATH, reload_interval: float = MODEL_CONFIG_RELOAD_INTERVAL):
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._models: Dict[Tuple, BaseChatModel] = {}
+        self._embeddings: Optional[Embeddings] = None
+        self._load()
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return self.path.stat().st_mtime
+        except OSError:
+            return None
+
+    def _load(self) -> None:
+        self._mtime_loaded = self._mtime()
+        self._checked_at = time.monotonic()
+        self.specs = resolve_roles(_read(self.path))
+
+    def use_file(self, path: Path) -> None:
+        """Cambia de archivo de configuración (p. ej. en bench_models.py)."""
+        with self._lock:
+            self.path = Path(path)
+            self._load()
+
+    def _maybe_reload(self) -> None:
+        if time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            self._checked_at = time.monotonic()
+            mtime = self._mtime()
+            if mtime == self._mtime_loaded:
+                return
+            old = self.specs
+            try:
+                self._load()
+            except Exception as e:
+                # Un YAML a medio escribir no debe tirar los requests en curso
+                logger.error(f"No se pudo recargar {self.path}: {e}")
+                self._mtime_loaded = mtime
+                return
+            changed = [r for r in CHAT_ROLES if old[r] != self.specs[r]]
+            if changed:
+                logger.info(f"{self.path.name} recargado; roles modificados: {', '.join(changed)}")
+            if old["embeddings"] != self.specs["embeddings"]:
+                logger.warning("El modelo de embeddings cambió en la configuración; se aplica al reiniciar")
+                self.specs["embeddings"] = old["embeddings"]
+
+    def spec(self, role: str) -> Dict[str, Any]:
+        self._maybe_reload()
+        return self.specs[role]
+
+    def chat_model(self, role: str) -> BaseChatModel:
+        """Chat model del rol; roles con la misma especificación comparten instancia."""
+        spec = self.spec(role)
+        key = _spec_key(spec)
+        model = self._models.get(key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    kwargs = {
+                        k: v
+                        for k, v in spec.items()
+                        if k != "model" and k not in CALL_OPTIONS and v is not None
+                    }
+                    model = self._models[key] = make_chat_model(spec["model"], **kwargs)
+        return model
+
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = make_embeddings(self.specs["embeddings"]["model"])
+        return self._embeddings
+
+    def warm(self) -> "ModelRouter":
+        for role in CHAT_ROLES:
+            self.chat_model(role)
+        return self
+
+
+router = ModelRouter()
+
+
+def chat_model(role: str) -> BaseChatModel:
+    return router.chat_model(role)
@@ -0,0 +1,397 @@
+# Planificación de trabajo y control de admisión frente al proveedor.
+# - Carriles (chat, ingest, aux) con concurrencia propia y cola justa por
+#   usuario: al liberarse un lugar pasa el siguiente usuario en round-robin, no
+#   el siguiente mensaje, así que quien sube diez PDFs o encadena preguntas no
+#   bloquea a los demás. Ingesta y títulos no ocupan lugares del chat; la
+#   extracción de memorias corre dentro del turno pero cuenta como auxiliar.
+# - Token buckets por modelo (requests y tokens por minuto): cada llamada a un
+#   chat model reserva su estimación antes de salir y al terminar se corrige
+#   con usage_metadata. Los carriles que no son chat dejan una reserva libre
+#   para el chat. Se aplica con un callback de LangChain instalado globalmente.
+# - Respuestas 429: el modelo se pausa lo que pida Retry-After y la llamada se
+#   reintenta con backoff exponencial con jitter (RetryPolicy en los nodos del
+#   grafo, `with_backoff` fuera de él).
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Hashable, Iterator, Optional, Tuple, TypeVar
+from uuid import UUID
+
+import yaml
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+from metrics import RATE_LIMIT_WAIT_SECONDS, RATE_LIMITED, SCHED_WAIT_SECONDS, SCHED_WAITING
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+# Turnos que Gradio deja pasar a bot(); la concurrencia real la ponen los carriles
+QUEUE_CONCURRENCY = int(os.getenv("QUEUE_CONCURRENCY", "32"))
+
+# Carril: (lugares en total, lugares por usuario). SCHED_LANES (JSON) los pisa.
+LANES: Dict[str, Tuple[int, int]] = {
+    "chat": (5, 2),
+    "ingest": (2, 1),
+    "aux": (4, 2),
+}
+LANES.update({k: tuple(v) for k, v in json.loads(os.getenv("SCHED_LANES", "{}")).items()})
+
+
+def _configured_limits() -> Dict[str, Tuple[int, int]]:
+    path = Path(os.getenv("MODEL_CONFIG_PATH", Path(__file__).resolve().parents[1] / "config.yaml"))
+    raw: Dict[str, Any] = {}
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            raw = (yaml.safe_load(f) or {}).get("RATE_LIMITS") or {}
+    raw.update(json.loads(os.getenv("RATE_LIMITS", "{}")))
+    return {k: tuple(v) for k, v in raw.items()}
+
+
+# Límites del proveedor por modelo: (requests, tokens) por minuto. Dependen del
+# tier de la cuenta, así que no hay valores por defecto: se toman de la sección
+# RATE_LIMITS de config.yaml y la variable RATE_LIMITS (JSON) los pisa o agrega.
+# Los modelos que no figuran no se limitan. Con varios workers (serve.py) cada
+# proceso usa su parte.
+RATE_LIMITS: Dict[str, Tuple[int, int]] = _configured_limits()
+WORKER_COUNT = max(1, int(os.getenv("WORKER_COUNT", "1")))
+# Fracción del presupuesto que ingest/aux no pueden usar (queda para el chat)
+LOW_PRIORITY_RESERVE = float(os.getenv("RATE_LIMIT_RESERVE", "0.2"))
+# Tokens de salida supuestos cuando la llamada no fija max_tokens
+OUTPUT_TOKENS_ESTIMATE = int(os.getenv("RATE_LIMIT_OUTPUT_ESTIMATE", "300"))
+
+# Reintentos ante 429
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "1.0"))
+BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "30"))
+
+_lane_var: ContextVar[str] = ContextVar("gemis_scheduler_lane", default="chat")
+
+
+# -----------------------------
+# Carriles con cola justa
+# -----------------------------
+
+
+class FairLane:
+    """Semáforo con cola FIFO por usuario y turnos round-robin entre usuarios."""
+
+    def __init__(self, name: str, limit: int, per_user: int):
+        self.name = name
+        self.limit = limit
+        self.per_user = per_user
+        self._cond = threading.Condition()
+        self._queues: Dict[Hashable, Deque[object]] = {}
+        self._order: Deque[Hashable] = deque()
+        self._granted: set = set()
+        self._running = 0
+        self._running_by_user: Dict[Hashable, int] = defaultdict(int)
+
+    def _dispatch(self) -> None:
+        # Un lugar por usuario y vuelta; quien ya tiene per_user corriendo espera
+        granted = False
+        skipped = 0
+        while self._running < self.limit and self._order and skipped < len(self._order):
+            user = self._order[0]
+            self._order.rotate(-1)
+            if self._running_by_user[user] >= self.per_user:
+                skipped += 1
+                continue
+            skipped = 0
+            queue = self._queues[user]
+            self._granted.add(queue.popleft())
+            if not queue:
+                del self._queues[user]
+                self._order.remove(user)
+            self._running += 1
+            self._running_by_user[user] += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def acquire(self, user: Hashable) -> None:
+        ticket = object()
+        with self._cond:
+            if user not in self._queues:
+                self._queues[user] = deque()
+                self._order.append(user)
+            self._queues[user].append(ticket)
+            self._dispatch()
+            while ticket not in self._granted:
+                self._cond.wait()
+            self._granted.discard(ticket)
+
+    def release(self, user: Hashable) -> None:
+        with self._cond:
+            self._running -= 1
+            self._running_by_user[user] -= 1
+            if not self._running_by_user[user]:
+                del self._running_by_user[user]
+            self._dispatch()
+
+
+_lanes = {name: FairLane(name, *limits) for name, limits in LANES.items()}
+
+
+@contextmanager
+def schedule(lane: str, user_id: Any) -> Iterator[None]:
+    """Ejecuta el bloque cuando el carril le da lugar al usuario."""
+    token = _lane_var.set(lane)
+    try:
+        if not SCHEDULER_ENABLED:
+            yield
+            return
+        fair = _lanes[lane]
+        SCHED_WAITING.inc(lane=lane)
+        t0 = time.perf_counter()
+        try:
+            fair.acquire(user_id)
+        finally:
+            SCHED_WAITING.dec(lane=lane)
+        SCHED_WAIT_SECONDS.observe(time.perf_counter() - t0, lane=lane)
+        try:
+            yield
+        finally:
+            fair.release(user_id)
+    finally:
+        _lane_var.reset(token)
+
+
+@contextmanager
+def in_lane(name: str) -> Iterator[None]:
+    """Atribuye las llamadas del bloque a un carril sin ocupar lugar en él."""
+    token = _lane_var.set(name)
+    try:
+        yield
+    finally:
+        _lane_var.reset(token)
+
+
+# -----------------------------
+# Límites por modelo
+# -----------------------------
+
+
+class TokenBucket:
+    """Bucket por minuto con reservas: descuenta al pedir y devuelve la espera necesaria."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self._t = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._t) * self.rate)
+        self._t = now
+
+    def reserve(self, amount: float, now: float, floor: float = 0.0) -> float:
+        self._refill(now)
+        # Una llamada más grande que el bucket entero esperaría para siempre
+        self.level -= min(amount, self.capacity)
+        return max(0.0, (floor - self.level) / self.rate)
+
+    def refund(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ModelLimiter:
+    """Presupuesto de requests y tokens por minuto de un modelo, más pausas por 429."""
+
+    def __init__(self, model: str, rpm: int, tpm: int):
+        self.model = model
+        self.requests = TokenBucket(rpm / WORKER_COUNT)
+        self.tokens = TokenBucket(tpm / WORKER_COUNT)
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int, priority: bool = True) -> float:
+        """Espera a tener presupuesto para una llamada de `tokens`; devuelve la espera."""
+        with self._lock:
+            now = time.monotonic()
+            reserve = 0.0 if priority else LOW_PRIORITY_RESERVE
+            wait = max(
+                self.requests.reserve(1, now, reserve * self.requests.capacity),
+                self.tokens.reserve(tokens, now, reserve * self.tokens.capacity),
+                self.paused_until - now,
+            )
+        if wait > 0:
+            time.sleep(wait)
+            RATE_LIMIT_WAIT_SECONDS.observe(wait, model=self.model)
+        return wait
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Corrige la reserva con el uso real (positivo devuelve, negativo descuenta)."""
+        with self._lock:
+            self.tokens.refund(estimated - actual, time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(model: str) -> Optional[ModelLimiter]:
+    limits = RATE_LIMITS.get(model)
+    if limits is None:
+        return None
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = ModelLimiter(model, *limits)
+        return _limiters[model]
+
+
+def log_rate_limits() -> None:
+    """Deja en el log qué límites por modelo quedaron activos."""
+    if not SCHEDULER_ENABLED or not RATE_LIMITS:
+        logger.info("Sin límites de tasa por modelo")
+        return
+    for model, (rpm, tpm) in sorted(RATE_LIMITS.items()):
+        logger.info(f"Límite de tasa {model}: {rpm} req/min, {tpm} tokens/min (÷{WORKER_COUNT} workers)")
+
+
+def admit(model: str, tokens: int) -> int:
+    """Reserva presupuesto para `tokens` del modelo (si tiene límites). Devuelve lo reservado."""
+    limiter = limiter_for(model) if SCHEDULER_ENABLED else None
+    if limiter is None:
+        return 0
+    limiter.acquire(tokens, priority=_lane_var.get() == "chat")
+    return tokens
+
+
+# -----------------------------
+# 429
+# -----------------------------
+
+
+def is_rate_limit(exc: BaseException) -> bool:
+    """429 reintentable (una cuota agotada también es 429, pero no se arregla esperando)."""
+    if getattr(exc, "status_code", None) != 429 and type(exc).__name__ != "RateLimitError":
+        return False
+    return getattr(exc, "code", None) != "insufficient_quota"
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial con jitter completo para el intento `attempt` (desde 1)."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def with_backoff(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Llama a `fn` reintentando ante 429 con backoff exponencial con jitter."""
+    attempt = 1
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if not is_rate_limit(e) or attempt >= RATE_LIMIT_RETRIES:
+                raise
+            delay = max(backoff_delay(attempt), retry_after(e) or 0.0)
+            logger.warning(f"Límite de tasa del proveedor; reintento {attempt} en {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def retry_policy():
+    """RetryPolicy de LangGraph para nodos que llaman a modelos."""
+    from langgraph.types import RetryPolicy
+
+    return RetryPolicy(
+        retry_on=is_rate_limit,
+        max_attempts=RATE_LIMIT_RETRIES,
+        initial_interval=BACKOFF_BASE,
+        backoff_factor=2.0,
+        max_interval=BACKOFF_MAX,
+        jitter=True,
+    )
+
+
+# -----------------------------
+# Callback
+# -----------------------------
+
+
+def _message_chars(messages) -> int:
+    total = 0
+    for batch in messages:
+        for m in batch:
+            content = getattr(m, "content", "")
+            total += len(content) if isinstance(content, str) else len(str(content))
+    return total
+
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    """Reserva presupuesto antes de cada llamada a un chat model y la corrige al terminar."""
+
+    def __init__(self) -> None:
+        self._runs: Dict[UUID, Tuple[str, int]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = (
+            (metadata or {}).get("ls_model_name")
+            or params.get("model")
+            or params.get("model_name")
+            or "desconocido"
+        )
+        output = params.get("max_tokens") or params.get("max_completion_tokens") or OUTPUT_TOKENS_ESTIMATE
+        estimated = admit(model, _message_chars(messages) // 4 + output)
+        self._runs[run_id] = (model, estimated)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        model, estimated = self._runs.pop(run_id, (None, 0))
+        limiter = limiter_for(model) if estimated else None
+        if limiter is None:
+            return
+        actual = 0
+        for gens in response.generations:
+            for gen in gens:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                if usage:
+                    actual += usage.get("total_tokens", 0)
+        if actual:
+            limiter.settle(estimated, actual)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        model, estimated = self._runs.pop(run_id, (None, 0))
+        if model is None:
+            return
+        limited = is_rate_limit(error)
+        if limited:
+            RATE_LIMITED.inc(model=model)
+        limiter = limiter_for(model)
+        if limiter is None:
+            return
+        if limited:
+            limiter.pause(retry_after(error) or BACKOFF_BASE)
+        # La llamada fallida no consumió su estimación
+        if estimated:
+            limiter.settle(estimated, 0)
+
+
+_handler_var: ContextVar[Optional[RateLimitCallbackHandler]] = ContextVar(
+    "gemis_rate_limit_handler",
+    default=RateLimitCallbackHandler() if SCHEDULER_ENABLED else None,
+)
+register_configure_hook(_handler_var, inheritable=True)
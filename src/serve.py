@@ -0,0 +1,240 @@
+# Despliegue multi-proceso.
+# Levanta un servidor de Chroma local (o usa CHROMA_SERVER_HOST si ya existe),
+# N procesos de la app (src/main.py, cada uno con sus propias conexiones SQLite y
+# cliente de Chroma) en puertos consecutivos, y un balanceador HTTP en --port.
+# El balanceador es afín por sesión de Gradio: las llamadas con el mismo
+# session_hash (cola, heartbeat) o upload_id van siempre al mismo worker; el
+# resto se reparte en round-robin. Un worker que termina se vuelve a lanzar.
+#
+#   uv run python src/serve.py --workers 4 --port 7860
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SRC_DIR = Path(__file__).resolve().parent
+
+# Cabeceras que no se reenvían (hop-by-hop o recalculadas)
+_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "upgrade",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "host",
+    "content-length",
+}
+_SESSION_IN_PATH = re.compile(r"/heartbeat/([^/?]+)")
+
+
+def start_chroma_server(path: str, host: str, port: int) -> subprocess.Popen:
+    """Lanza `chroma run` sobre `path` y espera a que responda."""
+    exe = shutil.which("chroma")
+    if exe is None:
+        raise RuntimeError("No se encontró el ejecutable 'chroma' (paquete chromadb)")
+    proc = subprocess.Popen(
+        [exe, "run", "--path", path, "--host", host, "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+    )
+    wait_chroma(host, port)
+    return proc
+
+
+def wait_chroma(host: str, port: int, timeout: float = 60) -> None:
+    import chromadb
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            chromadb.HttpClient(host=host, port=port).heartbeat()
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def wait_http(url: str, timeout: float = 120) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            httpx.get(url, timeout=2)
+            return
+        except httpx.HTTPError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+class WorkerPool:
+    """Procesos de la app; relanza los que terminan mientras el pool está activo."""
+
+    def __init__(self, n: int, base_port: int, env: Dict[str, str]):
+        self.ports = [base_port + i for i in range(n)]
+        self.env = env
+        self.procs: List[Optional[subprocess.Popen]] = [None] * n
+        self._stopping = threading.Event()
+
+    @property
+    def backends(self) -> List[str]:
+        return [f"http://127.0.0.1:{p}" for p in self.ports]
+
+    def _spawn(self, i: int) -> subprocess.Popen:
+        env = {
+            **self.env,
+            "WORKER_INDEX": str(i),
+            "WORKER_COUNT": str(len(self.ports)),
+            "GRADIO_SERVER_NAME": "127.0.0.1",
+            "GRADIO_SERVER_PORT": str(self.ports[i]),
+        }
+        return subprocess.Popen([sys.executable, str(SRC_DIR / "main.py")], env=env)
+
+    def start(self) -> None:
+        for i in range(len(self.ports)):
+            self.procs[i] = self._spawn(i)
+        for url in self.backends:
+            wait_http(url)
+        threading.Thread(target=self._watch, name="worker-watch", daemon=True).start()
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(2):
+            for i, proc in enumerate(self.procs):
+                if proc is not None and proc.poll() is not None:
+                    logger.warning(f"Worker {i} terminó ({proc.returncode}); relanzando")
+                    self.procs[i] = self._spawn(i)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for proc in self.procs:
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+        for proc in self.procs:
+            if proc is not None:
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+
+def _affinity_key(request, body: bytes) -> Optional[str]:
+    params = request.query_params
+    key = params.get("session_hash") or params.get("upload_id")
+    if key:
+        return key
+    m = _SESSION_IN_PATH.search(request.url.path)
+    if m:
+        return m.group(1)
+    if body and request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if isinstance(data, dict) and data.get("session_hash"):
+            return str(data["session_hash"])
+    return None
+
+
+def build_balancer(backends: List[str]):
+    """App ASGI que reenvía a los workers con afinidad por sesión."""
+    import httpx
+    from starlette.applications import Starlette
+    from starlette.background import BackgroundTask
+    from starlette.responses import StreamingResponse
+    from starlette.routing import Route
+
+    client = httpx.AsyncClient(timeout=None)
+    round_robin = itertools.cycle(range(len(backends)))
+
+    async def proxy(request):
+        body = await request.body()
+        key = _affinity_key(request, body)
+        idx = zlib.crc32(key.encode()) % len(backends) if key else next(round_robin)
+        url = backends[idx] + request.url.path
+        if request.url.query:
+            url += "?" + request.url.query
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS]
+        if request.client is not None:
+            # IP original para el límite de intentos de login (auth.py)
+            forwarded = request.headers.get("x-forwarded-for")
+            ip = request.client.host
+            headers = [(k, v) for k, v in headers if k.lower() != "x-forwarded-for"]
+            headers.append(("x-forwarded-for", f"{forwarded}, {ip}" if forwarded else ip))
+        upstream = await client.send(
+            client.build_request(request.method, url, headers=headers, content=body),
+            stream=True,
+        )
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers={k: v for k, v in upstream.headers.items() if k.lower() not in _HOP_HEADERS},
+            background=BackgroundTask(upstream.aclose),
+        )
+
+    methods = ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"]
+    return Starlette(
+        routes=[Route("/{path:path}", proxy, methods=methods)],
+        on_shutdown=[client.aclose],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="App con varios workers detrás de un balanceador")
+    parser.add_argument("--workers", type=int, default=max(2, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--worker-base-port", type=int, default=7900)
+    parser.add_argument("--chroma-port", type=int, default=8000)
+    parser.add_argument("--chroma-path", default=os.getenv("CHROMA_PERSIST_DIR", "./chroma_multi"))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    import uvicorn
+
+    from db import init_db
+
+    # El esquema se crea/migra una vez, antes de que arranquen los workers
+    init_db()
+    env = dict(os.environ)
+    chroma = None
+    if not env.get("CHROMA_SERVER_HOST"):
+        chroma = start_chroma_server(args.chroma_path, "127.0.0.1", args.chroma_port)
+        env["CHROMA_SERVER_HOST"] = "127.0.0.1"
+        env["CHROMA_SERVER_PORT"] = str(args.chroma_port)
+
+    pool = WorkerPool(args.workers, args.worker_base_port, env)
+
+    def shutdown(*_):
+        pool.stop()
+        if chroma is not None:
+            chroma.terminate()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    try:
+        pool.start()
+        logger.info(f"{args.workers} workers listos: {', '.join(pool.backends)}")
+        uvicorn.run(build_balancer(pool.backends), host=args.host, port=args.port)
+    finally:
+        shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Sesiones firmadas y caché de estado por usuario.
+# Al iniciar sesión el navegador guarda (gr.BrowserState) un token
+# `<payload>.<firma>`: el payload lleva user_id, username y vencimiento, y la
+# firma es HMAC-SHA256 con SESSION_SECRET, así que no se puede editar sin
+# invalidarlo. Al recargar la página se verifica la firma y se usa el user_id
+# del token, sin buscar al usuario por nombre.
+# La caché guarda por usuario la lista de chats y el último hilo abierto. Cada
+# entrada lleva la "versión" de sus chats en app.db (cantidad y último
+# updated_at, una consulta sobre el índice): si otro worker creó, borró o
+# renombró un chat, la entrada se descarta y se rearma.
+#
+# El secreto sale de SESSION_SECRET o, si no está, de SESSION_SECRET_PATH (se
+# crea la primera vez), compartido por todos los workers de serve.py.
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from metrics import CACHE_HITS, CACHE_MISSES, SESSIONS_REJECTED
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+SESSION_SECRET_PATH = Path(os.getenv("SESSION_SECRET_PATH", ".session_secret"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+
+
+def _load_secret() -> str:
+    secret = os.getenv("SESSION_SECRET")
+    if secret:
+        return secret
+    try:
+        return SESSION_SECRET_PATH.read_text().strip()
+    except FileNotFoundError:
+        pass
+    # Se escribe aparte y se enlaza: si dos workers arrancan a la vez, gana uno
+    # y el otro lee el mismo archivo completo
+    SESSION_SECRET_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = SESSION_SECRET_PATH.with_name(f"{SESSION_SECRET_PATH.name}.{os.getpid()}.tmp")
+    tmp.write_text(secrets.token_hex(32))
+    tmp.chmod(0o600)
+    try:
+        os.link(tmp, SESSION_SECRET_PATH)
+    except FileExistsError:
+        pass
+    finally:
+        tmp.unlink()
+    return SESSION_SECRET_PATH.read_text().strip()
+
+
+SESSION_SECRET = _load_secret()
+_KEY = SESSION_SECRET.encode("utf-8")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(body: str) -> str:
+    return _b64(hmac.new(_KEY, body.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue(user_id: int, username: str, ttl: float = SESSION_TTL) -> str:
+    """Token firmado con user_id, username y vencimiento."""
+    payload = {"uid": int(user_id), "usr": username, "exp": int(time.time() + ttl)}
+    body = _b64(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    return f"{body}.{_sign(body)}"
+
+
+def load(token: Any) -> Optional[Dict[str, Any]]:
+    """Payload del token si la firma es válida y no venció; si no, None."""
+    if not isinstance(token, str) or token.count(".") != 1:
+        return None
+    body, signature = token.split(".")
+    if not hmac.compare_digest(signature, _sign(body)):
+        SESSIONS_REJECTED.inc(reason="signature")
+        return None
+    try:
+        claims = json.loads(_unb64(body))
+    except ValueError:
+        SESSIONS_REJECTED.inc(reason="payload")
+        return None
+    if claims.get("exp", 0) < time.time():
+        SESSIONS_REJECTED.inc(reason="expired")
+        return None
+    return claims
+
+
+class SessionCache:
+    """LRU por user_id: {"chats": [(título, thread_id)], "thread_id": ..., "version": ...}."""
+
+    def __init__(self, max_entries: int = SESSION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, version: Any) -> Optional[Dict[str, Any]]:
+        """Entrada del usuario si sigue en la `version` actual de sus chats."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry["version"] == version:
+                self._entries.move_to_end(user_id)
+                CACHE_HITS.inc(cache="session")
+                return entry
+        CACHE_MISSES.inc(cache="session")
+        return None
+
+    def last_thread(self, user_id: int) -> Optional[str]:
+        """Último hilo abierto, aunque la lista de chats haya cambiado."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return entry["thread_id"] if entry else None
+
+    def put(self, user_id: int, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_thread(self, user_id: int, thread_id: str) -> None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry["thread_id"] = thread_id
+
+    def drop(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+cache = SessionCache()
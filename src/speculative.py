@@ -0,0 +1,128 @@
+# Recuperación especulativa (opcional: SPECULATIVE_RETRIEVAL=1).
+# En hilos con documentos, generate_query_or_respond lanza la búsqueda con la
+# pregunta tal cual mientras el modelo decide si llamar a retriever_tool. Si la
+# tool se llama con una consulta equivalente (mismas palabras significativas,
+# con solapamiento >= SPECULATIVE_MIN_OVERLAP) usa el resultado adelantado; si
+# no, se descarta. Aciertos, fallos y segundos ahorrados van a /metrics y a stats().
+
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Callable, Dict, Optional, Set
+
+from metrics import SPECULATIVE, SPECULATIVE_SAVED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "0") == "1"
+SPECULATIVE_MIN_OVERLAP = float(os.getenv("SPECULATIVE_MIN_OVERLAP", "0.6"))
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "4"))
+
+# Palabras que no cambian la búsqueda
+_STOPWORDS = set(
+    "a al como con cual cuales de del el en es la las lo los me mi por que qué se sobre su "
+    "un una y o the of a an and in on to what which is are".split()
+)
+
+_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+
+
+class _Prefetch:
+    def __init__(self, query: str, k: int, future: Future):
+        self.query = query
+        self.k = k
+        self.future = future
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+
+_pending: Dict[str, _Prefetch] = {}
+_lock = threading.Lock()
+_stats = {"hit": 0, "miss_query": 0, "miss_no_tool": 0, "error": 0, "saved_s": 0.0}
+
+
+def _terms(text: str) -> Set[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return {w for w in re.findall(r"\w+", text) if w not in _STOPWORDS}
+
+
+def equivalent(a: str, b: str, min_overlap: float = SPECULATIVE_MIN_OVERLAP) -> bool:
+    """Consultas equivalentes: Jaccard de sus palabras significativas."""
+    ta, tb = _terms(a), _terms(b)
+    if not ta or not tb:
+        return a.strip().lower() == b.strip().lower()
+    return len(ta & tb) / len(ta | tb) >= min_overlap
+
+
+def _record(outcome: str, saved: float = 0.0) -> None:
+    SPECULATIVE.inc(outcome=outcome)
+    with _lock:
+        _stats[outcome] += 1
+        _stats["saved_s"] += saved
+    if saved:
+        SPECULATIVE_SAVED_SECONDS.observe(saved)
+
+
+def start(thread_id: str, query: str, k: int, search: Callable[[str], Any]) -> None:
+    """Lanza `search(query)` en segundo plano para el turno actual del hilo."""
+    ctx = copy_context()
+    future = _executor.submit(ctx.run, search, query)
+    prefetch = _Prefetch(query, k, future)
+    future.add_done_callback(lambda _: setattr(prefetch, "finished", time.perf_counter()))
+    with _lock:
+        previous = _pending.pop(thread_id, None)
+        _pending[thread_id] = prefetch
+    if previous is not None:
+        previous.future.cancel()
+        _record("miss_no_tool")
+
+
+def discard(thread_id: str) -> None:
+    """El modelo respondió sin buscar: se descarta el resultado adelantado."""
+    with _lock:
+        prefetch = _pending.pop(thread_id, None)
+    if prefetch is not None:
+        prefetch.future.cancel()
+        _record("miss_no_tool")
+
+
+def claim(thread_id: str, query: str, k: int) -> Optional[Any]:
+    """Resultado adelantado si la consulta de la tool es equivalente; si no, None."""
+    with _lock:
+        prefetch = _pending.pop(thread_id, None)
+    if prefetch is None:
+        return None
+    if k != prefetch.k or not equivalent(query, prefetch.query):
+        prefetch.future.cancel()
+        _record("miss_query")
+        return None
+    t_claim = time.perf_counter()
+    try:
+        result = prefetch.future.result()
+    except Exception as e:
+        logger.warning(f"Falló la recuperación especulativa: {e}")
+        _record("error")
+        return None
+    # Ahorro: la parte de la búsqueda que ya había corrido al momento de pedirla
+    finished = prefetch.finished or time.perf_counter()
+    saved = min(finished, t_claim) - prefetch.started
+    _record("hit", saved)
+    logger.info(f"Recuperación especulativa: acierto, {saved * 1000:.0f} ms ahorrados")
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    """Totales del proceso: aciertos, fallos, tasa de acierto y ahorro medio por acierto."""
+    with _lock:
+        s = dict(_stats)
+    attempts = s["hit"] + s["miss_query"] + s["miss_no_tool"] + s["error"]
+    s["attempts"] = attempts
+    s["hit_rate"] = s["hit"] / attempts if attempts else 0.0
+    s["saved_ms_per_hit"] = s["saved_s"] * 1000 / s["hit"] if s["hit"] else 0.0
+    return s
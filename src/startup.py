@@ -0,0 +1,129 @@
+# Inicialización diferida de recursos pesados.
+# Embeddings, chat models, Chroma, docstore, bases SQLite y el grafo compilado
+# se declaran con @component y se construyen la primera vez que se piden (una
+# sola vez aunque lleguen requests concurrentes). warm_up() los construye todos,
+# en orden de registro, y main.py lo corre en segundo plano cuando el servidor
+# ya está escuchando. Con --profile-startup se reporta el tiempo de import por
+# paquete y el de inicialización de cada componente.
+#
+#   uv run python src/main.py --profile-startup
+
+import logging
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_COMPONENTS: Dict[str, "Lazy"] = {}
+
+
+class Lazy(Generic[T]):
+    """Singleton construido al primer uso; guarda cuánto tardó."""
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self.factory = factory
+        self.seconds: Optional[float] = None
+        self._value: Optional[T] = None
+        self._ready = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def __call__(self) -> T:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                t0 = time.perf_counter()
+                self._value = self.factory()
+                self.seconds = time.perf_counter() - t0
+                self._ready = True
+                logger.info(f"Componente {self.name} inicializado en {self.seconds:.2f}s")
+        return self._value
+
+
+def component(name: str) -> Callable[[Callable[[], T]], Lazy[T]]:
+    """Decorador: registra la función como fábrica de un componente diferido."""
+
+    def decorator(factory: Callable[[], T]) -> Lazy[T]:
+        lazy = Lazy(name, factory)
+        _COMPONENTS[name] = lazy
+        return lazy
+
+    return decorator
+
+
+def warm_up(names: Optional[List[str]] = None) -> Dict[str, Optional[float]]:
+    """Construye los componentes (todos por defecto). Devuelve segundos por componente."""
+    for name in names or list(_COMPONENTS):
+        try:
+            _COMPONENTS[name]()
+        except Exception as e:
+            # Se reintenta cuando un request lo pida
+            logger.error(f"Falló la inicialización de {name}: {e}")
+    return {name: c.seconds for name, c in _COMPONENTS.items()}
+
+
+def warm_up_in_background() -> threading.Thread:
+    t = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    t.start()
+    return t
+
+
+# -----------------------------
+# --profile-startup
+# -----------------------------
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Importa `module` en un intérprete nuevo con -X importtime. Devuelve el total
+    y los segundos propios acumulados por paquete de primer nivel.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=Path(__file__).parent,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    by_package: Dict[str, float] = defaultdict(float)
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if not m:
+            continue
+        self_us, cumulative_us, _, name = m.groups()
+        by_package[name.split(".")[0]] += int(self_us) / 1e6
+        if name == module:
+            total = int(cumulative_us) / 1e6
+    return total, sorted(by_package.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def profile_startup(module: str = "main", top: int = 15) -> None:
+    total, packages = import_times(module)
+    print(f"Import de {module}: {total:.2f}s (proceso nuevo)")
+    print(f"{'paquete':<32} {'segundos':>9}")
+    for name, seconds in packages[:top]:
+        print(f"{name:<32} {seconds:>9.3f}")
+
+    t0 = time.perf_counter()
+    timings = warm_up()
+    print(f"\nInicialización de componentes: {time.perf_counter() - t0:.2f}s")
+    print(f"{'componente':<32} {'segundos':>9}")
+    for name, seconds in timings.items():
+        print(f"{name:<32} {seconds if seconds is not None else float('nan'):>9.3f}")
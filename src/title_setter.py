@@ -1,11 +1,14 @@
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 from dotenv import load_dotenv
+from resilient import invoke_model
+from routing import chat_model
+from metrics import TITLE_SECONDS, timed
+from usage import usage_scope
 
 load_dotenv()
-_title_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2)
 
 
+@timed(TITLE_SECONDS)
 def _generate_title_openai(user_text: str, max_len: int = 60, lang: str = "es") -> str:
     """
     Pide a OpenAI un título corto estilo ChatGPT (4-6 palabras, sin comillas).
@@ -18,17 +21,20 @@ def _generate_title_openai(user_text: str, max_len: int = 60, lang: str = "es")
         "Usa 4-6 palabras, en mayúsculas/minúsculas naturales, y en el mismo idioma del usuario."
     )
     try:
-        resp = _title_llm.invoke(
-            [
-                SystemMessage(content=prompt_sys),
-                HumanMessage(
-                    content=(
-                        f"Genera un título breve (máx {max_len} caracteres) para este primer mensaje. "
-                        f"Idioma: {lang}. Texto:\n\n{user_text}"
-                    )
-                ),
-            ]
-        )
+        with usage_scope(node="title"):
+            resp = invoke_model(
+                "title",
+                chat_model("title"),
+                [
+                    SystemMessage(content=prompt_sys),
+                    HumanMessage(
+                        content=(
+                            f"Genera un título breve (máx {max_len} caracteres) para este primer mensaje. "
+                            f"Idioma: {lang}. Texto:\n\n{user_text}"
+                        )
+                    ),
+                ],
+            )
         title = (resp.content or "").strip()
         # limpiar comillas accidentales y truncar
         title = title.strip("“”\"'").strip()
@@ -0,0 +1,321 @@
+# Contabilidad de tokens y costo por usuario, hilo, nodo y modelo.
+# Un callback de LangChain instalado globalmente toma usage_metadata de cada
+# llamada a chat models; los embeddings se cuentan con un envoltorio que estima
+# tokens por caracteres. Los consumos se agregan en memoria y un hilo los vuelca
+# cada USAGE_FLUSH_INTERVAL segundos (o al juntar USAGE_FLUSH_ROWS filas) en la
+# tabla `usage` de app.db, con un UPSERT por clave (día, usuario, hilo, nodo, modelo).
+# El costo se calcula al reportar con la tabla PRICES (USD por millón de tokens).
+#
+#   uv run python src/usage.py report --days 30 --top 10
+
+import argparse
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.tracers.context import register_configure_hook
+
+import db
+from scheduler import admit, with_backoff
+
+logger = logging.getLogger(__name__)
+
+USAGE_ENABLED = os.getenv("USAGE_ENABLED", "1") == "1"
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+USAGE_FLUSH_ROWS = int(os.getenv("USAGE_FLUSH_ROWS", "200"))
+
+# USD por millón de tokens (entrada, salida). USAGE_PRICES (JSON) pisa o agrega modelos.
+PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-3-large": (0.13, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-ada-002": (0.10, 0.0),
+}
+PRICES.update({k: tuple(v) for k, v in json.loads(os.getenv("USAGE_PRICES", "{}")).items()})
+
+# Nodo con el que se cuentan las preguntas respondidas (calls = turnos)
+TURN_NODE = "__turn__"
+
+_Key = Tuple[str, int, str, str, str]
+
+_scope: ContextVar[Dict[str, Any]] = ContextVar("gemis_usage_scope", default={})
+
+
+@contextmanager
+def usage_scope(**attrs: Any) -> Iterator[None]:
+    """Atribuye el consumo del bloque (user_id, thread_id, node) cuando el callback no lo trae."""
+    token = _scope.set({**_scope.get(), **{k: v for k, v in attrs.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+class UsageRecorder:
+    """Acumula consumos en memoria y los vuelca por lotes en app.db."""
+
+    def __init__(self, interval: float = USAGE_FLUSH_INTERVAL, max_rows: int = USAGE_FLUSH_ROWS):
+        self.interval = interval
+        self.max_rows = max_rows
+        self._pending: Dict[_Key, List[int]] = defaultdict(lambda: [0, 0, 0])
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(
+        self,
+        model: str,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        calls: int = 1,
+        user_id: Optional[int] = None,
+        thread_id: Optional[str] = None,
+        node: Optional[str] = None,
+    ) -> None:
+        scope = _scope.get()
+        key = (
+            date.today().isoformat(),
+            int(user_id if user_id is not None else scope.get("user_id", 0)),
+            str(thread_id if thread_id is not None else scope.get("thread_id", "")),
+            node or scope.get("node", "-"),
+            model,
+        )
+        with self._lock:
+            acc = self._pending[key]
+            acc[0] += calls
+            acc[1] += input_tokens
+            acc[2] += output_tokens
+            full = len(self._pending) >= self.max_rows
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="usage-flusher", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Escribe lo pendiente; devuelve la cantidad de filas. Si falla, reintenta en el próximo ciclo."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0])
+        if not pending:
+            return 0
+        rows = [
+            {
+                "day": day,
+                "user_id": uid,
+                "thread_id": tid,
+                "node": node,
+                "model": model,
+                "calls": calls,
+                "input_tokens": tin,
+                "output_tokens": tout,
+            }
+            for (day, uid, tid, node, model), (calls, tin, tout) in pending.items()
+        ]
+        try:
+            db.add_usage(rows)
+        except Exception as e:
+            logger.error(f"No se pudo guardar el consumo de tokens: {e}")
+            with self._lock:
+                for key, (calls, tin, tout) in pending.items():
+                    acc = self._pending[key]
+                    acc[0] += calls
+                    acc[1] += tin
+                    acc[2] += tout
+            return 0
+        return len(rows)
+
+    def _loop(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+recorder = UsageRecorder()
+atexit.register(recorder.flush)
+
+
+def record_turn(user_id: int, thread_id: str) -> None:
+    """Cuenta una pregunta respondida (para tokens por pregunta)."""
+    recorder.record("-", user_id=user_id, thread_id=thread_id, node=TURN_NODE)
+
+
+def _as_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Registra usage_metadata de cada llamada a chat models con su atribución."""
+
+    def __init__(self) -> None:
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        params = kwargs.get("invocation_params") or {}
+        self._runs[run_id] = {
+            "model": metadata.get("ls_model_name")
+            or params.get("model")
+            or params.get("model_name")
+            or "desconocido",
+            "node": metadata.get("langgraph_node"),
+            "user_id": _as_int(metadata.get("user_id")),
+            "thread_id": metadata.get("thread_id"),
+        }
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        tokens_in = tokens_out = 0
+        for gens in response.generations:
+            for gen in gens:
+                usage = getattr(getattr(gen, "message", None), "usage_metadata", None)
+                if usage:
+                    tokens_in += usage.get("input_tokens", 0)
+                    tokens_out += usage.get("output_tokens", 0)
+        if not (tokens_in or tokens_out):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            tokens_in = usage.get("prompt_tokens", 0)
+            tokens_out = usage.get("completion_tokens", 0)
+        recorder.record(run.pop("model"), tokens_in, tokens_out, **run)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+_handler_var: ContextVar[Optional[UsageCallbackHandler]] = ContextVar(
+    "gemis_usage_handler",
+    default=UsageCallbackHandler() if USAGE_ENABLED else None,
+)
+register_configure_hook(_handler_var, inheritable=True)
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 caracteres por token; la API de embeddings no informa usage vía LangChain
+    return len(text) // 4 + 1
+
+
+class TrackedEmbeddings(Embeddings):
+    """
+    Envoltorio que cuenta tokens (estimados) de un modelo de embeddings y pasa
+    por los límites del proveedor de scheduler.py (reserva y reintento ante 429).
+    """
+
+    def __init__(self, inner: Embeddings, model: Optional[str] = None):
+        self.inner = inner
+        self.model = model or getattr(inner, "model", None) or type(inner).__name__
+
+    def _admit(self, texts: List[str]) -> None:
+        tokens = sum(_estimate_tokens(t) for t in texts)
+        admit(self.model, tokens)
+        if USAGE_ENABLED:
+            recorder.record(self.model, tokens, 0, calls=1, node=_scope.get().get("node", "embed"))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._admit(texts)
+        return with_backoff(self.inner.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self._admit([text])
+        return with_backoff(self.inner.embed_query, text)
+
+
+# -----------------------------
+# Reporte
+# -----------------------------
+
+
+def cost_usd(model: str, input_tokens: int, output_tokens: int) -> float:
+    price_in, price_out = PRICES.get(model, (0.0, 0.0))
+    return (input_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+
+def summarize(group: str, days: int) -> List[Dict[str, Any]]:
+    """Consumo agrupado ('user', 'thread' o 'node') con costo, ordenado por costo."""
+    since = (date.today() - timedelta(days=days - 1)).isoformat()
+    keys = {"user": ("user_id",), "thread": ("user_id", "thread_id"), "node": ("node",)}[group]
+    out: Dict[Tuple, Dict[str, Any]] = {}
+    for r in db.usage_by(group, since):
+        k = tuple(r[c] for c in keys)
+        agg = out.setdefault(
+            k,
+            {
+                **{c: r[c] for c in keys},
+                "username": r["username"],
+                "title": r["title"],
+                "questions": 0,
+                "calls": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cost_usd": 0.0,
+            },
+        )
+        if r["model"] == "-":
+            agg["questions"] += r["calls"]
+            continue
+        agg["calls"] += r["calls"]
+        agg["input_tokens"] += r["input_tokens"]
+        agg["output_tokens"] += r["output_tokens"]
+        agg["cost_usd"] += cost_usd(r["model"], r["input_tokens"], r["output_tokens"])
+    return sorted(out.values(), key=lambda a: a["cost_usd"], reverse=True)
+
+
+def print_report(days: int, top: int) -> None:
+    users = summarize("user", days)
+    threads = summarize("thread", days)
+    nodes = [n for n in summarize("node", days) if n["node"] != TURN_NODE]
+    questions = sum(u["questions"] for u in users)
+    tokens = sum(u["input_tokens"] + u["output_tokens"] for u in users)
+    cost = sum(u["cost_usd"] for u in users)
+
+    print(f"Últimos {days} días: {questions} preguntas respondidas, {tokens} tokens, US$ {cost:.4f}")
+    if questions:
+        print(f"Por pregunta: {tokens / questions:.0f} tokens, US$ {cost / questions:.5f}")
+
+    print(f"\nUsuarios con más costo:\n{'usuario':<20} {'preg.':>6} {'tokens in':>11} {'tokens out':>11} {'USD':>10}")
+    for u in users[:top]:
+        name = u["username"] or f"#{u['user_id']}"
+        print(
+            f"{name:<20} {u['questions']:>6} {u['input_tokens']:>11} "
+            f"{u['output_tokens']:>11} {u['cost_usd']:>10.4f}"
+        )
+
+    print(f"\nHilos más caros:\n{'usuario':<20} {'chat':<32} {'preg.':>6} {'tok/preg':>9} {'USD':>10}")
+    for t in threads[:top]:
+        name = t["username"] or f"#{t['user_id']}"
+        title = (t["title"] or t["thread_id"] or "-")[:32]
+        per_q = (t["input_tokens"] + t["output_tokens"]) / t["questions"] if t["questions"] else 0
+        print(f"{name:<20} {title:<32} {t['questions']:>6} {per_q:>9.0f} {t['cost_usd']:>10.4f}")
+
+    print(f"\nPor nodo:\n{'nodo':<28} {'llamadas':>9} {'tok/preg':>9} {'USD':>10}")
+    for n in nodes:
+        per_q = (n["input_tokens"] + n["output_tokens"]) / questions if questions else 0
+        print(f"{n['node']:<28} {n['calls']:>9} {per_q:>9.0f} {n['cost_usd']:>10.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consumo de tokens y costo")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_report = sub.add_parser("report", help="Usuarios, hilos y nodos con más consumo")
+    p_report.add_argument("--days", type=int, default=30)
+    p_report.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.cmd == "report":
+        print_report(args.days, args.top)